@@ -6,17 +6,57 @@ aggregate the daily CSV file from "RTE éCO2mix"
 into a large one homogenous file
 
 Pierre Haessig — February 2012
+
+Updates:
+* October 2026: both file formats ("éCO2mix v1" and "v2") are aggregated,
+  their labels being mapped on one set of columns (see `label_mapping`)
+* October 2026: opt-in timing of the aggregation (see RTE_eCO2mix_profile.py)
+* October 2026: the daily files are parsed into typed blocks (int32 values,
+  and flags of the unavailable data), the CSV file being one serialization
+  of these blocks (`csv_lines`)
+* October 2026: export of the store as a year-partitioned Parquet
+  or Arrow dataset (see RTE_eCO2mix_arrow.py)
+* October 2026: the daily files can be read from their yearly archive
+  (see RTE_eCO2mix_archive.py)
 """
 from __future__ import print_function
 
-import os.path, codecs
+import os.path, codecs, warnings
 import datetime as dt
-from RTE_eCO2mix_download import day_range
+from itertools import takewhile
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+import numpy as np
+from RTE_eCO2mix_download import day_range, data_url, get_daily_data, \
+                                 ConnectionPool, RateLimiter, data_status
+from RTE_eCO2mix_analyze import update_schema_index
+import RTE_eCO2mix_store as st
+import RTE_eCO2mix_time as tm
+from RTE_eCO2mix_quality import update_flags, MISSING, ND
+from RTE_eCO2mix_store import write_store
+from RTE_eCO2mix_rollup import write_rollup
+from RTE_eCO2mix_arrow import export_dataset, dataset_formats
+import RTE_eCO2mix_profile as prof
+import RTE_eCO2mix_archive as archive
 # How to order the columns in the aggregated file:
 reordered_header = [u'Consommation', u'PrévisionJ-1', u'PrévisionJ',
                     u'Nucléaire', u'Gaz', u'Charbon', u'Fioul + pointe',
                     u'Hydraulique', u'Eolien',  u'Autres',
-                    u'Solde',  u'Co2']
+                    u'Solde',  u'Co2',
+                    # "éCO2mix v2" only:
+                    u'Solaire', u'Pompage', u'Taux de Co2',
+                    u'Ech. comm. Allemagne', u'Ech. comm. Angleterre',
+                    u'Ech. comm. Belgique', u'Ech. comm. Espagne',
+                    u'Ech. comm. Italie', u'Ech. comm. Suisse']
+
+# Mapping of the "éCO2mix v2" labels to the aggregated columns
+# (other labels are the same in both formats).
+# Note: "Co2" (v1, CO2 emissions) and "Taux de Co2" (v2, in g/kWh)
+# are different quantities.
+label_mapping = {u'Prévision J-1': u'PrévisionJ-1',
+                 u'Prévision J': u'PrévisionJ',
+                 u'Fioul': u'Fioul + pointe',
+                 u'Ech. physiques': u'Solde'}
 
 
 # Where are the data files:
@@ -30,6 +70,250 @@ stop_day = dt.date.today() # stop excluded from range
 aggregated_filename = 'RTE_eCO2mix_%s_%s.csv' % \
                        (start_day.isoformat(),
                        (stop_day - dt.timedelta(1)).isoformat())
+# Columnar binary store (see RTE_eCO2mix_store.py), much faster to load:
+aggregated_store = os.path.splitext(aggregated_filename)[0] + '.store'
+
+# Year-partitioned dataset (see RTE_eCO2mix_arrow.py), exported from the store
+# (with the quality flags), for the Parquet/Arrow tools (needs pyarrow):
+aggregated_dataset = os.path.splitext(aggregated_filename)[0] + '.%s'
+
+# Which outputs to write ('csv', 'store', 'parquet' and/or 'arrow',
+# the store being also written for a 'parquet' or 'arrow' dataset)
+output_formats = ['csv', 'store']
+
+# Parallel aggregation: number of worker processes
+# (None: one per CPU core, 1: serial aggregation)
+nb_processes = None
+# and size of the day range chunks given to each worker ('month' or 'year')
+chunk_size = 'month'
+
+# Incremental aggregation: only the new or changed daily files are parsed
+# and written into the store `incremental_store` (see `update_store`)
+incremental = False
+incremental_store = 'RTE_eCO2mix.store'
+
+# Whether to compute the rollup cube of the store (hourly, daily, weekly,
+# monthly and yearly statistics, see RTE_eCO2mix_rollup.py)
+rollup = True
+
+def check_schema(start_day, stop_day, filename_pattern, reordered_header):
+    '''check that the daily files of the day range exist, are valid
+    and only contain labels of `reordered_header`, before aggregating them
+    
+    The check uses the schema index of the data directory
+    (see RTE_eCO2mix_analyze.update_schema_index), so that only the new
+    or modified files are read.
+    Raises a ValueError for the first file which doesn't pass the check.
+    '''
+    schema_index = update_schema_index(os.path.dirname(filename_pattern))
+    headers = schema_index['headers']
+    known_labels = set(reordered_header) | set(label_mapping) | \
+                   set([u'Heures', u''])
+    for day in day_range(start_day, stop_day):
+        datafilename = filename_pattern % day.isoformat()
+        entry = schema_index['files'].get(os.path.basename(datafilename))
+        if entry is None:
+            raise ValueError('data file not found for day %s (filename: %s)' %\
+                              (day.isoformat(), datafilename))
+        if 'header' not in entry:
+            raise ValueError('data file for day %s is not valid (filename: %s)' %\
+                             (day.isoformat(), datafilename))
+        unknown_labels = set(headers[entry['header']].split('\t')) - known_labels
+        if unknown_labels:
+            raise ValueError('unknown labels %s in data file for day %s (filename: %s)' %\
+                             (', '.join(sorted(unknown_labels)),
+                              day.isoformat(), datafilename))
+
+def column_mapping(header, reordered_header):
+    '''mapping of the columns of a daily file on `reordered_header`
+    (see `label_mapping`), ignoring the empty labels
+    
+    Returns
+    -------
+    source : list of int
+        indices of the mapped columns in the daily file `header`
+    target : list of int
+        indices of these columns in `reordered_header`
+    '''
+    source, target = [], []
+    for k, label in enumerate(header):
+        if not label:
+            continue
+        label = label_mapping.get(label, label)
+        if label not in reordered_header:
+            raise ValueError('label "%s" is not in the aggregated columns' %\
+                             label)
+        source.append(k)
+        target.append(reordered_header.index(label))
+    return source, target
+
+# Numbers which stand for the unavailable data in the parsed daily files
+# (outside of the range of the int32 values)
+_missing_number = -10**10 - 1
+_ND_number = -10**10 - 2
+
+def _parse_numbers(lines, nb_fields, NA_values=('', 'ND')):
+    '''parse the tab separated fields of the data `lines` as integers
+    (the time labels "HH:MM" being parsed as HHMM numbers)
+
+    The unavailable data (fields of `NA_values`) is replaced by marker numbers
+    with a few text replacements, and all the fields are parsed by
+    one `np.fromstring` call. A field-by-field parser is used as a fallback
+    (other markers of unavailable data, lines with a different number
+    of fields).
+
+    Returns
+    -------
+    numbers : (len(lines), nb_fields) int64 array (0 for unavailable data)
+    markers : (len(lines), nb_fields) uint8 array
+        quality flags of the unavailable data: MISSING, or ND for "ND" fields
+        (see RTE_eCO2mix_quality.py)
+    '''
+    text = u'\t'.join(lines)
+    numbers = None
+    if text.count(u'\t') == len(lines)*nb_fields - 1:
+        text = u'\t%s\t' % text
+        # (twice, for the consecutive fields)
+        for k in range(2):
+            text = text.replace(u'\t\t', u'\t%d\t' % _missing_number)
+        if u'ND' in NA_values:
+            for k in range(2):
+                text = text.replace(u'\tND\t', u'\t%d\t' % _ND_number)
+        # (a field which is not an integer stops the parsing, with a warning
+        # or an error depending on the numpy version)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            try:
+                numbers = np.fromstring(text[1:-1].replace(u':', u''),
+                                        dtype=np.int64, sep='\t')
+            except ValueError:
+                numbers = None
+        if numbers is not None and len(numbers) != len(lines)*nb_fields:
+            numbers = None
+    if numbers is None:
+        numbers = []
+        for line in lines:
+            fields = (line.replace(u':', u'', 1).split(u'\t') +
+                      [u'']*nb_fields)[:nb_fields]
+            for field in fields:
+                if field in NA_values:
+                    numbers.append(_ND_number if field == u'ND'
+                                   else _missing_number)
+                else:
+                    numbers.append(int(field))
+        numbers = np.array(numbers, dtype=np.int64)
+    numbers = numbers.reshape(len(lines), nb_fields)
+    markers = np.zeros(numbers.shape, dtype=st.flags_dtype)
+    markers[numbers == _missing_number] = MISSING
+    markers[numbers == _ND_number] = ND
+    numbers[markers != 0] = 0
+    return numbers, markers
+
+def parse_daily_file(dailyfile, day, datafilename='', NA_values=('', 'ND')):
+    '''parse the content of a daily éCO2mix data file into a typed block
+
+    Parameters
+    ----------
+    dailyfile : file-like object
+        the daily data, decoded as unicode text
+    day : datetime.date object
+        the day of the data
+    datafilename : str, optional
+        name of the file, for error messages
+    NA_values : tuple of str, optional
+        which symbols mark unavailable data [default to ('', 'ND')]
+
+    Returns
+    -------
+    header : list of str
+        the column labels (without the first label "Heures"),
+        as written in the file
+    values : (nb_rows, len(header)) int32 array
+        the data lines (15 minutes timestep), 0 for unavailable data.
+        nb_rows is 96, or 92 and 100 on the DST transition days
+        (see `RTE_eCO2mix_time.check_day_rows`)
+    markers : (nb_rows, len(header)) uint8 array
+        quality flags of the unavailable data (MISSING or ND, see
+        RTE_eCO2mix_quality.py), 0 for the valid data
+    '''
+    line1 = dailyfile.readline()
+    # Check validity of the first line:
+    if not line1.startswith(u'Journée du'):
+        raise ValueError('data file for day %s is not valid (filename: %s)' %\
+                         (day.isoformat(), datafilename))
+    # Read the file header (after the data status line of "éCO2mix v2"):
+    header = dailyfile.readline()
+    if header.strip() in data_status:
+        header = dailyfile.readline()
+    header = header.rstrip('\r\n').split('\t')[1:] # drop the first label "Heures"
+    # Read the data lines (starting with "HH:MM"):
+    lines = list(takewhile(lambda line: line[2:3] == ':',
+                           dailyfile.read().splitlines()))[:tm.autumn_rows]
+    try:
+        numbers, markers = _parse_numbers(lines, len(header)+1, NA_values)
+    except ValueError:
+        raise ValueError('data file for day %s has invalid values (filename: %s)' %\
+                         (day.isoformat(), datafilename))
+    # Check the number of lines, and the continuity of time:
+    try:
+        tm.check_day_rows(day, len(lines))
+        minutes = tm.day_minutes(len(lines))
+    except ValueError:
+        minutes = None
+    if minutes is None or markers[:,0].any() or \
+       not (numbers[:,0] == minutes//60*100 + minutes%60).all():
+        raise ValueError('data file for day %s has missing time steps (filename: %s)' %\
+                         (day.isoformat(), datafilename))
+    return header, numbers[:,1:].astype(np.int32), markers[:,1:]
+# end parse_daily_file()
+
+def read_daily_file(day, filename_pattern, NA_values=('', 'ND')):
+    '''read the content of the daily éCO2mix data file of `day`
+    (see `parse_daily_file`), or of its archived copy
+    (see RTE_eCO2mix_archive.py)
+    '''
+    datafilename = filename_pattern % day.isoformat()
+    if not archive.exists(datafilename):
+        raise ValueError('data file not found for day %s (filename: %s)' %\
+                          (day.isoformat(), datafilename))
+    # Open the daily file:
+    with archive.open_text(datafilename) as dailyfile:
+        return parse_daily_file(dailyfile, day, datafilename, NA_values)
+
+def csv_lines(day, values, valid, flags=None, NA='NA', colsep=','):
+    '''CSV serialization of the typed block of one day
+    (see `reordered_block`): one line per row, starting with the timestamp
+
+    Unavailable data is written `NA`, or "ND" for the data flagged
+    as ND in `flags` (as in the daily files).
+    The rows with the same unavailable columns are formatted with
+    one format string.
+
+    Returns
+    -------
+    lines : list of str
+    '''
+    timestamps = tm.format_timestamps(tm.day_timestamps(day, len(values)))
+    timestamps = timestamps.tolist()
+    markers = np.where(valid, 0, MISSING)
+    if flags is not None:
+        markers[~valid & (flags & ND != 0)] = ND
+    symbols = {MISSING: NA.replace('%', '%%'), ND: u'ND'}
+    # Patterns of unavailable columns, as one number per row (2 bits per column)
+    keys = (markers.astype(np.int64) << 2*np.arange(markers.shape[1])).sum(axis=1)
+    patterns, first, inverse = np.unique(keys, return_index=True,
+                                         return_inverse=True)
+    lines = [None]*len(values)
+    for k in range(len(patterns)):
+        pattern = markers[first[k]]
+        line_format = colsep.join([u'%s'] +
+                                  [symbols.get(marker, u'%d')
+                                   for marker in pattern.tolist()]) + u'\n'
+        rows = np.flatnonzero(inverse == k)
+        row_values = values[rows][:,pattern == 0].tolist()
+        for row, row_value in zip(rows.tolist(), row_values):
+            lines[row] = line_format % tuple([timestamps[row]] + row_value)
+    return lines
 
 def reordered_data_range(start_day, stop_day, 
                          filename_pattern, reordered_header,
@@ -37,6 +321,8 @@ def reordered_data_range(start_day, stop_day,
     '''generator of reordered data lines
     
     browse the daily éCO2mix data to yield reformatted lines data
+    (CSV serialization of the typed blocks of `reordered_day_range`,
+    see `csv_lines`)
     
     Parameters
     ----------
@@ -55,59 +341,370 @@ def reordered_data_range(start_day, stop_day,
         What symbol to separate data columns
         [default to ',']
     '''
-    # Build the header order Look-up Table:
-    nb_column = len(reordered_header)
-    order_lut = dict((label, i) 
-                     for (label, i)
-                     in zip(reordered_header,
-                            range(nb_column)) )
     # Yield the header:
     yield colsep.join([u'Timestamp']+reordered_header)+'\n'
+    # Serialize the daily blocks
+    # (the instrumented stage includes the time spent by the consumer)
+    with prof.stage('reordered_data_range') as record:
+        for day, values, valid, flags in reordered_day_range(start_day, stop_day,
+                filename_pattern, reordered_header, with_flags=True):
+            lines = csv_lines(day, values, valid, flags, NA, colsep)
+            record.add(rows=len(lines),
+                       bytes_written=sum(len(line) for line in lines))
+            for line in lines:
+                yield line
+
+def reordered_day_range(start_day, stop_day,
+                        filename_pattern, reordered_header,
+                        NA_values=('', 'ND'), with_flags=False):
+    '''generator of reordered daily data blocks (typed arrays)
+    
+    Parameters
+    ----------
+    start_day : datetime.date object
+        at which day to start yielding data
+    stop_day : datetime.date object
+        at which date to stop yielding data (excluded from range)
+    filename_pattern : str,
+        where are the data files, with a "%s" to insert the date stamp
+    reordered_header : list of str
+        what data order is requested
+    NA_values : tuple of str, optional
+        which symbols mark unavailable data in the daily files
+        [default to ('', 'ND')]
+    with_flags : bool, optional
+        whether to yield the quality flags of the unavailable data
+        (see `reordered_block`) [default to False]
+    
+    Yields
+    ------
+    (day, values, valid) tuples, with `values` a (nb_rows, nb_column) int32
+    array and `valid` a (nb_rows, nb_column) boolean array
+    (False for unavailable data), or (day, values, valid, flags) tuples
+    '''
     # Browse the daily data files:
+    with prof.stage('reordered_day_range') as record:
+        for day in day_range(start_day, stop_day):
+            header, values, markers = read_daily_file(day, filename_pattern,
+                                                      NA_values)
+            record.add(files=1, rows=len(values), bytes_read=archive.signature(
+                           filename_pattern % day.isoformat(), False)['size'])
+            yield (day,) + reordered_block(header, values, markers,
+                                           reordered_header, with_flags)
+
+def reordered_block(header, values, markers, reordered_header,
+                    with_flags=False):
+    '''typed block of one day (see `parse_daily_file`)
+    with columns reordered like `reordered_header`
+    
+    Returns
+    -------
+    values : (nb_rows, nb_column) int32 array
+    valid : (nb_rows, nb_column) boolean array (False for unavailable data)
+    flags : (nb_rows, nb_column) uint8 array, only if `with_flags` is True
+        MISSING or ND quality flags of the unavailable data
+        (see RTE_eCO2mix_quality.py)
+    '''
+    nb_column = len(reordered_header)
+    # Compute column reordering:
+    source, target = column_mapping(header, reordered_header)
+    reordered_values = np.zeros((len(values), nb_column), dtype=np.int32)
+    reordered_values[:,target] = values[:,source]
+    flags = np.empty((len(values), nb_column), dtype=st.flags_dtype)
+    flags.fill(MISSING)
+    flags[:,target] = markers[:,source]
+    valid = (flags == 0)
+    if not with_flags:
+        return reordered_values, valid
+    return reordered_values, valid, flags
+
+def downloaded_day_range(start_day, stop_day, reordered_header,
+                         url=data_url, nb_workers=4, max_rate=None,
+                         NA_values=('', 'ND'), with_flags=False):
+    '''generator of reordered daily data blocks (like `reordered_day_range`)
+    downloaded directly from RTE's website, without writing daily files
+    
+    Each zip archive is extracted in memory and its CSV content is decoded
+    and parsed on the fly. Days are downloaded concurrently
+    (see `RTE_eCO2mix_download.get_data_range`) and yielded in date order.
+    '''
+    pool = ConnectionPool(url)
+    limiter = RateLimiter(max_rate)
+    def download_block(day):
+        '''download and parse the data of one day (executed by a worker)'''
+        datafile = codecs.getreader('iso-8859-15')(
+                       get_daily_data(day, url, pool, limiter))
+        header, values, markers = parse_daily_file(datafile, day, url,
+                                                   NA_values)
+        return (day,) + reordered_block(header, values, markers,
+                                        reordered_header, with_flags)
+    workers = ThreadPool(nb_workers)
+    try:
+        # imap keeps the order of the days:
+        for block in workers.imap(download_block,
+                                  day_range(start_day, stop_day)):
+            yield block
+    finally:
+        workers.terminate()
+        pool.close()
+
+### Parallel aggregation ######################################################
+
+def chunk_range(start_day, stop_day, chunk_size='month'):
+    '''split the day range [`start_day`, `stop_day`) into consecutive
+    sub-ranges which end at the first day of a month or of a year
+    
+    Returns
+    -------
+    chunks : list of (start, stop) tuples of datetime.date objects
+    '''
+    if chunk_size not in ('month', 'year'):
+        raise ValueError("chunk_size should be 'month' or 'year' (got %s)" %\
+                         chunk_size)
+    chunks = []
+    start = start_day
+    while start < stop_day:
+        if chunk_size == 'year' or start.month == 12:
+            stop = dt.date(start.year+1, 1, 1)
+        else:
+            stop = dt.date(start.year, start.month+1, 1)
+        stop = min(stop, stop_day)
+        chunks.append((start, stop))
+        start = stop
+    return chunks
+
+def _reordered_day_chunk(args):
+    '''list of the daily data blocks of one chunk (executed by a worker)'''
+    return list(reordered_day_range(*args))
+
+def _reordered_data_chunk(args):
+    '''reordered data lines of one chunk, as one string (executed by a worker)'''
+    lines = reordered_data_range(*args)
+    next(lines) # drop the header line
+    return u''.join(lines)
+
+def _parallel_chunks(worker, start_day, stop_day, args,
+                     nb_processes, chunk_size):
+    '''process the chunks of the day range with a pool of worker processes
+    and yield their results in date order'''
+    tasks = [(start, stop) + args
+             for (start, stop) in chunk_range(start_day, stop_day, chunk_size)]
+    pool = Pool(nb_processes)
+    try:
+        # imap keeps the order of the tasks:
+        for result in pool.imap(worker, tasks):
+            yield result
+    finally:
+        pool.terminate()
+
+def parallel_day_range(start_day, stop_day,
+                       filename_pattern, reordered_header,
+                       NA_values=('', 'ND'), with_flags=False,
+                       nb_processes=None, chunk_size='month'):
+    '''generator of reordered daily data blocks, like `reordered_day_range`,
+    with the daily files being parsed by a pool of processes
+    
+    Additional parameters
+    ---------------------
+    nb_processes : int, optional
+        number of worker processes [default to the number of CPU cores]
+    chunk_size : 'month' or 'year', optional
+        size of the day range given to a worker at once [default to 'month']
+    '''
+    for blocks in _parallel_chunks(_reordered_day_chunk, start_day, stop_day,
+                                   (filename_pattern, reordered_header,
+                                    NA_values, with_flags),
+                                   nb_processes, chunk_size):
+        for block in blocks:
+            yield block
+
+def parallel_data_range(start_day, stop_day,
+                        filename_pattern, reordered_header,
+                        NA = 'NA', colsep=',',
+                        nb_processes=None, chunk_size='month'):
+    '''generator of reordered data lines, like `reordered_data_range`,
+    with the daily files being parsed by a pool of processes
+    
+    Lines are yielded by chunks (one string for each month or year).
+    
+    Additional parameters
+    ---------------------
+    nb_processes : int, optional
+        number of worker processes [default to the number of CPU cores]
+    chunk_size : 'month' or 'year', optional
+        size of the day range given to a worker at once [default to 'month']
+    '''
+    # Yield the header:
+    yield colsep.join([u'Timestamp']+reordered_header)+'\n'
+    for lines in _parallel_chunks(_reordered_data_chunk, start_day, stop_day,
+                                  (filename_pattern, reordered_header, NA, colsep),
+                                  nb_processes, chunk_size):
+        yield lines
+
+### Incremental aggregation ###################################################
+
+def update_store(store_dir, start_day, stop_day,
+                 filename_pattern, reordered_header):
+    '''incremental aggregation of the daily data in a store
+    
+    The manifest of the store records the signature (size, mtime, SHA-1 hash)
+    of each aggregated daily file. Only the days which are new, or whose
+    file has changed (e.g. "Données temps réel" replaced by consolidated data)
+    are parsed: new days are appended to the store and changed days
+    are overwritten in place.
+    
+    The store is created if it doesn't exist yet, and rebuilt
+    if `start_day` or `reordered_header` differ from the existing store.
+    The quality flags derived from the values (which depend on the
+    neighbouring days) should then be updated with
+    `RTE_eCO2mix_quality.update_flags`, from the first new or changed row
+    (see the 'row' entries of the manifest).
+    
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store
+    start_day, stop_day, filename_pattern, reordered_header :
+        see `reordered_day_range`
+    
+    Returns
+    -------
+    (new_days, changed_days) : lists of datetime.date objects
+    '''
+    manifest = st.read_manifest(store_dir)
+    if manifest:
+        header = st.read_json(store_dir, st.header_filename)
+        if (min(manifest) != start_day.isoformat() or
+            header['columns'] != list(reordered_header)):
+            print('store %s does not match, rebuilding it' % store_dir)
+            manifest = {}
+    # Find the new or changed days:
+    new_days = []
+    changed_days = []
     for day in day_range(start_day, stop_day):
         datafilename = filename_pattern % day.isoformat()
-        if not os.path.exists(datafilename):
+        if not archive.exists(datafilename):
             raise ValueError('data file not found for day %s (filename: %s)' %\
                               (day.isoformat(), datafilename))
-        # Open the daily file:
-        with codecs.open(datafilename, encoding='utf-8') as dailyfile:
-            line1 = dailyfile.readline()
-            # Check validity of the first line:
-            if not line1.startswith(u'Journée du'):
-                raise ValueError('data file for day %s is not valid (filename: %s)' %\
-                                 (day.isoformat(), datafilename))
-            # Read the file header:
-            header = dailyfile.readline().strip()
-            header = header.split('\t')[1:] # drop the first label "Heures"
-            # Compute column reordering:
-            reorder = [order_lut[label] for label in header]
-            # Browse the daily file line by line 
-            for hour in range(24):
-                for minute in range(0,60,15): # timestep is 15 minutes
-                    # Split columns
-                    line = dailyfile.readline().strip().split('\t')
-                    # 1) Process the timestamp
-                    # Check the continuity of time:
-                    assert line[0] == '%.2d:%.2d' % (hour, minute)
-                    data_date = dt.datetime.combine(day, dt.time(hour, minute))
-                    timestamp = [data_date.isoformat()]
-                    
-                    # 2) Process the data
-                    line_data = line[1:]
-                    # Build the reordered data
-                    reordered_data = [NA]*nb_column
-                    for i,data in zip(reorder, line_data):
-                        if data: 
-                            reordered_data[i] = data
-                    # 3) Paste time and data together:
-                    yield colsep.join(timestamp + reordered_data)+'\n'
+        entry = manifest.get(day.isoformat())
+        if entry is None:
+            new_days.append(day)
+            continue
+        # Cheap check first, then hash the file content:
+        signature = archive.signature(datafilename, sha1=False)
+        if (signature['size'], signature['mtime']) == (entry['size'], entry['mtime']):
+            continue
+        signature = archive.signature(datafilename)
+        if signature['sha1'] != entry['sha1']:
+            changed_days.append(day)
+        else: # only the mtime changed
+            entry['mtime'] = signature['mtime']
+    
+    # Days which are only in the manifest (after stop_day) are kept
+    nb_rows = sum(entry['nb_rows'] for entry in manifest.values())
+    # 1) Overwrite the changed days
+    read_day = lambda day: next(reordered_day_range(day, day+dt.timedelta(1),
+                                    filename_pattern, reordered_header,
+                                    with_flags=True))
+    for day in changed_days:
+        entry = manifest[day.isoformat()]
+        _, values, valid, flags = read_day(day)
+        if len(values) != entry['nb_rows']:
+            raise ValueError('number of rows of day %s has changed, '
+                             'cannot update store %s' %\
+                             (day.isoformat(), store_dir))
+        st.patch_store(store_dir, entry['row'], values, valid, flags)
+        entry.update(archive.signature(filename_pattern % day.isoformat()))
+    # 2) Append the new days (contiguous ranges only)
+    if new_days:
+        if manifest and new_days[0].isoformat() < max(manifest):
+            raise ValueError('cannot insert day %s in store %s' %\
+                             (new_days[0].isoformat(), store_dir))
+        with_flags = nb_rows == 0 or 'flags_dtype' in \
+                     st.read_json(store_dir, st.header_filename)
+        with st.StoreWriter(store_dir, reordered_header, nb_rows,
+                            with_flags) as writer:
+            for day in new_days:
+                _, values, valid, flags = read_day(day)
+                entry = archive.signature(filename_pattern % day.isoformat())
+                entry['row'] = writer.nb_rows
+                entry['nb_rows'] = len(values)
+                writer.append(st.day_timestamps(day, len(values)), values,
+                              valid, flags)
+                manifest[day.isoformat()] = entry
+    st.write_json(store_dir, st.manifest_filename, manifest)
+    return new_days, changed_days
+# end update_store()
 
 if __name__ == '__main__':
-    print('Aggregating daily data from %s to %s in "%s"...' %\
-          (start_day.isoformat(), stop_day.isoformat(), aggregated_filename) )
-    # Create the line generator:
-    reordered_data_gen = reordered_data_range(start_day, stop_day,
+    print('Checking the daily data files...')
+    check_schema(start_day, stop_day, filename_pattern, reordered_header)
+    export_formats = [f for f in dataset_formats if f in output_formats]
+    if incremental:
+        print('Updating "%s" with daily data from %s to %s...' %\
+              (incremental_store, start_day.isoformat(), stop_day.isoformat()))
+        new_days, changed_days = update_store(incremental_store,
+                                              start_day, stop_day,
                                               filename_pattern, reordered_header)
-    # Write the data in one big file:
-    with codecs.open(aggregated_filename, 'w', encoding='utf-8') as out:
-        out.writelines(reordered_data_gen)
+        print('%d new days, %d changed days' % (len(new_days), len(changed_days)))
+        if new_days or changed_days:
+            # Flags and rollup periods are computed again from the first
+            # new or changed row only:
+            manifest = st.read_manifest(incremental_store)
+            start_row = min(manifest[day.isoformat()]['row']
+                            for day in new_days + changed_days)
+            print('Computing the quality flags...')
+            update_flags(incremental_store, start_row)
+            if rollup:
+                print('Computing the rollup cube...')
+                write_rollup(incremental_store, start_row=start_row)
+            # Only the partitions of the new or changed years are rewritten:
+            years = sorted(set(day.year for day in new_days + changed_days))
+            for file_format in export_formats:
+                dataset_dir = os.path.splitext(incremental_store)[0] + \
+                              '.' + file_format
+                if not os.path.isdir(dataset_dir):
+                    print('Exporting the store in "%s"...' % dataset_dir)
+                    export_dataset(incremental_store, dataset_dir, file_format)
+                    continue
+                print('Exporting the years %s in "%s"...' %\
+                      (', '.join(str(year) for year in years), dataset_dir))
+                export_dataset(incremental_store, dataset_dir, file_format,
+                               years)
+    else:
+        # Choose between serial and parallel aggregation:
+        if nb_processes == 1:
+            data_range, block_range = reordered_data_range, reordered_day_range
+            options = {}
+        else:
+            data_range, block_range = parallel_data_range, parallel_day_range
+            options = {'nb_processes':nb_processes, 'chunk_size':chunk_size}
+        if 'csv' in output_formats:
+            print('Aggregating daily data from %s to %s in "%s"...' %\
+                  (start_day.isoformat(), stop_day.isoformat(), aggregated_filename) )
+            # Create the line generator:
+            reordered_data_gen = data_range(start_day, stop_day,
+                                            filename_pattern, reordered_header,
+                                            **options)
+            # Write the data in one big file:
+            with codecs.open(aggregated_filename, 'w', encoding='utf-8') as out:
+                out.writelines(reordered_data_gen)
+        if 'store' in output_formats or export_formats:
+            print('Aggregating daily data from %s to %s in "%s"...' %\
+                  (start_day.isoformat(), stop_day.isoformat(), aggregated_store) )
+            # Create the daily block generator:
+            reordered_day_gen = block_range(start_day, stop_day,
+                                            filename_pattern, reordered_header,
+                                            with_flags=True, **options)
+            # Write the data in one columnar store:
+            nb_rows = write_store(aggregated_store, reordered_day_gen, reordered_header)
+            print('%d rows written' % nb_rows)
+            print('Computing the quality flags...')
+            update_flags(aggregated_store)
+            if rollup:
+                print('Computing the rollup cube...')
+                write_rollup(aggregated_store)
+            for file_format in export_formats:
+                dataset_dir = aggregated_dataset % file_format
+                print('Exporting the store in "%s"...' % dataset_dir)
+                export_dataset(aggregated_store, dataset_dir, file_format)
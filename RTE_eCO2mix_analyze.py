@@ -11,137 +11,178 @@ Updates:
 * January 2013: accounts for the new "éCO2mix v2" file format
   where headers are uniform.
   Also there is a new line about the "data status"
+* October 2026: each file is scanned only once (first 4 lines),
+  and the result is saved in a schema index, in the data directory,
+  which is updated only for new or modified files (`update_schema_index`)
+* October 2026: the daily files packed in the yearly archive
+  (see RTE_eCO2mix_archive.py) are scanned too
 
 """
 from __future__ import print_function
-import os.path, codecs
-from glob import glob
+import os.path, io, json
+from RTE_eCO2mix_download import data_status
+import RTE_eCO2mix_archive as archive
 
 target_dir = 'RTE_eCO2mix_daily'
-target_glob = os.path.join(target_dir,'*.csv')
-print('searching files like "%s"' % target_glob)
-filenames =  glob(target_glob)
-filenames.sort()
-
-print('%d data files found' % len(filenames))
-print('from "%s" to "%s"' % (os.path.basename(filenames[0]),
-                             os.path.basename(filenames[-1])) )
-
-### Analyze the 2nd line which gives the electricity data status ###############
-
-# data status should be either:
-# * "Données temps réel"
-# * "Données consolidées" or
-# * "Données définitives"
-
-data_status_collection = []
-data_status_first_occurence = []
-for datafile in filenames:
-    with codecs.open(datafile, encoding='utf-8') as dailyfile:
+schema_index_filename = 'schema_index.json'
+
+def scan_daily_file(datafile):
+    '''find the schema of a daily file, reading only its first lines
+
+    Returns
+    -------
+    schema : dict or None (for an invalid file) with the keys:
+        * 'status': data status (None for the old file format,
+          without status line)
+        * 'header': the header line (column labels, tab separated)
+        * 'available': indices of the labels of the header for which
+          data is truly available in the first data line
+          (that is not empty or "ND")
+    '''
+    with archive.open_text(datafile) as dailyfile:
         line1 = dailyfile.readline()
-        # Skip invalid file
         if not line1.startswith(u'Journée du'):
-            print('skipping %s (invalid file)' % datafile)
-            continue
-        # Read the header
-        data_status_line = dailyfile.readline().strip()
-        if not data_status_collection:
-            data_status_collection.append(data_status_line)
-            data_status_first_occurence.append(datafile)
-        elif data_status_line != data_status_collection[-1]:
-            data_status_collection.append(data_status_line)
-            data_status_first_occurence.append(datafile)
-
-print('\nData status : %d changes found' % len(data_status_collection) )
-for status, startfile in zip(data_status_collection, data_status_first_occurence):
-    print(' * starting with "%s": %s' % (os.path.basename(startfile),
-                                         status.encode('utf-8'))
-         )
-
-print('\n'+'-'*80)
-
-### Analyze the 3rd line which contains column headers #########################
-header_collection = []
-header_first_occurence = []
-for datafile in filenames:
-    with codecs.open(datafile, encoding='utf-8') as dailyfile:
-        line1 = dailyfile.readline()
-        # Skip invalid file
-        if not line1.startswith(u'Journée du'):
-            print('skipping %s (invalid file)' % datafile)
-            continue
+            return None
         line2 = dailyfile.readline().strip()
-        # Skip invalid file
-        if not line2 in [u"Données temps réel", u"Données consolidées", u"Données définitives"]:
-            print('skipping %s (invalid file)' % datafile)
-            continue
-        # Read the header
-        header_line = dailyfile.readline().strip()
-        if not header_collection:
-            header_collection.append(header_line)
-            header_first_occurence.append(datafile)
-        elif header_line != header_collection[-1]:
-            header_collection.append(header_line)
-            header_first_occurence.append(datafile)
-
-print('\nHeaders : %d changes found, %d different kinds' %\
-                  (len(header_collection),
-                   len(set(header_collection))) )
-for header, startfile in zip(header_collection, header_first_occurence):
-    print(' * starting with "%s":' % os.path.basename(startfile))
-    print("   %s" % header.encode('utf-8'))
-
-label_collection = set([label for header in  header_collection
-                              for label in header.split('\t')])
-label_collection = list(label_collection)
-label_collection.sort()
-print('\nLabels : %d different found' % len(label_collection))
-print('\n'.join(label_collection))
-
-
-print('\n'+'-'*80)
-
-### Analyze data availability (starting at the 4th line) #######################
-available_data_collection = []
-available_data_first_occurence = []
-for datafile in filenames:
-    with codecs.open(datafile, encoding='utf-8') as dailyfile:
-        line1 = dailyfile.readline()
-        # Skip invalid file
-        if not line1.startswith(u'Journée du'):
-            print('skipping %s (invalid file)' % datafile)
-            continue
-        line2 = dailyfile.readline().strip()
-        # Skip invalid file
-        if not line2 in [u"Données temps réel", u"Données consolidées", u"Données définitives"]:
-            print('skipping %s (invalid file)' % datafile)
-            continue
-        # Read line 3 and 4:
-        # Decode the header
-        headers = dailyfile.readline().strip().split('\t')
+        if line2 in data_status:
+            status = line2
+            header_line = dailyfile.readline().strip()
+        elif line2.startswith(u'Heures'):
+            # old file format, without status line
+            status = None
+            header_line = line2
+        else:
+            return None
         # Decode the first data line
         data = dailyfile.readline().strip().split('\t')
-        
-        # Find out which data is truly available (that is not empty or "ND")
-        available_data = []
-        for h,d in zip(headers, data):
-            if d == '' or d == 'ND':
-                continue
-            else:
-                available_data.append(h)
-        
-        # Combine available headers in one string (for hashability)
-        available_data = '\t'.join(available_data)
-        
-        # Save this header if it's different from the previous file:
-        if not available_data_collection or available_data != available_data_collection[-1]:
-            available_data_collection.append(available_data)
-            available_data_first_occurence.append(datafile)
-
-
-print('\nAvailable data : %d changes found, %d different kinds' %\
-                  (len(available_data_collection),
-                   len(set(available_data_collection))) )
-for header, startfile in zip(available_data_collection, available_data_first_occurence):
-    print(' * starting with "%s":' % os.path.basename(startfile))
-    print("   %s" % header.encode('utf-8'))
+    headers = header_line.split('\t')
+    available = [k for k, (h,d) in enumerate(zip(headers, data))
+                 if d != '' and d != 'ND']
+    return {'status': status, 'header': header_line, 'available': available}
+
+def load_schema_index(target_dir):
+    '''schema index of the daily files of `target_dir` (see `update_schema_index`)'''
+    filename = os.path.join(target_dir, schema_index_filename)
+    if not os.path.exists(filename):
+        return {'headers': [], 'files': {}}
+    with io.open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+def update_schema_index(target_dir):
+    '''scan the daily files of `target_dir` and update their schema index
+
+    Only the files which are new, or whose size or mtime changed are read
+    (archived files included, see `RTE_eCO2mix_archive.list_files`).
+    The index is saved in `target_dir`.
+
+    Returns
+    -------
+    schema_index : dict with the keys
+        * 'headers': list of the different header lines
+        * 'files': dict (indexed by file name) of dict with the file
+          'size' and 'mtime', the data 'status', the 'header'
+          (index in the header list) and the 'available' data
+          (see `scan_daily_file`). Invalid files only have 'size' and 'mtime'.
+    '''
+    previous_index = load_schema_index(target_dir)
+    headers = previous_index['headers']
+    schema_index = {'headers': headers, 'files': {}}
+    for datafile in archive.list_files(target_dir, '*.csv'):
+        name = os.path.basename(datafile)
+        entry = previous_index['files'].get(name)
+        signature = archive.signature(datafile, sha1=False)
+        if entry is not None and \
+           (entry['size'], entry['mtime']) == (signature['size'],
+                                               signature['mtime']):
+            schema_index['files'][name] = entry
+            continue
+        entry = signature
+        schema = scan_daily_file(datafile)
+        if schema is not None:
+            if schema['header'] not in headers:
+                headers.append(schema['header'])
+            schema['header'] = headers.index(schema['header'])
+            entry.update(schema)
+        schema_index['files'][name] = entry
+    with io.open(os.path.join(target_dir, schema_index_filename), 'w',
+                 encoding='utf-8') as out:
+        out.write(json.dumps(schema_index, ensure_ascii=False, indent=0,
+                             sort_keys=True))
+    return schema_index
+
+def schema_changes(schema_index, key):
+    '''changes of a schema property (`key` = 'status', 'header' or 'available')
+    along the valid files, sorted by name
+
+    Returns
+    -------
+    list of (value, first file name) tuples
+    '''
+    headers = schema_index['headers']
+    changes = []
+    for name in sorted(schema_index['files']):
+        entry = schema_index['files'][name]
+        if 'header' not in entry:
+            continue # invalid file
+        value = entry[key]
+        if key == 'header':
+            value = headers[value]
+        elif key == 'available':
+            labels = headers[entry['header']].split('\t')
+            value = '\t'.join(labels[k] for k in value)
+        if not changes or value != changes[-1][0]:
+            changes.append((value, name))
+    return changes
+
+if __name__ == '__main__':
+    print('scanning files like "%s"' % os.path.join(target_dir,'*.csv'))
+    schema_index = update_schema_index(target_dir)
+    filenames = sorted(schema_index['files'])
+
+    print('%d data files found' % len(filenames))
+    print('from "%s" to "%s"' % (filenames[0], filenames[-1]))
+    for name in filenames:
+        if 'header' not in schema_index['files'][name]:
+            print('skipping %s (invalid file)' % name)
+
+    ### Analyze the 2nd line which gives the electricity data status ###########
+
+    # data status should be either:
+    # * "Données temps réel"
+    # * "Données consolidées" or
+    # * "Données définitives"
+    # (no status line in the old file format)
+    status_changes = schema_changes(schema_index, 'status')
+    print('\nData status : %d changes found' % len(status_changes) )
+    for status, startfile in status_changes:
+        print(' * starting with "%s": %s' % (startfile,
+              status.encode('utf-8') if status else '(no status line)'))
+
+    print('\n'+'-'*80)
+
+    ### Analyze the line which contains column headers #########################
+    header_changes = schema_changes(schema_index, 'header')
+    print('\nHeaders : %d changes found, %d different kinds' %\
+                      (len(header_changes),
+                       len(set(header for header, _ in header_changes))) )
+    for header, startfile in header_changes:
+        print(' * starting with "%s":' % startfile)
+        print("   %s" % header.encode('utf-8'))
+
+    label_collection = set([label for header in schema_index['headers']
+                                  for label in header.split('\t')])
+    label_collection = list(label_collection)
+    label_collection.sort()
+    print('\nLabels : %d different found' % len(label_collection))
+    print('\n'.join(label_collection))
+
+    print('\n'+'-'*80)
+
+    ### Analyze data availability (first data line) ############################
+    available_changes = schema_changes(schema_index, 'available')
+    print('\nAvailable data : %d changes found, %d different kinds' %\
+                      (len(available_changes),
+                       len(set(available for available, _ in available_changes))) )
+    for available, startfile in available_changes:
+        print(' * starting with "%s":' % startfile)
+        print("   %s" % available.encode('utf-8'))
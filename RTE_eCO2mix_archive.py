@@ -0,0 +1,368 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix daily files archive
+
+packs the daily files of the data directory (one small text file per day,
+see RTE_eCO2mix_download.py) into one compressed container per year,
+with an offset index, in the "archive" sub-directory:
+
+    RTE_eCO2mix_daily/archive/RTE_CO2mix_2012.3f9a1c0b.zst
+    RTE_eCO2mix_daily/archive/RTE_CO2mix_2012.index.json
+
+Each daily file is compressed separately (one zstd frame, or one zlib
+stream without the `zstandard` module), so that it can be read by day
+without extracting the container. The index records, for each file name,
+the offset and length of its compressed data, and the signature of the
+original file (size, mtime and SHA-1 hash, as in the manifest of a store):
+an archived file is seen as unchanged by the incremental aggregation.
+The name of the container, which includes a hash of its content, is also
+recorded in the index: a container packed again is written under a new
+name, and the index switches to it in one atomic rename.
+
+The compatibility functions (`exists`, `open_text`, `signature`,
+`list_files`) take the usual daily file names (`filename_pattern`):
+they read the file itself when it exists, otherwise its archived copy.
+The containers are kept open by the reader, so that a full scan reads
+a handful of files instead of opening thousands of them.
+
+A file downloaded again after packing (e.g. with an upgraded data status)
+takes precedence over its archived copy, until the next packing.
+
+Running this module packs the daily files (removing the packed files
+with --remove)::
+
+    python RTE_eCO2mix_archive.py --remove RTE_eCO2mix_daily
+"""
+from __future__ import print_function, division
+
+import os, io, re, json, zlib, hashlib, argparse
+from glob import glob
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import RTE_eCO2mix_store as st
+
+archive_dirname = 'archive'
+container_filename = 'RTE_CO2mix_%d.%s.%s' # (year, version, extension)
+index_filename = 'RTE_CO2mix_%d.index.json'
+daily_glob = 'RTE_CO2mix_*.csv'
+
+# Compression codecs: file extension and level
+codec_settings = {'zstd': ('zst', 19), 'zlib': ('zz', 9)}
+default_codec = 'zstd' if zstandard is not None else 'zlib'
+
+_year_regex = re.compile(r'_(\d{4})-\d\d-\d\d\.')
+_index_regex = re.compile(r'_(\d{4})\.index\.json$')
+
+def _file_year(name):
+    '''year of a daily file name (None if the name has no date)'''
+    match = _year_regex.search(name)
+    return int(match.group(1)) if match else None
+
+def compress(data, codec=default_codec):
+    '''compress the bytes of one daily file'''
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('the zstd codec requires zstandard '
+                              '(pip install zstandard)')
+        compressor = zstandard.ZstdCompressor(level=codec_settings[codec][1])
+        return compressor.compress(data)
+    elif codec == 'zlib':
+        return zlib.compress(data, codec_settings[codec][1])
+    raise ValueError('unknown archive codec "%s"' % codec)
+
+def decompress(data, codec):
+    '''decompress the bytes of one daily file'''
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('the archive is compressed with zstd, '
+                              'which requires zstandard (pip install zstandard)')
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError('unknown archive codec "%s"' % codec)
+
+### Reader #####################################################################
+
+class Archive(object):
+    '''reader of the yearly containers of a data directory
+
+    Indexes are loaded, and containers opened, on first use.
+    Use `refresh` to see the containers packed by another process.
+    '''
+    def __init__(self, target_dir):
+        self.target_dir = target_dir
+        self.archive_dir = os.path.join(target_dir, archive_dirname)
+        self._indexes = {}
+        self._files = {}
+
+    def years(self):
+        '''years which have a container'''
+        filenames = glob(os.path.join(self.archive_dir, index_filename % 0)
+                         .replace('_0.', '_*.'))
+        return sorted(int(_index_regex.search(f).group(1)) for f in filenames)
+
+    def index(self, year):
+        '''index of the container of `year` (None if there is no container):
+        dict with the 'codec' and the 'files' entries, by file name'''
+        if year not in self._indexes:
+            filename = os.path.join(self.archive_dir, index_filename % year)
+            index = None
+            if os.path.exists(filename):
+                with io.open(filename, encoding='utf-8') as f:
+                    index = json.load(f)
+            self._indexes[year] = index
+        return self._indexes[year]
+
+    def entry(self, name):
+        '''index entry of the daily file `name` (None if not archived)'''
+        year = _file_year(name)
+        index = self.index(year) if year is not None else None
+        return index['files'].get(name) if index is not None else None
+
+    def names(self):
+        '''names of the archived daily files'''
+        return [name for year in self.years()
+                for name in self.index(year)['files']]
+
+    def _container(self, year):
+        '''open file of the container of `year` (opened again in a forked
+        process, which must not share the file position of its parent)'''
+        pid, f = self._files.get(year, (None, None))
+        if f is None or pid != os.getpid():
+            f = open(os.path.join(self.archive_dir,
+                                  self.index(year)['container']), 'rb')
+            self._files[year] = (os.getpid(), f)
+        return f
+
+    def read(self, name):
+        '''content (bytes) of the archived daily file `name`
+
+        Raises
+        ------
+        KeyError if the file is not archived
+        '''
+        entry = self.entry(name)
+        if entry is None:
+            raise KeyError('%s is not archived in %s' % (name, self.archive_dir))
+        year = _file_year(name)
+        f = self._container(year)
+        f.seek(entry['offset'])
+        return decompress(f.read(entry['length']), self.index(year)['codec'])
+
+    def iter_year(self, year):
+        '''content of all the daily files of a container, in the order
+        of the file names, with one sequential read of the container
+
+        Yields
+        ------
+        (name, data) tuples
+        '''
+        index = self.index(year)
+        if index is None:
+            return
+        f = self._container(year)
+        f.seek(0)
+        container = f.read()
+        for name in sorted(index['files']):
+            entry = index['files'][name]
+            yield name, decompress(container[entry['offset']:
+                                             entry['offset'] + entry['length']],
+                                   index['codec'])
+
+    def refresh(self):
+        '''forget the loaded indexes and close the containers'''
+        self.close()
+        self._indexes = {}
+
+    def close(self):
+        for pid, f in self._files.values():
+            f.close()
+        self._files = {}
+# end Archive
+
+_archives = {}
+
+def get_archive(target_dir):
+    '''the (shared) reader of the archive of `target_dir`'''
+    key = os.path.abspath(target_dir)
+    if key not in _archives:
+        _archives[key] = Archive(target_dir)
+    return _archives[key]
+
+### Compatibility functions ####################################################
+
+def exists(filename):
+    '''whether the daily file `filename` exists, or is archived'''
+    if os.path.exists(filename):
+        return True
+    target_dir, name = os.path.split(filename)
+    return get_archive(target_dir).entry(name) is not None
+
+def read_bytes(filename):
+    '''content (bytes) of a daily file, or of its archived copy
+
+    Raises
+    ------
+    IOError if the file doesn't exist and is not archived
+    '''
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+    target_dir, name = os.path.split(filename)
+    try:
+        return get_archive(target_dir).read(name)
+    except KeyError:
+        raise IOError('no such file: %s' % filename)
+
+def open_text(filename, encoding='utf-8'):
+    '''open a daily file, or its archived copy, in text mode'''
+    if os.path.exists(filename):
+        return io.open(filename, encoding=encoding)
+    return io.TextIOWrapper(io.BytesIO(read_bytes(filename)), encoding=encoding)
+
+def signature(filename, sha1=True):
+    '''signature of a daily file (see `RTE_eCO2mix_store.file_signature`),
+    recorded in the index for an archived file'''
+    if os.path.exists(filename):
+        return st.file_signature(filename, sha1)
+    target_dir, name = os.path.split(filename)
+    entry = get_archive(target_dir).entry(name)
+    if entry is None:
+        raise OSError('no such file: %s' % filename)
+    keys = ['size', 'mtime', 'sha1'] if sha1 else ['size', 'mtime']
+    return dict((key, entry[key]) for key in keys)
+
+def list_files(target_dir, pattern=daily_glob):
+    '''paths of the daily files of `target_dir`, and of the archived ones,
+    sorted by name'''
+    names = set(os.path.basename(f)
+                for f in glob(os.path.join(target_dir, pattern)))
+    names.update(get_archive(target_dir).names())
+    return [os.path.join(target_dir, name) for name in sorted(names)]
+
+### Packing ####################################################################
+
+def _write_container(archive_dir, year, files, codec):
+    '''write the container and the index of `year`
+
+    `files` gives, by file name, the signature of the file and either
+    its compressed data ('data') or its content ('content')
+
+    The container is written under a new name (versioned by the hash of its
+    content), before the index which points to it: after a crash, the index
+    is either the previous one, with its unchanged container, or the new one.
+    The previous containers are removed once the index is replaced.
+    '''
+    index = {'codec': codec, 'files': {}}
+    tmp_container = os.path.join(archive_dir, container_filename %
+                                 (year, 'new', codec_settings[codec][0]) +
+                                 '.tmp')
+    h = hashlib.sha1()
+    with open(tmp_container, 'wb') as out:
+        offset = 0
+        for name in sorted(files):
+            entry = files[name]
+            data = entry.pop('data', None)
+            if data is None:
+                data = compress(entry.pop('content'), codec)
+            out.write(data)
+            h.update(data)
+            entry.update({'offset': offset, 'length': len(data)})
+            index['files'][name] = entry
+            offset += len(data)
+    index['container'] = container_filename % (year, h.hexdigest()[:8],
+                                               codec_settings[codec][0])
+    os.rename(tmp_container, os.path.join(archive_dir, index['container']))
+    tmp_index = os.path.join(archive_dir, index_filename % year + '.tmp')
+    with io.open(tmp_index, 'w', encoding='utf-8') as out:
+        out.write(json.dumps(index, indent=0, sort_keys=True))
+    os.rename(tmp_index, tmp_index[:-len('.tmp')])
+    # Previous containers of the year (of any codec):
+    for extension, _ in codec_settings.values():
+        for old in glob(os.path.join(archive_dir, container_filename %
+                                     (year, '*', extension))):
+            if os.path.basename(old) != index['container']:
+                os.remove(old)
+
+def pack_archive(target_dir, remove=False, codec=default_codec):
+    '''pack the daily files of `target_dir` into the yearly containers
+
+    Only the years with new or changed files, or archived with another
+    codec, are written again (the unchanged archived files are copied
+    without being decompressed, if the codec is the same).
+
+    Parameters
+    ----------
+    target_dir : str
+        data directory
+    remove : bool
+        remove the daily files once packed
+    codec : str
+        'zstd' or 'zlib' [default: zstd if available]
+
+    Returns
+    -------
+    packed : dict of the number of new or changed files, by year
+    '''
+    archive = get_archive(target_dir)
+    archive.refresh()
+    if not os.path.isdir(archive.archive_dir):
+        os.makedirs(archive.archive_dir)
+    loose = {}
+    for filename in glob(os.path.join(target_dir, daily_glob)):
+        year = _file_year(os.path.basename(filename))
+        if year is not None:
+            loose.setdefault(year, []).append(filename)
+    packed = {}
+    for year in sorted(set(loose) | set(archive.years())):
+        index = archive.index(year) or {'codec': codec, 'files': {}}
+        files = {}
+        for filename in loose.get(year, []):
+            name = os.path.basename(filename)
+            with open(filename, 'rb') as f:
+                content = f.read()
+            stat = os.stat(filename)
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                     'sha1': hashlib.sha1(content).hexdigest()}
+            old = index['files'].get(name)
+            if old is None or old['sha1'] != entry['sha1']:
+                entry['content'] = content
+                files[name] = entry
+        if files or index['codec'] != codec:
+            packed[year] = len(files)
+            for name, old in index['files'].items():
+                if name in files:
+                    continue
+                entry = dict((key, old[key]) for key in ('size', 'mtime', 'sha1'))
+                if index['codec'] == codec:
+                    f = archive._container(year)
+                    f.seek(old['offset'])
+                    entry['data'] = f.read(old['length'])
+                else:
+                    entry['content'] = archive.read(name)
+                files[name] = entry
+            archive.close()
+            _write_container(archive.archive_dir, year, files, codec)
+        if remove:
+            for filename in loose.get(year, []):
+                os.remove(filename)
+    archive.refresh()
+    return packed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='pack the daily files into yearly compressed containers')
+    parser.add_argument('target_dir', nargs='?', default='RTE_eCO2mix_daily')
+    parser.add_argument('--remove', action='store_true',
+                        help='remove the daily files once packed')
+    parser.add_argument('--codec', choices=sorted(codec_settings),
+                        default=default_codec)
+    args = parser.parse_args()
+    print('packing the daily files of "%s" (%s)...' %\
+          (args.target_dir, args.codec))
+    packed = pack_archive(args.target_dir, args.remove, args.codec)
+    for year in sorted(packed):
+        print(' * %d: %d new or changed files' % (year, packed[year]))
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix Parquet and Arrow export
+
+export of a store (see RTE_eCO2mix_store.py) as a dataset partitioned by year,
+readable by the Parquet/Arrow tools (pyarrow, pandas, polars, DuckDB, Spark...),
+which read only the requested columns and years:
+
+    RTE_eCO2mix_2000-06-24_2012-02-19.parquet/
+        year=2000/part-0.parquet
+        year=2001/part-0.parquet
+        ...
+
+Columns: "Timestamp" (local time, as in the store, timestamp[ms]),
+the value columns (int32, in MW, null for the unavailable data)
+and, for a store with quality flags, one "<label> flags" column per value
+column (uint8, see RTE_eCO2mix_quality.py).
+
+Parquet files are written with delta encoding of the timestamps and
+values, dictionary encoding of the flags, zstd compression and statistics
+for each row group (about one month): readers skip the row groups
+and the year partitions outside of a time filter (predicate pushdown).
+Arrow IPC files ("arrow" format) are written with zstd compression.
+
+pyarrow is an optional dependency, only needed for this module.
+
+Example::
+
+    export_dataset('RTE_eCO2mix.store', 'RTE_eCO2mix.parquet')
+    time, data = read_dataset('RTE_eCO2mix.parquet', [u'Consommation'],
+                              '2011-01-01', '2011-02-01')
+"""
+from __future__ import print_function, division
+
+import os.path, shutil
+import numpy as np
+
+import RTE_eCO2mix_quality as q
+from RTE_eCO2mix_load import Store
+
+dataset_formats = ['parquet', 'arrow']
+timestamp_label = u'Timestamp'
+flags_label = u'%s flags'
+partition_dir = 'year=%d'
+part_filename = 'part-0.%s'
+
+# Rows per Parquet row group (about one month)
+row_group_size = 31*24*4
+compression = 'zstd'
+
+def _import_pyarrow():
+    '''import pyarrow (optional dependency)'''
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+        import pyarrow.ipc
+    except ImportError:
+        raise ImportError('the Parquet/Arrow export requires pyarrow '
+                          '(pip install pyarrow)')
+    return pyarrow
+
+def _check_format(file_format):
+    if file_format not in dataset_formats:
+        raise ValueError('unknown dataset format "%s"' % file_format)
+
+def year_table(store, rows, with_flags=True):
+    '''Arrow table of the `rows` of a store (slice)'''
+    pa = _import_pyarrow()
+    time = np.asarray(store.timestamp()[rows]).astype('datetime64[ms]')
+    arrays = [pa.array(time, type=pa.timestamp('ms'))]
+    names = [timestamp_label]
+    for label in store.columns:
+        valid = np.asarray(store.valid(label, rows))
+        arrays.append(pa.array(np.asarray(store.column(label, rows)),
+                               mask=~valid, type=pa.int32()))
+        names.append(label)
+    if with_flags and store.has_flags:
+        for label in store.columns:
+            arrays.append(pa.array(np.asarray(store.flags(label, rows)),
+                                   type=pa.uint8()))
+            names.append(flags_label % label)
+    return pa.Table.from_arrays(arrays, names=names)
+
+def write_table(table, path, file_format='parquet'):
+    '''write one partition file'''
+    pa = _import_pyarrow()
+    if file_format == 'parquet':
+        value_columns = [name for name in table.column_names
+                         if not name.endswith(flags_label % '')]
+        flags_columns = [name for name in table.column_names
+                         if name.endswith(flags_label % '')]
+        pa.parquet.write_table(table, path, row_group_size=row_group_size,
+            compression=compression, write_statistics=True,
+            use_dictionary=flags_columns,
+            column_encoding=dict((name, 'DELTA_BINARY_PACKED')
+                                 for name in value_columns))
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.OSFile(path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table, max_chunksize=row_group_size)
+
+def export_dataset(store_dir, dataset_dir, file_format='parquet', years=None):
+    '''export a store as a dataset partitioned by year
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store
+    dataset_dir : str
+        directory of the dataset (one sub-directory "year=YYYY" per year)
+    file_format : str
+        'parquet' or 'arrow' (Arrow IPC file format)
+    years : list of int, optional
+        only (re)write the partitions of these years
+        [default: all the years of the store, the other partitions
+        being removed]
+
+    Returns
+    -------
+    nb_rows : dict of the number of rows written, by year
+    '''
+    _check_format(file_format)
+    store = Store(store_dir)
+    if years is None and os.path.isdir(dataset_dir):
+        shutil.rmtree(dataset_dir)
+    nb_rows = {}
+    for rows in store.chunk_ranges('year'):
+        year = int(np.asarray(store.timestamp()[rows.start:rows.start+1])
+                   .astype('datetime64[Y]').astype(int)[0]) + 1970
+        if years is not None and year not in years:
+            continue
+        directory = os.path.join(dataset_dir, partition_dir % year)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        write_table(year_table(store, rows),
+                    os.path.join(directory, part_filename % file_format),
+                    file_format)
+        nb_rows[year] = rows.stop - rows.start
+    return nb_rows
+
+def read_dataset(dataset_dir, columns=None, start=None, stop=None,
+                 file_format='parquet', policy=None):
+    '''load the data of a dataset written by `export_dataset`,
+    reading only the requested columns, and the years and row groups
+    of the time window from `start` to `stop` (excluded)
+
+    Parameters
+    ----------
+    dataset_dir : str
+        directory of the dataset
+    columns : list of str, optional
+        which columns to load [default: all]
+    start, stop : datetime.date, datetime.datetime, datetime64 or str, optional
+        time window [default: all the data]
+    file_format : str
+        'parquet' or 'arrow'
+    policy : str or int, optional
+        quality policy (see `RTE_eCO2mix_load.Store.masked`), applied with
+        the flags columns if the dataset has them (otherwise, only the
+        unavailable data is masked)
+
+    Returns
+    -------
+    time : datetime64[m] array
+    data : 2D masked array (one column per requested label), in MW
+    '''
+    _check_format(file_format)
+    pa = _import_pyarrow()
+    ds = pa.dataset
+    dataset = ds.dataset(dataset_dir, format='ipc' if file_format == 'arrow'
+                         else file_format, partitioning='hive')
+    names = dataset.schema.names
+    if columns is None:
+        columns = [name for name in names if name != timestamp_label and
+                   name != 'year' and not name.endswith(flags_label % '')]
+    anomalies = q.policy_flags(policy) & ~q.marker_flags
+    read_flags = anomalies != 0 and \
+                 all(flags_label % label in names for label in columns)
+    # Time filter, on the year partitions and on the timestamps:
+    conditions = []
+    if start is not None:
+        start = np.datetime64(start).astype('datetime64[ms]')
+        conditions.append(ds.field('year') >= _year(start))
+        conditions.append(ds.field(timestamp_label) >=
+                          pa.scalar(start, pa.timestamp('ms')))
+    if stop is not None:
+        stop = np.datetime64(stop).astype('datetime64[ms]')
+        conditions.append(ds.field('year') <= _year(stop))
+        conditions.append(ds.field(timestamp_label) <
+                          pa.scalar(stop, pa.timestamp('ms')))
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    read_columns = [timestamp_label] + list(columns)
+    if read_flags:
+        read_columns += [flags_label % label for label in columns]
+    # Partitions are read in the order of the years, and their rows in the
+    # order of the files (not sorted by timestamp: the local times of the
+    # switch to winter time occur twice)
+    fragments = sorted(dataset.get_fragments(filter=condition),
+                       key=lambda fragment: fragment.path)
+    tables = [fragment.to_table(columns=read_columns, filter=condition,
+                                schema=dataset.schema)
+              for fragment in fragments]
+    if not tables:
+        return (np.zeros(0, dtype='datetime64[m]'),
+                np.ma.zeros((0, len(columns)), dtype=np.int32))
+    table = pa.concat_tables(tables)
+    time = table.column(timestamp_label).to_numpy().astype('datetime64[m]')
+    values = np.zeros((table.num_rows, len(columns)), dtype=np.int32)
+    mask = np.zeros(values.shape, dtype=bool)
+    for j, label in enumerate(columns):
+        column = table.column(label).combine_chunks()
+        values[:,j] = column.fill_null(0).to_numpy()
+        mask[:,j] = column.is_null().to_numpy(zero_copy_only=False)
+        if read_flags:
+            flags = table.column(flags_label % label).to_numpy()
+            mask[:,j] |= (flags & anomalies) != 0
+    return time, np.ma.MaskedArray(values, mask=mask)
+
+def _year(t):
+    '''year of a datetime64'''
+    return int(t.astype('datetime64[Y]').astype(int)) + 1970
@@ -0,0 +1,259 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix benchmark
+
+times (and measures the peak memory of) the stages of the data pipeline,
+on the bundled daily files and on synthetic corpora scaled up from them:
+
+* aggregation (`reordered_data_range` to a CSV file, and to a store)
+* loading of the aggregated data (CSV file and store)
+* analysis: consumption records, yearly load duration curves,
+  weekly statistics (as in the `analysis_examples` scripts)
+
+Results are saved in a JSON file, and compared with a baseline
+(a previous result file) to detect performance regressions.
+
+Usage::
+
+    python RTE_eCO2mix_benchmark.py --scale 1 10 --output bench.json \\
+                                    --baseline bench_baseline.json
+"""
+from __future__ import print_function, division
+
+import os.path, io, sys, json, time, shutil, tempfile, platform, argparse
+import datetime as dt
+import numpy as np
+try:
+    import tracemalloc
+except ImportError: # Python 2
+    tracemalloc = None
+
+import RTE_eCO2mix_aggregate as agg
+import RTE_eCO2mix_archive as archive
+from RTE_eCO2mix_store import write_store
+from RTE_eCO2mix_load import Store, load_csv
+from RTE_eCO2mix_stats import running_record, load_duration_points
+
+# Bundled daily files:
+daily_dir = 'RTE_eCO2mix_daily'
+start_day = dt.date(2000,6,24)
+stop_day = dt.date(2013,1,23) # last bundled day is 2013-01-22
+
+# Stages to run, in this order:
+all_stages = ['aggregate_csv', 'aggregate_store', 'load_csv', 'load_store',
+              'running_record', 'load_duration', 'weekly_stats']
+
+# Relative slowdown above which a stage is reported as a regression:
+tolerance = 0.2
+
+def make_synthetic_corpus(target_dir, scale):
+    '''create a corpus of `scale` times the bundled days in `target_dir`
+
+    The bundled daily files are repeated, one after the other, with new
+    dates after `start_day`. Files are hard links when possible
+    (copies of the archived files otherwise, see RTE_eCO2mix_archive.py).
+
+    Returns
+    -------
+    stop_day : datetime.date
+        end of the synthetic day range (excluded)
+    '''
+    source_days = list(agg.day_range(start_day, stop_day))
+    nb_days = len(source_days)*scale
+    for k, day in enumerate(agg.day_range(start_day,
+                                          start_day + dt.timedelta(nb_days))):
+        source = agg.filename_pattern % source_days[k % len(source_days)].isoformat()
+        target = os.path.join(target_dir, 'RTE_CO2mix_%s.csv' % day.isoformat())
+        if not os.path.exists(source):
+            with open(target, 'wb') as out:
+                out.write(archive.read_bytes(source))
+            continue
+        try:
+            os.link(source, target)
+        except (OSError, AttributeError):
+            shutil.copyfile(source, target)
+    return start_day + dt.timedelta(nb_days)
+
+### Analysis stages (as in the analysis_examples scripts) ######################
+
+def load_duration(consum, time_year, hours_of_interest=(0,2000,4000,8000)):
+    '''yearly load duration curves, for each complete year
+    (as in analysis_examples/load_duration.py)
+    '''
+    years, counts = np.unique(time_year, return_counts=True)
+    curves = {}
+    for y, count in zip(years, counts):
+        if count < 365*24*4:
+            continue # incomplete year
+        curves[y] = load_duration_points(consum[time_year==y],
+                                         hours_of_interest, missing='median')
+    return curves
+
+def weekly_stats(consum15m, day_skip=2):
+    '''weekly average, min and max
+    (as in analysis_examples/elec_consumption.py)
+    '''
+    consum1d = consum15m.reshape(-1,24*4).mean(axis=1)
+    nb_weeks = (len(consum1d) - day_skip)//7
+    week_range = slice(day_skip*24*4, (day_skip + nb_weeks*7)*24*4)
+    consum7d = consum1d[day_skip:day_skip+nb_weeks*7].reshape(-1,7).mean(axis=1)
+    consum7d_min = consum15m[week_range].reshape(-1,7*24*4).min(axis=1)
+    consum7d_max = consum15m[week_range].reshape(-1,7*24*4).max(axis=1)
+    return consum7d, consum7d_min, consum7d_max
+
+### Benchmark ##################################################################
+
+def measure(func, repeat=3, memory=True):
+    '''time `func` (best of `repeat` runs), and measure its peak memory
+    (with tracemalloc, in an additional run)
+
+    Returns
+    -------
+    dict with 'time' (best run, in s), 'times' (all the runs)
+    and 'peak_memory' (in bytes, None if not available)
+    '''
+    times = []
+    for k in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    peak_memory = None
+    if memory and tracemalloc is not None:
+        tracemalloc.start()
+        func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'time': min(times), 'times': times, 'peak_memory': peak_memory}
+
+def run_benchmark(corpus_dir, stop_day, work_dir, stages=all_stages,
+                  repeat=3, memory=True):
+    '''run the benchmark `stages` on the daily files of `corpus_dir`
+    (from `start_day` to `stop_day`), writing temporary files in `work_dir`
+
+    Returns
+    -------
+    results : dict of measures (see `measure`), indexed by stage
+    '''
+    filename_pattern = os.path.join(corpus_dir, 'RTE_CO2mix_%s.csv')
+    header = agg.reordered_header
+    csv_filename = os.path.join(work_dir, 'aggregated.csv')
+    store_dir = os.path.join(work_dir, 'aggregated.store')
+
+    def aggregate_csv():
+        with io.open(csv_filename, 'w', encoding='utf-8') as out:
+            out.writelines(agg.reordered_data_range(start_day, stop_day,
+                                                    filename_pattern, header))
+    def aggregate_store():
+        write_store(store_dir, agg.reordered_day_range(start_day, stop_day,
+                                                       filename_pattern, header),
+                    header)
+    def load_store():
+        store = Store(store_dir)
+        timestamps = np.array(store.timestamp())
+        consum = store.masked(u'Consommation')
+        return timestamps, consum/1000
+
+    stage_funcs = {
+        'aggregate_csv': aggregate_csv,
+        'aggregate_store': aggregate_store,
+        'load_csv': lambda: load_csv(csv_filename, [u'Consommation']),
+        'load_store': load_store,
+        'running_record': lambda: running_record(consum, 70, delta_min=6*4),
+        'load_duration': lambda: load_duration(consum, time_year),
+        'weekly_stats': lambda: weekly_stats(consum),
+    }
+    results = {}
+    consum = time_year = None
+    for stage in stages:
+        # Input data of the loading and analysis stages (not timed):
+        if stage in ('load_store', 'running_record', 'load_duration',
+                     'weekly_stats') and not os.path.exists(store_dir):
+            aggregate_store()
+        if stage in ('running_record', 'load_duration', 'weekly_stats') \
+           and consum is None:
+            timestamps, consum = load_store()
+            time_year = timestamps.astype('datetime64[Y]').astype(int) + 1970
+        if stage == 'load_csv' and not os.path.exists(csv_filename):
+            aggregate_csv()
+        print('  %s...' % stage)
+        results[stage] = measure(stage_funcs[stage], repeat, memory)
+    return results
+
+def compare(results, baseline, tolerance=tolerance):
+    '''compare benchmark results with a baseline, and print the comparison
+
+    Returns
+    -------
+    regressions : list of (corpus, stage, ratio) tuples
+        stages which are slower than the baseline by more than `tolerance`
+    '''
+    regressions = []
+    print('\n%-10s %-16s %10s %10s %8s' % ('corpus', 'stage', 'time (s)',
+                                           'baseline', 'ratio'))
+    for corpus in sorted(results['results']):
+        for stage in all_stages:
+            measures = results['results'][corpus].get(stage)
+            reference = baseline['results'].get(corpus, {}).get(stage)
+            if measures is None or reference is None:
+                continue
+            ratio = measures['time']/reference['time']
+            flag = ''
+            if ratio > 1 + tolerance:
+                regressions.append((corpus, stage, ratio))
+                flag = ' REGRESSION'
+            print('%-10s %-16s %10.3f %10.3f %8.2f%s' % (corpus, stage,
+                  measures['time'], reference['time'], ratio, flag))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='RTE éCO2mix benchmark')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1],
+                        help='corpus sizes, in number of times the bundled days')
+    parser.add_argument('--stages', nargs='+', default=all_stages,
+                        choices=all_stages, help='stages to run')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed runs of each stage')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="don't measure the peak memory")
+    parser.add_argument('--output', default='benchmark.json',
+                        help='where to write the results (JSON)')
+    parser.add_argument('--baseline', help='results to compare with (JSON)')
+    args = parser.parse_args(argv)
+
+    results = {'date': dt.datetime.now().isoformat(),
+               'python': platform.python_version(),
+               'numpy': np.__version__,
+               'platform': platform.platform(),
+               'results': {}}
+    for scale in args.scale:
+        corpus = 'x%d' % scale
+        print('Benchmark on corpus %s' % corpus)
+        work_dir = tempfile.mkdtemp(prefix='RTE_eCO2mix_benchmark_')
+        try:
+            if scale == 1:
+                corpus_dir, corpus_stop_day = daily_dir, stop_day
+            else:
+                corpus_dir = os.path.join(work_dir, 'daily')
+                os.mkdir(corpus_dir)
+                corpus_stop_day = make_synthetic_corpus(corpus_dir, scale)
+            results['results'][corpus] = run_benchmark(corpus_dir,
+                    corpus_stop_day, work_dir, args.stages, args.repeat,
+                    args.memory)
+        finally:
+            shutil.rmtree(work_dir)
+    with io.open(args.output, 'w', encoding='utf-8') as out:
+        out.write(json.dumps(results, ensure_ascii=False, indent=1,
+                             sort_keys=True))
+    print('results written in "%s"' % args.output)
+
+    if args.baseline:
+        with io.open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline)
+        if regressions:
+            print('%d regressions found' % len(regressions))
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix memoization cache
+
+disk-backed memoization of the analysis functions, so that a report
+run again on unchanged data reads its results instead of computing them.
+
+Results are content-addressed: the key of a call is the SHA-1 hash of
+the function identity (module, name, and source code of the function and of
+its module), of its parameters
+and of the content of its array arguments (values and mask), not of
+the name or date of the data file. Analyses which work chunk by chunk
+(e.g. one year of data per call, see `RTE_eCO2mix_stats.LoadDurationCurves`
+and `RTE_eCO2mix_stats.chunked_running_records`) only recompute the chunks
+whose data changed, e.g. the last month after a one-day update.
+
+Each result is a pickle file of the cache directory. The total size of the
+cache is bounded by `max_size`: the least recently used results (oldest
+mtime, updated when a result is read) are removed.
+
+Example::
+
+    memo = Memo('RTE_eCO2mix.cache')
+    points = memo(load_duration_points, consum, [0, 2000, 4000])
+
+    @memo.memoize
+    def weekly_peak(x):
+        ...
+"""
+from __future__ import print_function, division
+
+import os, sys, hashlib, inspect, functools, datetime as dt
+try:
+    import cPickle as pickle
+except ImportError: # Python 3
+    import pickle
+import numpy as np
+
+cache_dir = 'RTE_eCO2mix.cache'
+# Maximum total size of the cached results, in bytes
+max_size = 256*2**20
+# Version of the cache keys (to be increased to invalidate all the results,
+# e.g. when a function of another module, called by a memoized function,
+# changes: only the module of the memoized function is part of the key)
+cache_version = 1
+
+result_extension = '.pkl'
+
+### Keys #######################################################################
+
+_function_ids = {}
+
+def function_id(func):
+    '''identity of a function: module, name and hash of its source code
+    (or of its bytecode, when the source is not available) and of the source
+    of its module (so that a change of a helper function of the same module
+    also invalidates the results)'''
+    if func not in _function_ids:
+        h = hashlib.sha1()
+        try:
+            h.update(inspect.getsource(func).encode('utf-8'))
+        except (IOError, OSError, TypeError):
+            h.update(getattr(getattr(func, '__code__', None), 'co_code', b''))
+        module = sys.modules.get(func.__module__)
+        try:
+            h.update(inspect.getsource(module).encode('utf-8'))
+        except (IOError, OSError, TypeError):
+            pass # (interactive session, or compiled module)
+        _function_ids[func] = '%s.%s:%s' % (func.__module__, func.__name__,
+                                            h.hexdigest())
+    return _function_ids[func]
+
+def _update_hash(h, value):
+    '''update the hash `h` with a parameter value
+
+    Raises
+    ------
+    TypeError for the values which can't be hashed by content
+    '''
+    if isinstance(value, np.ndarray):
+        data = np.ma.getdata(value)
+        h.update(('array:%s:%r:' % (data.dtype.str, data.shape))
+                 .encode('ascii'))
+        h.update(np.ascontiguousarray(data).view(np.uint8).data)
+        if isinstance(value, np.ma.MaskedArray):
+            mask = np.ascontiguousarray(np.ma.getmaskarray(value))
+            h.update(b'mask:')
+            h.update(mask.view(np.uint8).data)
+    elif isinstance(value, (list, tuple)):
+        h.update(('%s:%d:' % (type(value).__name__, len(value)))
+                 .encode('ascii'))
+        for item in value:
+            _update_hash(h, item)
+    elif isinstance(value, dict):
+        h.update(('dict:%d:' % len(value)).encode('ascii'))
+        for name in sorted(value):
+            _update_hash(h, name)
+            _update_hash(h, value[name])
+    elif value is None or isinstance(value, (bool, int, float, complex, str,
+                                             bytes, np.generic, dt.date)):
+        h.update(('%s:%r;' % (type(value).__name__, value)).encode('utf-8'))
+    elif type(value).__name__ == 'unicode': # Python 2
+        h.update(('unicode:%s;' % value).encode('utf-8'))
+    else:
+        raise TypeError('cannot memoize a call with a parameter of type %s' %\
+                        type(value).__name__)
+
+def call_key(func, args=(), kwargs=None):
+    '''key of the call `func(*args, **kwargs)` (hexadecimal SHA-1 hash)'''
+    h = hashlib.sha1(('v%d:%s:' % (cache_version, function_id(func)))
+                     .encode('utf-8'))
+    _update_hash(h, list(args))
+    _update_hash(h, kwargs or {})
+    return h.hexdigest()
+
+### Cache ######################################################################
+
+class Memo(object):
+    '''disk-backed memoization cache, with a size-bounded LRU eviction
+
+    Parameters
+    ----------
+    directory : str
+        directory of the cached results (created if needed)
+    max_size : int
+        maximum total size of the cached results, in bytes
+    '''
+    def __init__(self, directory=cache_dir, max_size=max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = None # total size of the results (computed on first use)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + result_extension)
+
+    def _entries(self):
+        '''(mtime, size, path) of the cached results'''
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for subdir in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, subdir)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                if name.endswith(result_extension):
+                    path = os.path.join(subdir, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        '''total size of the cached results, in bytes'''
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, key):
+        '''cached result of the call `key`
+
+        Returns
+        -------
+        (found, result) tuple
+        '''
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        os.utime(path, None) # most recently used
+        return True, result
+
+    def put(self, key, result):
+        '''save the result of the call `key`, and remove the least recently
+        used results if the cache is too large'''
+        path = self._path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wb') as out:
+            pickle.dump(result, out, pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp_path)
+        os.rename(tmp_path, path)
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        '''remove the least recently used results, until the size of the cache
+        is below `max_size`
+
+        Returns
+        -------
+        nb_removed : int
+        '''
+        entries = sorted(self._entries())
+        self._size = sum(size for _, size, _ in entries)
+        nb_removed = 0
+        for mtime, size, path in entries:
+            if self._size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError: # removed by another process
+                pass
+            self._size -= size
+            nb_removed += 1
+        return nb_removed
+
+    def clear(self):
+        '''remove all the cached results'''
+        for _, _, path in self._entries():
+            os.remove(path)
+        self._size = 0
+
+    def __call__(self, func, *args, **kwargs):
+        '''`func(*args, **kwargs)`, read from the cache if it was already
+        computed with the same parameters (and the same function code)'''
+        key = call_key(func, args, kwargs)
+        found, result = self.get(key)
+        if found:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = func(*args, **kwargs)
+        self.put(key, result)
+        return result
+
+    def memoize(self, func):
+        '''decorator: memoized version of `func`'''
+        @functools.wraps(func)
+        def memoized(*args, **kwargs):
+            return self(func, *args, **kwargs)
+        return memoized
+# end Memo
+
+if __name__ == '__main__':
+    memo = Memo(sys.argv[1] if len(sys.argv) > 1 else cache_dir)
+    entries = memo._entries()
+    print('%s: %d results, %.1f MB (max %.1f MB)' %\
+          (memo.directory, len(entries),
+           sum(size for _, size, _ in entries)/2**20, memo.max_size/2**20))
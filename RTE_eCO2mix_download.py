@@ -9,13 +9,34 @@ Pierre Haessig — December 2011
 updates:
  * february 2012 : zip file unpacking
  * january 2013 : new download URL (part of "éCO2mix v2" changes)
+ * october 2026 : concurrent downloads, with persistent connections,
+   rate limiting and retries.
+   Re-download of the days whose data status can still be upgraded.
+   In-memory zip extraction and chunked transcoding (no temporary file)
+   Opt-in timing of the downloads (see RTE_eCO2mix_profile.py)
+ * october 2026 : the days packed in the yearly archive
+   (see RTE_eCO2mix_archive.py) are not downloaded again
 """
+from __future__ import print_function
 
-import urllib, urllib2
-import codecs, os.path
-from tempfile import TemporaryFile
+try: # Python 2
+    from urllib import urlencode
+    from urlparse import urlsplit
+    import httplib
+    from Queue import Queue, Empty
+except ImportError: # Python 3
+    from urllib.parse import urlencode, urlsplit
+    import http.client as httplib
+    from queue import Queue, Empty
+import codecs, os.path, socket, time, threading, json, io
+from multiprocessing.pool import ThreadPool
 from zipfile import ZipFile
 from datetime import date, timedelta
+import RTE_eCO2mix_profile as prof
+import RTE_eCO2mix_archive as archive
+
+# Where to download the data from:
+data_url = 'http://www.rte-france.com/curves/eco2mixDl'
 
 def day_range(start, stop, step = timedelta(days=1)):
     '''range of date objects, with a default step of 1 day
@@ -25,7 +46,106 @@ def day_range(start, stop, step = timedelta(days=1)):
         yield d
         d += step
 
-def get_daily_data(day):
+class ConnectionPool(object):
+    '''pool of persistent (keep-alive) HTTP connections to the host of `url`
+    
+    Connections are taken with `get` and given back with `put`
+    to be reused by the next request. A broken connection should be
+    closed instead of being given back.
+    '''
+    def __init__(self, url, timeout=60):
+        parts = urlsplit(url)
+        self.host = parts.netloc
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        if parts.scheme == 'https':
+            self.connection_class = httplib.HTTPSConnection
+        else:
+            self.connection_class = httplib.HTTPConnection
+        self.timeout = timeout
+        self._idle = Queue()
+    
+    def get(self):
+        '''take an idle connection, or open a new one'''
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self.connection_class(self.host, timeout=self.timeout)
+    
+    def put(self, connection):
+        '''give back a connection, for reuse'''
+        self._idle.put(connection)
+    
+    def close(self):
+        '''close all the idle connections'''
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+# end ConnectionPool
+
+class RateLimiter(object):
+    '''limit the rate of the requests sent to one host
+    (shared by several threads)
+    
+    Parameters
+    ----------
+    max_rate : float or None
+        maximum number of requests per second (None for no limit)
+    '''
+    def __init__(self, max_rate=None):
+        self.interval = 1./max_rate if max_rate else 0.
+        self._next_time = 0.
+        self._lock = threading.Lock()
+    
+    def wait(self):
+        '''wait until the next request is allowed'''
+        with self._lock:
+            now = time.time()
+            request_time = max(now, self._next_time)
+            self._next_time = request_time + self.interval
+        if request_time > now:
+            time.sleep(request_time - now)
+# end RateLimiter
+
+def post_request(pool, content, limiter=None, retries=3, backoff=1.):
+    '''send a POST request with a connection from `pool`
+    
+    The request is retried (with a new connection) after network errors
+    and HTTP server errors (status 5xx or 429), waiting `backoff` seconds
+    before the first retry, then twice longer before each next one.
+    
+    Returns
+    -------
+    (response, body) : the HTTP response object and its content (bytes)
+    '''
+    headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+    for attempt in range(retries+1):
+        if limiter is not None:
+            limiter.wait()
+        connection = pool.get()
+        try:
+            connection.request('POST', pool.path, content, headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (httplib.HTTPException, socket.error) as exc:
+            connection.close() # don't reuse a broken connection
+            error = exc
+        else:
+            pool.put(connection)
+            if response.status == 200:
+                return response, body
+            error = IOError('HTTP error %d (%s) from %s' %\
+                            (response.status, response.reason, pool.host))
+            if response.status < 500 and response.status != 429:
+                raise error # client error: no retry
+        if attempt < retries:
+            time.sleep(backoff * 2**attempt)
+    raise error
+
+def get_daily_data(day, url=data_url, pool=None, limiter=None, retries=3):
     '''get the daily electricty consumption data from
     
     Note that the output file may be empty if the requested day
@@ -35,6 +155,15 @@ def get_daily_data(day):
     ----------
     day : datetime.date object
         which day to grab
+    url : str, optional
+        download URL [default to `data_url`]
+    pool : ConnectionPool, optional
+        where to take the HTTP connection from
+        [default to a new connection]
+    limiter : RateLimiter, optional
+        to limit the rate of requests
+    retries : int, optional
+        how many times the download is retried after an error
     
     Returns
     -------
@@ -43,19 +172,19 @@ def get_daily_data(day):
     '''
     print('dowloading RTE data for day %s...' % day.isoformat())
     date_str = day.strftime('%d/%m/%Y') # like '31/02/2012'
-    # Forge the HTTP GET request 
-    url = 'http://www.rte-france.com/curves/eco2mixDl'
-    content = urllib.urlencode([('date',date_str)])
-    # Download the zipped data:
-    a = urllib.urlopen(url,content)
+    # Forge the HTTP POST request
+    content = urlencode([('date',date_str)])
+    if pool is None:
+        pool = ConnectionPool(url)
+    with prof.stage('get_daily_data') as record:
+        # Download the zipped data:
+        a, zipped = post_request(pool, content, limiter, retries)
+        record.add(files=1, bytes_read=len(zipped))
     # Add some sanity checks
     # 'content-disposition' header is 'attachment; filename="eCO2mix_RTE_2013-01-01.zip"'
-    assert a.headers['content-disposition'].startswith('attachment; filename=')
-    # Write the zip archive to a tmp file
-    tmp = TemporaryFile()
-    tmp.write(a.read())
-    # Open the zip file:
-    z = ZipFile(tmp)
+    assert a.getheader('content-disposition').startswith('attachment; filename=')
+    # Open the zip archive in memory:
+    z = ZipFile(io.BytesIO(zipped))
     # The archive only contains one file :
     assert len(z.namelist()) == 1
     conso_filename = z.namelist()[0]
@@ -64,25 +193,193 @@ def get_daily_data(day):
     return z.open(conso_filename)
 # end get_daily_data()
 
-def get_data_range(start_day, stop_day, target_dir):
+def transcode(datafile, out, encoding='iso-8859-15', chunk_size=65536):
+    '''decode the bytes of `datafile` chunk by chunk and write them
+    as unicode text in `out` (which does the encoding)'''
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        chunk = datafile.read(chunk_size)
+        if not chunk:
+            break
+        out.write(decoder.decode(chunk))
+    out.write(decoder.decode(b'', final=True))
+
+### Data status and re-download scheduling ####################################
+
+# Data status (2nd line of the "éCO2mix v2" files), from the least
+# to the most final one:
+data_status = [u'Données temps réel', u'Données consolidées',
+               u'Données définitives']
+
+# How long after a day its data is expected to be upgraded:
+upgrade_delay = {u'Données temps réel': timedelta(days=31), # monthly consolidation
+                 u'Données consolidées': timedelta(days=365)} # definitive data
+# Minimum interval between two downloads of the same day:
+recheck_interval = timedelta(days=7)
+
+# Index of the data status of the downloaded days (in `target_dir`):
+status_index_filename = 'status_index.json'
+
+def read_status(datafilename):
+    '''data status of a daily file, read on its 2nd line
+    (None for the old file format, without status line)'''
+    with archive.open_text(datafilename) as dailyfile:
+        dailyfile.readline()
+        line2 = dailyfile.readline().strip()
+    return line2 if line2 in data_status else None
+
+def load_status_index(target_dir):
+    '''index of the data status of the downloaded days (dict)
+    
+    each day (iso format) gives a dict with the data 'status',
+    the 'mtime' of the file when its status was read, and the day
+    it was last downloaded ('checked', None if unknown)
+    '''
+    filename = os.path.join(target_dir, status_index_filename)
+    if not os.path.exists(filename):
+        return {}
+    with io.open(filename, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_status_index(target_dir, status_index):
+    '''write the index of the data status in `target_dir`'''
+    filename = os.path.join(target_dir, status_index_filename)
+    with io.open(filename, 'w', encoding='utf-8') as out:
+        out.write(json.dumps(status_index, ensure_ascii=False, indent=1,
+                             sort_keys=True))
+
+def update_status_index(status_index, target_dir, days, checked=None):
+    '''update the status of `days` in the index
+    
+    the status line is only read for the files which are new
+    or which were modified since the last update.
+    `checked` (datetime.date) marks the days as just downloaded.
+    '''
+    name_pattern = os.path.join(target_dir, 'RTE_CO2mix_%s.csv')
+    for day in days:
+        datafilename = name_pattern % day.isoformat()
+        if not archive.exists(datafilename):
+            status_index.pop(day.isoformat(), None)
+            continue
+        mtime = archive.signature(datafilename, sha1=False)['mtime']
+        entry = status_index.setdefault(day.isoformat(), {'checked': None})
+        if entry.get('mtime') != mtime:
+            entry['status'] = read_status(datafilename)
+            entry['mtime'] = mtime
+        if checked is not None:
+            entry['checked'] = checked.isoformat()
+    return status_index
+
+def redownload_schedule(status_index, today=None):
+    '''days whose data status can still be upgraded, oldest first
+    
+    A day is scheduled when its status is not final, when the upgrade
+    of its status is expected (see `upgrade_delay`) and when it was not
+    downloaded during the last `recheck_interval`.
+    '''
+    if today is None:
+        today = date.today()
+    days = []
+    for day_str, entry in status_index.items():
+        status = entry['status']
+        if status not in upgrade_delay:
+            continue
+        day = date(*[int(s) for s in day_str.split('-')])
+        if today - day < upgrade_delay[status]:
+            continue
+        if entry['checked'] is not None:
+            checked = date(*[int(s) for s in entry['checked'].split('-')])
+            if today - checked < recheck_interval:
+                continue
+        days.append(day)
+    days.sort()
+    return days
+
+def get_data_range(start_day, stop_day, target_dir, url=data_url,
+                   nb_workers=4, max_rate=None, retries=3, refresh=True):
     '''download a range of daily data from RTE éCO2mix
     between `start_day` and `stop_day` (excluded)
     
     data consist of CSV files (tab separated, utf-8 encoding).
     Those files are saved in `target_dir`.
+    
+    Days are downloaded concurrently by `nb_workers` threads,
+    which share a pool of persistent connections. The request rate
+    can be limited to `max_rate` requests per second.
+    
+    Days already downloaded are skipped, except when `refresh` is True
+    and their data status can be upgraded (see `redownload_schedule`)
+    
+    Returns
+    -------
+    failed_days : list of (day, error) tuples
+        days which could not be downloaded
     '''
     name_pattern = os.path.join(target_dir, 'RTE_CO2mix_%s.csv')
+    status_index = load_status_index(target_dir)
+    refresh_days = []
+    if refresh:
+        update_status_index(status_index, target_dir,
+                            day_range(start_day, stop_day))
+        refresh_days = [day for day in redownload_schedule(status_index)
+                        if start_day <= day < stop_day]
+        print('%d days to download again (data status can be upgraded)' %\
+              len(refresh_days))
+    days = []
     for day in day_range(start_day, stop_day):
         datafilename = name_pattern % day.isoformat()
-        if os.path.exists(datafilename):
-            # TODO : needs a smarter skipping algorithm because of data consolidation (at the end of each month)
-            print('skipping day %s [already downloaded]' % day.isoformat())
+        if archive.exists(datafilename):
+            if day not in refresh_days:
+                print('skipping day %s [already downloaded]' % day.isoformat())
             continue
-        # 1) Grab the daily data:
-        datafile = get_daily_data(day)
-        # 2) Write the CSV file:
-        with codecs.open(datafilename, 'w', encoding='utf-8') as out:
-            out.write(datafile.read().decode('iso-8859-15'))
+        days.append(day)
+    days += refresh_days
+    
+    pool = ConnectionPool(url)
+    limiter = RateLimiter(max_rate)
+    def download_day(day):
+        '''download and write the data of one day (executed by a worker)'''
+        try:
+            # 1) Grab the daily data:
+            datafile = get_daily_data(day, url, pool, limiter, retries)
+            # 2) Write the CSV file (in a temporary file, renamed once
+            #    complete, so that a failed download doesn't truncate
+            #    the file of a previous download):
+            filename = name_pattern % day.isoformat()
+            tmp_filename = filename + '.tmp'
+            try:
+                with codecs.open(tmp_filename, 'w', encoding='utf-8') as out:
+                    transcode(datafile, out)
+            except Exception:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+                raise
+            os.rename(tmp_filename, filename)
+        except Exception as exc:
+            return day, exc
+        return day, None
+    
+    failed_days = []
+    downloaded_days = []
+    workers = ThreadPool(nb_workers)
+    try:
+        with prof.stage('get_data_range') as record:
+            for day, error in workers.imap_unordered(download_day, days):
+                if error is not None:
+                    print('failed to download day %s: %s' % (day.isoformat(), error))
+                    failed_days.append((day, error))
+                else:
+                    downloaded_days.append(day)
+                    record.add(files=1, bytes_written=os.path.getsize(
+                                   name_pattern % day.isoformat()))
+    finally:
+        workers.terminate()
+        pool.close()
+        # Record the status of the downloaded files:
+        update_status_index(status_index, target_dir, downloaded_days,
+                            checked=date.today())
+        save_status_index(target_dir, status_index)
+    return failed_days
 # end get_data_range()
 
 # Where to dowload the data files:
@@ -92,8 +389,14 @@ target_dir = 'RTE_eCO2mix_daily'
 start_day = date(2000,6,24)
 stop_day = date.today() # stop excluded from range
 
+# Number of concurrent downloads, and maximum number of requests per second
+nb_workers = 4
+max_rate = 5
+
 if __name__ == '__main__':
     print('Downloading RTE éCO2mix data')
     print(' from day %s to %s' % (start_day.isoformat(), stop_day.isoformat()))
-    get_data_range(start_day, stop_day, target_dir)
-
+    failed_days = get_data_range(start_day, stop_day, target_dir,
+                                 nb_workers=nb_workers, max_rate=max_rate)
+    if failed_days:
+        print('%d days could not be downloaded' % len(failed_days))
@@ -0,0 +1,420 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix aggregated data loader
+
+load the aggregated éCO2mix data, either from a columnar binary store
+(written by RTE_eCO2mix_aggregate.py, see RTE_eCO2mix_store.py)
+or from the big aggregated CSV file.
+
+With the store, columns are memory-mapped: loading a column only touches
+the bytes of this column, and only when they are used.
+
+Example::
+
+    store = Store('RTE_eCO2mix_2000-06-24_2012-02-19.store')
+    time = store.timestamp()               # datetime64[m] array
+    consum = store.masked(u'Consommation') # masked array, in MW
+    # only the data of February 2012 (found by the date index):
+    time, data = store.window('2012-02-01', '2012-03-01', [u'Nucléaire'])
+
+For datasets which don't fit in memory, the data can be read in chunks
+(e.g. one month or one year at a time) with `iter_chunks`::
+
+    # yearly average consumption, in bounded memory:
+    for time, data in iter_chunks(path, [u'Consommation'], 'year'):
+        print(time[0], data.mean())
+
+The loading functions are instrumented (see RTE_eCO2mix_profile.py).
+"""
+from __future__ import print_function, division
+
+import os.path, io, json
+from itertools import groupby
+import numpy as np
+
+import RTE_eCO2mix_store as st
+from RTE_eCO2mix_time import local_to_utc
+import RTE_eCO2mix_quality as q
+import RTE_eCO2mix_profile as prof
+
+# Known wrong values, to be masked when loading
+# (a bunch of consumption data is stuck at 100 MW)
+invalid_values = q.sentinel_values
+
+class Store(object):
+    '''read access to a columnar binary store, through memory-mapping
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store
+    '''
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with io.open(os.path.join(store_dir, st.header_filename),
+                     encoding='utf-8') as f:
+            self.header = json.load(f)
+        self.columns = self.header['columns']
+        self.nb_rows = self.header['nb_rows']
+        self.has_flags = 'flags_dtype' in self.header
+        self._time_step = None
+        self._memmaps = {}
+
+    def _memmap(self, filename, dtype):
+        '''memory-map one binary file of the store (read-only),
+        once for all the accesses to this file'''
+        if self.nb_rows == 0:
+            return np.zeros(0, dtype=dtype)
+        if filename not in self._memmaps:
+            path = os.path.join(self.store_dir, filename)
+            self._memmaps[filename] = np.memmap(path, dtype=dtype, mode='r',
+                                                shape=(self.nb_rows,))
+        return self._memmaps[filename]
+
+    def column_index(self, label):
+        '''index of the column `label` in the store'''
+        if label not in self.columns:
+            raise KeyError('column "%s" not found in store %s' %\
+                           (label, self.store_dir))
+        return self.columns.index(label)
+
+    def timestamp(self, utc=False):
+        '''timestamps of the rows, as a datetime64[m] array
+        
+        Parameters
+        ----------
+        utc : bool, optional
+            whether to convert the local timestamps to UTC
+            [default to False: zero-copy view of the local timestamps]
+        '''
+        t = self._memmap(st.timestamp_filename, self.header['timestamp_dtype'])
+        if utc:
+            return local_to_utc(t).view('datetime64[m]')
+        return t.view('datetime64[m]')
+
+    def time_step(self):
+        '''time step of the rows in minutes, if the timestamps are regularly
+        spaced, or 0 otherwise (e.g. with missing days, or with the 92 and
+        100 rows days of the DST transitions, whose missing and extra rows
+        may cancel out over the store)
+
+        All the timestamps are checked, once (the result is cached).
+        '''
+        if self._time_step is None:
+            self._time_step = 0
+            t = self._memmap(st.timestamp_filename, self.header['timestamp_dtype'])
+            if self.nb_rows >= 2:
+                step = int(t[1] - t[0])
+                if step > 0 and (np.diff(t) == step).all():
+                    self._time_step = step
+        return self._time_step
+
+    def row(self, time):
+        '''index of the first row whose timestamp is at or after `time`
+
+        The index is computed by arithmetic on the timestamps when they
+        are regularly spaced, or else by binary search in the memory-mapped
+        timestamps: only a few values are read from disk.
+
+        Parameters
+        ----------
+        time : datetime, date, datetime64 or ISO 8601 str
+        '''
+        time = np.datetime64(time, 'm').astype(np.int64)
+        t = self._memmap(st.timestamp_filename, self.header['timestamp_dtype'])
+        if self.nb_rows == 0:
+            return 0
+        step = self.time_step()
+        if step:
+            row = -((int(t[0]) - time)//step) # ceil((time - t[0])/step)
+            return int(min(max(row, 0), self.nb_rows))
+        return int(np.searchsorted(t, time))
+
+    def row_range(self, start=None, stop=None):
+        '''slice of the rows from `start` to `stop` (excluded)
+        [default: from the first row, to the last one] (see `row`)'''
+        start = 0 if start is None else self.row(start)
+        stop = self.nb_rows if stop is None else self.row(stop)
+        return slice(start, max(start, stop))
+
+    def window(self, start=None, stop=None, columns=None, policy=None):
+        '''load the data from `start` to `stop` (excluded), reading
+        only the rows of this time window from disk (see `row_range`)
+
+        Returns
+        -------
+        time : datetime64[m] array
+        data : 2D masked array (one column per requested label), in MW,
+            masked according to the quality `policy` (see `masked`)
+        '''
+        if columns is None:
+            columns = self.columns
+        rows = self.row_range(start, stop)
+        with prof.stage('store_window') as record:
+            time = np.array(self.timestamp()[rows])
+            data = np.ma.column_stack([self.masked(label, rows=rows,
+                                                   policy=policy)
+                                       for label in columns])
+            record.add(rows=len(time), bytes_read=_nbytes(time, data))
+        return time, data
+
+    def column(self, label, rows=slice(None)):
+        '''raw values of the column `label` (zero-copy view, in MW),
+        optionally restricted to the slice `rows`'''
+        j = self.column_index(label)
+        return self._memmap(st.column_filename % j,
+                            self.header['value_dtype'])[rows]
+
+    def valid(self, label, rows=slice(None)):
+        '''validity mask of the column `label` (zero-copy view),
+        optionally restricted to the slice `rows`'''
+        j = self.column_index(label)
+        return self._memmap(st.valid_filename % j,
+                            self.header['valid_dtype'])[rows]
+
+    def flags(self, label, rows=slice(None)):
+        '''quality flags of the column `label` (zero-copy view),
+        optionally restricted to the slice `rows`
+        (see RTE_eCO2mix_quality.py)'''
+        if not self.has_flags:
+            raise KeyError('store %s has no quality flags' % self.store_dir)
+        j = self.column_index(label)
+        return self._memmap(st.flags_filename % j,
+                            self.header['flags_dtype'])[rows]
+
+    def masked(self, label, mask_invalid_values=True, rows=slice(None),
+               policy=None):
+        '''values of the column `label` as a masked array
+
+        The data of the masked array is the memory-mapped column
+        (no copy), only the mask is computed.
+
+        Parameters
+        ----------
+        label : str
+            which column to load
+        mask_invalid_values : bool, optional
+            whether to mask the known wrong values
+            listed in `invalid_values` [default to True]
+        rows : slice, optional
+            which rows to load [default: all]
+        policy : str or int, optional
+            quality policy: which flagged data to mask, in addition to
+            the unavailable data (see `RTE_eCO2mix_quality.quality_policies`)
+            [default to 'default': unavailable data and sentinel values].
+            It is applied with the stored quality flags, without scanning
+            the values (except for a store without flags, where only
+            the sentinel values can be masked).
+        '''
+        data = self.column(label, rows)
+        mask = ~self.valid(label, rows)
+        anomalies = q.policy_flags(policy) & ~q.marker_flags
+        if not mask_invalid_values:
+            anomalies &= ~q.SENTINEL
+        if self.has_flags:
+            if anomalies:
+                mask |= (self.flags(label, rows) & anomalies) != 0
+        elif anomalies & q.SENTINEL:
+            for value in invalid_values.get(label, ()):
+                mask |= (data == value)
+        return np.ma.MaskedArray(data, mask=mask)
+
+    def chunk_ranges(self, chunk='month'):
+        '''slices of the rows of each chunk (see `iter_chunks`)
+
+        Chunk boundaries are found by binary search in the memory-mapped
+        timestamps, so that only a few pages of them are read.
+        '''
+        if self.nb_rows == 0:
+            return []
+        if isinstance(chunk, int):
+            starts = np.arange(0, self.nb_rows, chunk)
+        else:
+            t = self.timestamp()
+            unit = chunk_units[chunk]
+            first = t[0].astype('datetime64[%s]' % unit)
+            last = t[-1].astype('datetime64[%s]' % unit)
+            periods = np.arange(first, last + 1).astype('datetime64[m]')
+            starts = np.searchsorted(t, periods)
+        stops = np.append(starts[1:], self.nb_rows)
+        return [slice(start, stop) for start, stop in zip(starts, stops)
+                if stop > start]
+
+    def iter_chunks(self, columns=None, chunk='month', policy=None):
+        '''iterate over the store, chunk by chunk (see `iter_chunks`)'''
+        if columns is None:
+            columns = self.columns
+        # (the instrumented stage includes the time spent by the consumer)
+        with prof.stage('iter_chunks') as record:
+            for rows in self.chunk_ranges(chunk):
+                time = np.array(self.timestamp()[rows])
+                data = np.ma.column_stack([self.masked(label, rows=rows,
+                                                       policy=policy)
+                                           for label in columns])
+                record.add(rows=len(time), bytes_read=_nbytes(time, data))
+                yield time, data
+# end Store
+
+def _nbytes(time, data):
+    '''size of the arrays loaded from a store (timestamps, values and mask)'''
+    return time.nbytes + data.data.nbytes + np.ma.getmaskarray(data).nbytes
+
+# Chunk sizes of `iter_chunks`, and their datetime64 unit
+chunk_units = {'day': 'D', 'month': 'M', 'year': 'Y'}
+
+def _mask_sentinel_values(data, columns, policy):
+    '''mask the sentinel values of the masked array `data` (in place),
+    if the quality `policy` requires it (the CSV file has no quality flags)'''
+    if not q.policy_flags(policy) & q.SENTINEL:
+        return
+    for j, label in enumerate(columns):
+        for value in invalid_values.get(label, ()):
+            data.mask[:,j] |= (data.data[:,j] == value)
+
+def load_csv(fname, columns=None, policy=None):
+    '''load the aggregated CSV file (slow: prefer a store)
+
+    Parameters
+    ----------
+    fname : str
+        aggregated CSV filename
+    columns : list of str, optional
+        which columns to load [default: all]
+    policy : str or int, optional
+        quality policy (see `Store.masked`). The unavailable data ("NA" and
+        "ND") is always masked. The CSV file has no quality flags: they are
+        computed on all the columns of the file (see
+        `RTE_eCO2mix_quality.compute_flags`) if the policy masks anomalies
+        other than the sentinel values, which gives the same mask as a store.
+
+    Returns
+    -------
+    time : datetime64[m] array
+    data : 2D masked array (one column per requested label), in MW
+    '''
+    # Anomalies computed from the values (the sentinel values are masked
+    # by `_mask_sentinel_values`):
+    anomalies = q.policy_flags(policy) & ~(q.marker_flags | q.SENTINEL)
+    with prof.stage('load_csv') as record:
+        with io.open(fname, encoding='utf-8') as f:
+            header = f.readline().strip().split(',')[1:] # drop "Timestamp"
+        if columns is None:
+            columns = header
+        loaded = header if anomalies else columns
+        usecols = [header.index(label)+1 for label in loaded]
+        data = np.genfromtxt(fname, delimiter=',', skip_header=1,
+                             usecols=usecols, missing_values=['NA', 'ND'],
+                             usemask=True)
+        data = data.reshape(-1, len(loaded))
+        # Unavailable data: anything which is not a number (as in
+        # `iter_csv_chunks`), read as an unmasked NaN
+        data.mask = np.ma.getmaskarray(data) | np.isnan(data.data)
+        if anomalies:
+            valid = ~data.mask
+            flags = q.compute_flags(data.filled(0).astype(st.value_dtype),
+                                    valid, header)
+            j = [header.index(label) for label in columns]
+            data = data[:,j]
+            data.mask |= (flags[:,j] & anomalies) != 0
+        # Vectorized timestamps conversion (no per-row datetime object):
+        time = np.loadtxt(fname, delimiter=',', skiprows=1, usecols=[0],
+                          dtype='U19').astype('datetime64[m]')
+        _mask_sentinel_values(data, columns, policy)
+        # (the file is read twice)
+        record.add(files=1, rows=len(time),
+                   bytes_read=2*os.path.getsize(fname))
+    return time, data
+
+def iter_csv_chunks(fname, columns=None, chunk='month', policy=None):
+    '''iterate over the aggregated CSV file, chunk by chunk
+    (see `iter_chunks`), reading it line by line
+
+    The unavailable data ("NA" and "ND") is always masked, and the sentinel
+    values if the quality `policy` requires it. The other anomalies, which
+    are detected on the whole series, are only masked by `load_csv`
+    or with a store.'''
+    with io.open(fname, encoding='utf-8') as f:
+        header = f.readline().strip().split(',')[1:] # drop "Timestamp"
+        if columns is None:
+            columns = header
+        usecols = [header.index(label)+1 for label in columns]
+        if isinstance(chunk, int):
+            counter = iter(range(2**62))
+            key = lambda line: next(counter)//chunk
+        else:
+            # the timestamps start with "YYYY-MM-DD":
+            key_length = {'day': 10, 'month': 7, 'year': 4}[chunk]
+            key = lambda line: line[:key_length]
+        # (the instrumented stage includes the time spent by the consumer)
+        with prof.stage('iter_chunks') as record:
+            for _, lines in groupby(f, key):
+                lines = list(lines)
+                fields = np.array([line.rstrip().split(',') for line in lines])
+                time = fields[:,0].astype('datetime64[m]')
+                values = fields[:,usecols]
+                # Unavailable data: anything which is not an integer ("NA", "ND")
+                valid = np.char.isdigit(np.char.lstrip(values, '-'))
+                values[~valid] = '0'
+                data = np.ma.MaskedArray(values.astype(st.value_dtype),
+                                         mask=~valid)
+                _mask_sentinel_values(data, columns, policy)
+                record.add(rows=len(time),
+                           bytes_read=sum(len(line) for line in lines))
+                yield time, data
+
+def iter_chunks(path, columns=None, chunk='month', policy=None):
+    '''iterate over the aggregated data, chunk by chunk, in bounded memory
+    (from a store directory or from a CSV file)
+
+    Parameters
+    ----------
+    path : str
+        store directory or aggregated CSV filename
+    columns : list of str, optional
+        which columns to load [default: all]
+    chunk : str or int, optional
+        size of the chunks: 'day', 'month' or 'year',
+        or a number of rows [default to 'month']
+    policy : str or int, optional
+        quality policy (see `Store.masked`)
+
+    Yields
+    ------
+    time : datetime64[m] array
+    data : 2D masked array of integers (one column per requested label),
+        in MW, with the known wrong data masked
+    '''
+    if isinstance(chunk, str) and chunk not in chunk_units:
+        raise ValueError('unknown chunk size "%s"' % chunk)
+    if not os.path.isdir(path):
+        return iter_csv_chunks(path, columns, chunk, policy)
+    return Store(path).iter_chunks(columns, chunk, policy)
+
+def load_aggregated(path, columns=None, policy=None):
+    '''load the aggregated data, from a store directory or from a CSV file
+
+    Parameters
+    ----------
+    path : str
+        store directory or aggregated CSV filename
+    columns : list of str, optional
+        which columns to load [default: all]
+    policy : str or int, optional
+        quality policy (see `Store.masked`)
+
+    Returns
+    -------
+    time : datetime64[m] array
+    data : 2D masked array (one column per requested label), in MW
+    '''
+    if not os.path.isdir(path):
+        return load_csv(path, columns, policy)
+    store = Store(path)
+    if columns is None:
+        columns = store.columns
+    with prof.stage('load_store') as record:
+        time = store.timestamp()
+        data = np.ma.column_stack([store.masked(label, policy=policy)
+                                   for label in columns])
+        record.add(rows=len(time), bytes_read=_nbytes(time, data))
+    return time, data
@@ -0,0 +1,273 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix production mix
+
+stacked production series, ready to be plotted with `fill_between`,
+in a stacking order chosen by the caller:
+
+* at the 15 minutes resolution, or averaged over the periods of a rollup
+  level (hour, day, week, month, year), read from the rollup cube of the store
+  when it is up to date (see RTE_eCO2mix_rollup.py)
+* decimated to a bounded number of points, keeping the peaks and troughs:
+  per-bin min/max envelope (one bin per pixel column) or LTTB
+  ("Largest Triangle Three Buckets", S. Steinarsson, 2013)
+
+All the layers of a stack are decimated at the same instants (chosen on the
+top layer, i.e. the total production), so that they can still be filled
+between each other.
+
+Example::
+
+    store = Store('RTE_eCO2mix_2000-06-24_2012-02-19.store')
+    t, stacked = production_mix(store, [u'Nucléaire', u'Hydraulique', u'Gaz'],
+                                resolution='day', nb_points=2000)
+"""
+from __future__ import print_function, division
+
+import numpy as np
+
+import RTE_eCO2mix_quality as q
+from RTE_eCO2mix_rollup import Rollup, compute_rollup
+
+# Production columns of the store, in the default stacking order
+# (from the bottom)
+production_columns = [u'Nucléaire', u'Gaz', u'Charbon', u'Fioul + pointe',
+                      u'Hydraulique', u'Eolien', u'Autres', u'Solde']
+
+decimation_methods = ['minmax', 'lttb']
+
+### Stacking ###################################################################
+
+def stack(data):
+    '''stacked (cumulated) series of the columns of `data`, from the first one
+
+    Masked data is counted as zero, and a layer is masked where itself
+    or any layer below is masked.
+
+    Parameters
+    ----------
+    data : 2D (masked) array of shape (n, nb_layers)
+
+    Returns
+    -------
+    stacked : 2D masked float array of shape (n, nb_layers)
+    '''
+    data = np.ma.asarray(data)
+    stacked = data.filled(0).astype(float).cumsum(axis=1)
+    mask = np.logical_or.accumulate(np.ma.getmaskarray(data), axis=1)
+    return np.ma.MaskedArray(stacked, mask=mask)
+
+### Decimation #################################################################
+
+def _as_float(t):
+    '''float version of a time vector (datetime64 arrays in minutes)'''
+    t = np.asarray(t)
+    if np.issubdtype(t.dtype, np.datetime64):
+        t = t.astype('datetime64[m]').astype(np.int64)
+    return t.astype(float)
+
+def _gap_starts(mask):
+    '''indices of the first sample of each run of masked samples'''
+    return np.flatnonzero(mask & ~np.r_[False, mask[:-1]])
+
+def _gap_markers(x, mask, nb_bins):
+    '''indices of the first masked sample of each of `nb_bins` bins of equal
+    duration which contain masked samples (kept by the decimation, so that
+    gaps stay visible, with at most one marker per bin)'''
+    masked = np.flatnonzero(mask)
+    if len(masked) == 0 or nb_bins < 1:
+        return masked[:0]
+    span = (x[-1] - x[0]) or 1.
+    bins = np.minimum(((x[masked] - x[0])/span*nb_bins).astype(np.int64),
+                      nb_bins-1)
+    return masked[np.r_[True, bins[1:] != bins[:-1]]]
+
+def minmax_indices(t, y, nb_points):
+    '''indices of the min and max of `y` in bins of equal duration
+    (per-pixel envelope), in increasing order, at most `nb_points`
+    (for `nb_points` >= 5)
+
+    Masked samples are ignored, except the first masked sample of each bin
+    which contains some: with masked samples, there are (`nb_points`-2)//3
+    bins instead of (`nb_points`-2)//2.
+    The first and last valid samples are always kept.
+    '''
+    x = _as_float(t)
+    y = np.ma.asarray(y)
+    mask = np.ma.getmaskarray(y)
+    valid = np.flatnonzero(~mask)
+    nb_bins = max((nb_points-2)//(3 if mask.any() else 2), 1)
+    if len(valid) == 0:
+        return _gap_markers(x, mask, nb_bins)
+    xv = x[valid]
+    span = (xv[-1] - xv[0]) or 1.
+    bins = np.minimum(((xv - xv[0])/span*nb_bins).astype(np.int64), nb_bins-1)
+    # sort by bin, then by value: the min and max are at the ends of each bin
+    order = np.lexsort((y.data[valid], bins))
+    sorted_bins = bins[order]
+    first = np.flatnonzero(np.r_[True, sorted_bins[1:] != sorted_bins[:-1]])
+    last = np.r_[first[1:] - 1, len(order) - 1]
+    kept = np.concatenate([valid[order[first]], valid[order[last]],
+                           valid[[0, -1]], _gap_markers(x, mask, nb_bins)])
+    return np.unique(kept)
+
+def lttb_indices(t, y, nb_points):
+    '''indices of `nb_points` samples of `y` selected by the
+    Largest Triangle Three Buckets algorithm, in increasing order
+
+    The valid samples are split in `nb_points`-2 buckets (plus the first and
+    the last samples). In each bucket, the selected sample forms the largest
+    triangle with the sample selected in the previous bucket and the average
+    of the next bucket. The loop runs over the buckets only.
+
+    Masked samples are ignored, except the first of each masked run when
+    all the samples are kept. Otherwise, half of the `nb_points` are
+    the first masked sample of the bins of equal duration which contain
+    some (see `minmax_indices`), so that there are at most `nb_points`
+    samples (for `nb_points` >= 3).
+    '''
+    x = _as_float(t)
+    y = np.ma.asarray(y)
+    mask = np.ma.getmaskarray(y)
+    valid = np.flatnonzero(~mask)
+    gaps = _gap_starts(mask)
+    if len(valid) + len(gaps) <= max(nb_points, 2):
+        return np.union1d(valid, gaps)
+    nb_gap_bins = nb_points//2 if len(gaps) else 0
+    gaps = _gap_markers(x, mask, nb_gap_bins)
+    nb_points -= nb_gap_bins
+    n = len(valid)
+    if n <= max(nb_points, 2):
+        return np.union1d(valid, gaps)
+    if nb_points < 3:
+        return np.union1d(valid[[0, -1]], gaps)
+    xv, yv = x[valid], y.data[valid].astype(float)
+    edges = np.linspace(1, n-1, nb_points-1).astype(np.int64)
+    selected = np.empty(nb_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n-1
+    a = 0
+    for k in range(nb_points-2):
+        lo, hi = edges[k], edges[k+1]
+        next_lo, next_hi = (edges[k+1], edges[k+2]) if k+2 < len(edges) \
+                           else (n-1, n)
+        cx, cy = xv[next_lo:next_hi].mean(), yv[next_lo:next_hi].mean()
+        area = np.abs((xv[a] - cx)*(yv[lo:hi] - yv[a]) -
+                      (xv[a] - xv[lo:hi])*(cy - yv[a]))
+        a = lo + area.argmax()
+        selected[k+1] = a
+    return np.union1d(valid[selected], gaps)
+
+def decimate(t, y, nb_points, method='minmax', key=None):
+    '''decimate the series `y` to at most `nb_points` samples
+    (including one masked sample per bin with masked data, so that
+    the gaps stay visible)
+
+    Parameters
+    ----------
+    t : array of shape (n,)
+        time vector (float or datetime64)
+    y : (masked) array of shape (n,) or (n, nb_layers)
+    nb_points : int
+        number of points to keep (e.g. twice the plot width in pixels
+        for the 'minmax' method)
+    method : str
+        'minmax' (min and max of each bin, see `minmax_indices`)
+        or 'lttb' (see `lttb_indices`)
+    key : array of shape (n,), optional
+        series on which the samples are selected, for all the columns of `y`
+        [default: `y`, or its last column (top of a stack) if `y` is 2D]
+
+    Returns
+    -------
+    t, y : decimated time vector and series
+    '''
+    if key is None:
+        key = y if np.ndim(y) == 1 else y[:,-1]
+    if method == 'minmax':
+        index = minmax_indices(t, key, nb_points)
+    elif method == 'lttb':
+        index = lttb_indices(t, key, nb_points)
+    else:
+        raise ValueError('unknown decimation method "%s"' % method)
+    return t[index], y[index]
+
+### Production mix #############################################################
+
+def period_means(store, columns, level, start=None, stop=None, policy=None):
+    '''average of the `columns` of `store` over each `level` period
+    which overlaps the time window from `start` to `stop`
+
+    The means are read from the rollup cube when it is up to date
+    (and computed with the default quality policy), otherwise they are
+    computed from the data of the window.
+
+    Returns
+    -------
+    periods : datetime64[m] array
+        start of each period
+    means : 2D masked array of shape (nb_periods, len(columns)), in MW
+    '''
+    rows = store.row_range(start, stop)
+    try:
+        rollup = Rollup(store.store_dir)
+    except (IOError, OSError):
+        rollup = None
+    if rollup is not None and \
+       rollup.header['store_nb_rows'] == store.nb_rows and \
+       level in rollup.levels and \
+       q.policy_flags(policy) == q.policy_flags() and \
+       all(label in rollup.columns for label in columns):
+        timestamps = store.timestamp()[rows]
+        periods = rollup.period(level)
+        if len(timestamps) == 0:
+            return periods[:0], np.ma.zeros((0, len(columns)))
+        first = np.searchsorted(periods, timestamps[0], 'right') - 1
+        last = np.searchsorted(periods, timestamps[-1], 'right')
+        means = np.ma.column_stack([rollup.get(level, 'mean', label)[first:last]
+                                    for label in columns])
+        return np.array(periods[first:last]), means
+    t, data = store.window(start, stop, columns, policy)
+    periods, stats = compute_rollup(t, data.data, ~np.ma.getmaskarray(data),
+                                    level)
+    means = np.ma.MaskedArray(stats['mean'], mask=(stats['count'] == 0))
+    return periods.astype('datetime64[m]'), means
+
+def production_mix(store, columns=production_columns, start=None, stop=None,
+                   resolution=None, nb_points=None, method='minmax',
+                   policy=None):
+    '''stacked production mix of a store, over a time window
+
+    Parameters
+    ----------
+    store : RTE_eCO2mix_load.Store
+    columns : list of str
+        production columns, in the stacking order (from the bottom)
+        [default: `production_columns`]
+    start, stop : datetime.date, datetime.datetime or datetime64, optional
+        time window (see `Store.row_range`) [default: all the store]
+    resolution : str, optional
+        rollup level ('hour', 'day', 'week', 'month' or 'year') over which
+        the production is averaged [default: 15 minutes data]
+    nb_points : int, optional
+        decimate the stacked series to at most `nb_points` samples
+        (see `decimate`) [default: no decimation]
+    method : str
+        decimation method: 'minmax' or 'lttb'
+    policy : str or int, optional
+        quality policy of the loaded data (see `Store.masked`)
+
+    Returns
+    -------
+    t : datetime64[m] array
+        time of each sample (start of the period, for a `resolution`)
+    stacked : 2D masked float array of shape (len(t), len(columns))
+        stacked production, in MW: `stacked[:,-1]` is the total production
+    '''
+    if resolution is None:
+        t, data = store.window(start, stop, columns, policy)
+    else:
+        t, data = period_means(store, columns, resolution, start, stop, policy)
+    stacked = stack(data)
+    if nb_points is not None and len(t) > nb_points:
+        t, stacked = decimate(t, stacked, nb_points, method)
+    return t, stacked
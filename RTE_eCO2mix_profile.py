@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix pipeline instrumentation
+
+opt-in timing of the stages of the data pipeline (download, aggregation,
+loading), to find which one is responsible when a run slows down.
+
+Each instrumented stage records its wall time, the bytes read and written,
+the number of rows processed and of files, the files per second and the
+peak RSS of the process (resident memory high-water mark, from the `resource`
+module, not available on Windows). Records are exported as JSON lines
+(one JSON object per stage run) or as a Prometheus-style text file
+(totals per stage).
+
+Instrumented stages:
+
+* 'get_data_range' and 'get_daily_data' (RTE_eCO2mix_download.py)
+* 'reordered_data_range' and 'reordered_day_range' (RTE_eCO2mix_aggregate.py,
+  in the process which runs them: the workers of the parallel aggregation
+  are not instrumented)
+* 'load_csv', 'load_store', 'store_window' and 'iter_chunks'
+  (RTE_eCO2mix_load.py)
+
+Instrumentation is disabled by default (a disabled stage costs one
+function call). It can be enabled from the environment, for any script::
+
+    RTE_ECO2MIX_PROFILE=profile.jsonl python RTE_eCO2mix_aggregate.py
+    RTE_ECO2MIX_PROFILE=profile.prom RTE_ECO2MIX_CPROFILE=reordered_data_range \\
+        python RTE_eCO2mix_aggregate.py
+
+(records exported at exit, in Prometheus format for a ".prom" file),
+or from Python with `enable`, then `export_json_lines`
+or `export_prometheus`.
+
+With a cProfile stage, the runs of this stage are also profiled with cProfile
+and the statistics saved in "<stage>.prof" (see the `pstats` module).
+"""
+from __future__ import print_function, division
+
+import os, io, sys, json, time, atexit, threading
+import datetime as dt
+from contextlib import contextmanager
+import cProfile
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+enabled = False
+# Stage whose runs are profiled with cProfile (None for no cProfile)
+cprofile_stage = None
+cprofile_dir = '.'
+
+# Records of the finished stage runs
+records = []
+
+counter_names = ['rows', 'bytes_read', 'bytes_written', 'files']
+
+# Prefix of the exported Prometheus metrics
+metric_prefix = 'rte_eco2mix_stage'
+
+_lock = threading.Lock()
+_profiler = None
+_profiler_lock = threading.Lock()
+
+def enable(stage=None, directory='.'):
+    '''enable the instrumentation, with cProfile capture of the runs
+    of `stage` (optional), saved in `directory`'''
+    global enabled, cprofile_stage, cprofile_dir, _profiler
+    enabled = True
+    cprofile_stage = stage
+    cprofile_dir = directory
+    _profiler = cProfile.Profile() if stage is not None else None
+
+def disable():
+    '''disable the instrumentation (records are kept)'''
+    global enabled
+    enabled = False
+
+def reset():
+    '''forget the records'''
+    with _lock:
+        del records[:]
+
+def peak_rss():
+    '''peak resident memory of the process, in bytes (None if not available)'''
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss*1024
+
+class StageRecord(object):
+    '''measures of one run of a stage, updated by the instrumented code
+    with `add`'''
+    def __init__(self, stage):
+        self.stage = stage
+        self.counters = dict((name, 0) for name in counter_names)
+
+    def add(self, **counters):
+        '''increment the counters (rows, bytes_read, bytes_written, files)'''
+        for name, value in counters.items():
+            self.counters[name] += int(value)
+# end StageRecord
+
+class _NullRecord(object):
+    '''record of a stage run while the instrumentation is disabled'''
+    def add(self, **counters):
+        pass
+
+_null_record = _NullRecord()
+
+@contextmanager
+def stage(name):
+    '''instrument the run of stage `name` (the code of the `with` block)
+
+    Yields
+    ------
+    record : object with an `add` method to count the rows,
+        bytes and files processed by the stage
+    '''
+    if not enabled:
+        yield _null_record
+        return
+    record = StageRecord(name)
+    start = dt.datetime.now()
+    # cProfile can profile only one run at a time (the first thread wins):
+    profiler = None
+    if name == cprofile_stage and _profiler is not None and \
+       _profiler_lock.acquire(False):
+        profiler = _profiler
+        profiler.enable()
+    t0 = time.time()
+    try:
+        yield record
+    finally:
+        wall_time = time.time() - t0
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(cprofile_dir, '%s.prof' % name))
+            _profiler_lock.release()
+        result = {'stage': name, 'start': start.isoformat(),
+                  'wall_time': wall_time,
+                  'files_per_second': record.counters['files']/wall_time
+                                      if wall_time > 0 else None,
+                  'peak_rss': peak_rss()}
+        result.update(record.counters)
+        with _lock:
+            records.append(result)
+
+def summary():
+    '''totals of the records, by stage: number of runs, wall time, counters,
+    and maximal peak RSS'''
+    totals = {}
+    with _lock:
+        for record in records:
+            total = totals.setdefault(record['stage'],
+                dict([('runs', 0), ('wall_time', 0.), ('peak_rss', None)] +
+                     [(name, 0) for name in counter_names]))
+            total['runs'] += 1
+            total['wall_time'] += record['wall_time']
+            for name in counter_names:
+                total[name] += record[name]
+            if record['peak_rss'] is not None:
+                total['peak_rss'] = max(total['peak_rss'] or 0,
+                                        record['peak_rss'])
+    return totals
+
+def export_json_lines(filename, append=True):
+    '''write the records in `filename`, one JSON object per line'''
+    with _lock:
+        lines = [json.dumps(record, sort_keys=True) + u'\n'
+                 for record in records]
+    with io.open(filename, 'a' if append else 'w', encoding='utf-8') as out:
+        out.writelines(lines)
+
+def export_prometheus(filename):
+    '''write the totals of the records by stage (see `summary`)
+    in `filename`, in the Prometheus text exposition format'''
+    metrics = [
+        ('runs_total', 'runs', 'counter', 'Number of runs of the stage'),
+        ('seconds_total', 'wall_time', 'counter', 'Wall time of the stage'),
+        ('rows_total', 'rows', 'counter', 'Rows processed by the stage'),
+        ('read_bytes_total', 'bytes_read', 'counter', 'Bytes read by the stage'),
+        ('written_bytes_total', 'bytes_written', 'counter',
+         'Bytes written by the stage'),
+        ('files_total', 'files', 'counter', 'Files processed by the stage'),
+        ('peak_rss_bytes', 'peak_rss', 'gauge',
+         'Peak resident memory of the process at the end of the stage'),
+    ]
+    totals = summary()
+    lines = []
+    for metric, key, kind, help_text in metrics:
+        metric = '%s_%s' % (metric_prefix, metric)
+        lines.append(u'# HELP %s %s\n' % (metric, help_text))
+        lines.append(u'# TYPE %s %s\n' % (metric, kind))
+        for name in sorted(totals):
+            if totals[name][key] is not None:
+                lines.append(u'%s{stage="%s"} %r\n' % (metric, name,
+                                                       totals[name][key]))
+    with io.open(filename, 'w', encoding='utf-8') as out:
+        out.writelines(lines)
+
+def export(filename):
+    '''write the records in `filename`: Prometheus text format for
+    a ".prom" file, JSON lines otherwise'''
+    if filename.endswith('.prom'):
+        export_prometheus(filename)
+    else:
+        export_json_lines(filename)
+
+# Opt-in from the environment:
+if os.environ.get('RTE_ECO2MIX_PROFILE'):
+    enable(os.environ.get('RTE_ECO2MIX_CPROFILE') or None)
+    atexit.register(export, os.environ['RTE_ECO2MIX_PROFILE'])
@@ -0,0 +1,305 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix data quality flags
+
+flags of each sample of the aggregated data, as a bitmask,
+computed once at aggregation time and stored next to the data
+(one "colXX_flags.bin" uint8 file per column, see RTE_eCO2mix_store.py).
+
+Flags:
+
+* MISSING: no data in the daily file (empty field, or missing column)
+* ND: data marked as not available ("ND") in the daily file
+* SENTINEL: known wrong value (e.g. consumption stuck at 100 MW)
+* STUCK: (non zero) value repeated for at least `stuck_length` samples
+* JUMP: step from the previous valid sample much larger than usual
+  (`jump_factor` times the 99.9th percentile of the steps of the column)
+* MISMATCH: the production, plus the exchanges balance, doesn't match
+  the consumption (by more than `mismatch_tolerance`)
+
+The loaders (see RTE_eCO2mix_load.py) mask the samples according to
+a quality policy: the set of flags to be masked (see `quality_policies`),
+using the stored flags instead of scanning the values again.
+
+Running this module prints a summary of the flags of a store::
+
+    python RTE_eCO2mix_quality.py RTE_eCO2mix.store
+"""
+from __future__ import print_function, division
+
+import os.path, sys
+import numpy as np
+
+import RTE_eCO2mix_store as st
+
+### Flags and policies #########################################################
+
+MISSING = 1
+ND = 2
+SENTINEL = 4
+STUCK = 8
+JUMP = 16
+MISMATCH = 32
+
+flag_names = [(MISSING, 'missing'), (ND, 'ND'), (SENTINEL, 'sentinel'),
+              (STUCK, 'stuck'), (JUMP, 'jump'), (MISMATCH, 'mismatch')]
+
+# Flags which are read from the daily files (the other ones are computed
+# from the values by `compute_flags`)
+marker_flags = MISSING | ND
+
+# Sets of flags to be masked by the loaders:
+quality_policies = {
+    'raw': MISSING | ND, # only unavailable data
+    'default': MISSING | ND | SENTINEL,
+    'strict': MISSING | ND | SENTINEL | STUCK | JUMP | MISMATCH,
+}
+default_policy = 'default'
+
+### Anomaly detection settings #################################################
+
+# Known wrong values (a bunch of consumption data is stuck at 100 MW)
+sentinel_values = {u'Consommation': (100,)}
+
+# Minimal length of a run of identical values to be flagged as stuck
+# (4 hours). Zero values are not flagged (no production), nor the columns
+# which vary slowly by nature.
+stuck_length = 4*4
+stuck_exempt = (u'Taux de Co2',)
+
+# Steps larger than `jump_factor` times the 99.9th percentile
+# of the steps of a column are flagged as jumps
+jump_factor = 3
+jump_exempt = (u'Co2', u'Taux de Co2')
+
+# Production balance: sum(production) + exchanges balance = consumption
+balance_columns = [u'Nucléaire', u'Gaz', u'Charbon', u'Fioul + pointe',
+                   u'Hydraulique', u'Eolien', u'Autres', u'Solde']
+# (columns which are counted only when available)
+optional_balance_columns = [u'Solaire', u'Pompage']
+mismatch_tolerance = 1000 # MW
+
+def policy_flags(policy=None):
+    '''flags masked by a quality `policy`: a name of `quality_policies`,
+    or a bitmask of flags [default: `default_policy`]'''
+    if policy is None:
+        policy = default_policy
+    if isinstance(policy, str):
+        if policy not in quality_policies:
+            raise ValueError('unknown quality policy "%s"' % policy)
+        return quality_policies[policy]
+    return int(policy)
+
+def describe_flags(flags):
+    '''names of the flags of the bitmask `flags`, as a string'''
+    return '|'.join(name for flag, name in flag_names if flags & flag)
+
+### Flags computation ##########################################################
+
+def _runs(same):
+    '''start and stop indices of the runs of True in the 1D bool array `same`'''
+    edges = np.diff(np.r_[0, same.astype(np.int8), 0])
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def stuck_flags(x, valid, length=stuck_length):
+    '''samples of `x` which belong to a run of at least `length` identical
+    non zero valid values (vectorized, 1D arrays)'''
+    stuck = np.zeros(len(x), dtype=bool)
+    same = (x[1:] == x[:-1]) & valid[1:] & valid[:-1] & (x[1:] != 0)
+    starts, stops = _runs(same)
+    # a run of `k` equal steps is a run of `k+1` samples
+    long_runs = (stops - starts + 1) >= length
+    edges = np.zeros(len(x)+1, dtype=np.int32)
+    np.add.at(edges, starts[long_runs], 1)
+    np.add.at(edges, stops[long_runs]+1, -1)
+    stuck[:] = np.cumsum(edges[:-1]) > 0
+    return stuck
+
+def jump_threshold(x, valid, factor=jump_factor):
+    '''threshold of the jump detection: `factor` times the 99.9th percentile
+    of the steps between the valid samples of `x` (None if `x` has less than
+    two valid samples)'''
+    index = np.flatnonzero(valid)
+    if len(index) < 2:
+        return None
+    steps = np.abs(np.diff(x[index].astype(np.int64)))
+    return float(factor*np.percentile(steps, 99.9))
+
+def jump_flags(x, valid, factor=jump_factor, threshold=None):
+    '''samples of `x` whose step from the previous valid sample is larger
+    than `factor` times the 99.9th percentile of the steps (1D arrays),
+    or than `threshold` if given (see `jump_threshold`)'''
+    jump = np.zeros(len(x), dtype=bool)
+    index = np.flatnonzero(valid)
+    if threshold is None:
+        threshold = jump_threshold(x, valid, factor)
+    if len(index) < 2 or threshold is None:
+        return jump
+    steps = np.abs(np.diff(x[index].astype(np.int64)))
+    jump[index[1:][steps > max(threshold, 1)]] = True
+    return jump
+
+def mismatch_flags(values, valid, columns, tolerance=mismatch_tolerance):
+    '''rows where the production balance doesn't match the consumption
+    (only for the rows where it can be computed)'''
+    mismatch = np.zeros(len(values), dtype=bool)
+    if u'Consommation' not in columns or \
+       not all(label in columns for label in balance_columns):
+        return mismatch
+    j = [columns.index(label) for label in balance_columns]
+    j_opt = [columns.index(label) for label in optional_balance_columns
+             if label in columns]
+    j_consum = columns.index(u'Consommation')
+    complete = valid[:,j].all(axis=1) & valid[:,j_consum]
+    balance = values[:,j].astype(np.int64).sum(axis=1)
+    balance += np.where(valid[:,j_opt], values[:,j_opt], 0).sum(axis=1)
+    balance -= values[:,j_consum]
+    mismatch[complete] = np.abs(balance[complete]) > tolerance
+    return mismatch
+
+def compute_flags(values, valid, columns, markers=None, jump_thresholds=None):
+    '''quality flags of a block of data (all the rows of a store)
+
+    Parameters
+    ----------
+    values : 2D int array of shape (n, nb_columns)
+    valid : 2D bool array of shape (n, nb_columns)
+    columns : list of str
+        labels of the columns
+    markers : 2D uint8 array, optional
+        MISSING and ND flags read from the daily files
+        [default: MISSING for the invalid data]
+    jump_thresholds : dict, optional
+        thresholds of the jump detection, by column label: used for the
+        columns in the dict, computed on the block (and added to the dict)
+        for the other ones
+
+    Returns
+    -------
+    flags : 2D uint8 array of shape (n, nb_columns)
+    '''
+    if jump_thresholds is None:
+        jump_thresholds = {}
+    if markers is None:
+        flags = np.where(valid, 0, MISSING).astype(st.flags_dtype)
+    else:
+        flags = (np.asarray(markers) & marker_flags).astype(st.flags_dtype)
+    for j, label in enumerate(columns):
+        x, ok = values[:,j], valid[:,j]
+        for value in sentinel_values.get(label, ()):
+            flags[ok & (x == value), j] |= SENTINEL
+        # Sentinel values are excluded from the other detections:
+        ok = ok & (flags[:,j] & SENTINEL == 0)
+        if label not in stuck_exempt:
+            flags[stuck_flags(x, ok), j] |= STUCK
+        if label not in jump_exempt:
+            if label not in jump_thresholds:
+                jump_thresholds[label] = jump_threshold(x, ok)
+            flags[jump_flags(x, ok, threshold=jump_thresholds[label]), j] |= \
+                JUMP
+    # (a balance mismatch is flagged on the columns of the balance only)
+    mismatch = mismatch_flags(values, valid, columns)
+    for j, label in enumerate(columns):
+        if label in balance_columns + optional_balance_columns + \
+                    [u'Consommation']:
+            flags[mismatch, j] |= MISMATCH
+    flags[~valid] &= marker_flags # no anomaly on unavailable data
+    return flags
+
+def _run_start(x, valid, row, chunk=7*96):
+    '''first row of the run of identical non zero valid values of `x`
+    which contains `row` (backward search, chunk by chunk)'''
+    while row > 0:
+        lo = max(row - chunk, 0)
+        xs, vs = x[lo:row+1], valid[lo:row+1]
+        same = (xs[1:] == xs[:-1]) & vs[1:] & vs[:-1] & (xs[1:] != 0)
+        breaks = np.flatnonzero(~same)
+        if len(breaks):
+            return lo + breaks[-1] + 1
+        row = lo
+    return 0
+
+def update_flags(store_dir, start_row=0):
+    '''compute the quality flags of a store, and save them in the store
+    directory (the MISSING and ND flags written at aggregation time are kept)
+
+    With `start_row`, after an incremental aggregation, only the flags
+    which may depend on the rows from `start_row` onward are computed again:
+    from the start of the runs of identical values which contain the row
+    before (stuck values), using the thresholds of the jump detection
+    recorded in the header by the last full computation.
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store
+    start_row : int
+        first new or changed row [default: 0, all the rows]
+
+    Returns
+    -------
+    counts : dict of the number of samples of each flag, by column label
+        (of the rows computed again)
+    '''
+    header = st.read_json(store_dir, st.header_filename)
+    columns, nb_rows = header['columns'], header['nb_rows']
+    path = lambda name: os.path.join(store_dir, name)
+    read = lambda name, dtype: np.memmap(path(name), dtype=dtype, mode='r',
+                                         shape=(nb_rows,)) \
+                               if nb_rows else np.zeros(0, dtype)
+    if 'flags_dtype' not in header or 'jump_thresholds' not in header:
+        start_row = 0
+    # First row to be computed again, by column (`begin`), and first row
+    # read (`lo`: with the previous valid sample, for the jump detection)
+    begin = [min(start_row, nb_rows)]*len(columns)
+    lo = begin[0]
+    for j in range(len(columns)):
+        if 0 < begin[j] < nb_rows:
+            x = read(st.column_filename % j, header['value_dtype'])
+            valid = read(st.valid_filename % j, header['valid_dtype'])
+            begin[j] = _run_start(x, valid, begin[j]-1)
+            previous = np.flatnonzero(valid[:begin[j]])
+            lo = min(lo, previous[-1] if len(previous) else 0)
+    if lo == 0:
+        begin = [0]*len(columns)
+    values = np.empty((nb_rows-lo, len(columns)), header['value_dtype'])
+    valid = np.empty((nb_rows-lo, len(columns)), bool)
+    markers = None
+    if 'flags_dtype' in header:
+        markers = np.empty((nb_rows-lo, len(columns)), st.flags_dtype)
+    for j in range(len(columns)):
+        values[:,j] = read(st.column_filename % j, header['value_dtype'])[lo:]
+        valid[:,j] = read(st.valid_filename % j, header['valid_dtype'])[lo:]
+        if markers is not None:
+            markers[:,j] = read(st.flags_filename % j, st.flags_dtype)[lo:]
+    jump_thresholds = header.get('jump_thresholds', {}) if lo > 0 else {}
+    flags = compute_flags(values, valid, columns, markers, jump_thresholds)
+    if markers is not None:
+        # (the flags before `begin` are kept)
+        for j in range(len(columns)):
+            flags[:begin[j]-lo,j] = markers[:begin[j]-lo,j]
+    for j in range(len(columns)):
+        with open(path(st.flags_filename % j),
+                  'r+b' if lo > 0 else 'wb') as f:
+            f.seek(lo*np.dtype(st.flags_dtype).itemsize)
+            np.ascontiguousarray(flags[:,j]).tofile(f)
+    header['flags_dtype'] = st.flags_dtype
+    if lo == 0:
+        header['jump_thresholds'] = jump_thresholds
+    st.write_json(store_dir, st.header_filename, header)
+    return flag_counts(flags[min(begin)-lo:], columns)
+
+def flag_counts(flags, columns):
+    '''number of samples of each flag, by column label'''
+    return dict((label, dict((name, int((flags[:,j] & flag != 0).sum()))
+                             for flag, name in flag_names))
+                for j, label in enumerate(columns))
+
+if __name__ == '__main__':
+    store_dir = sys.argv[1] if len(sys.argv) > 1 else 'RTE_eCO2mix.store'
+    print('computing the quality flags of "%s"...' % store_dir)
+    counts = update_flags(store_dir)
+    print('%-22s' % 'column' + ''.join('%10s' % name for _, name in flag_names))
+    for label in st.read_json(store_dir, st.header_filename)['columns']:
+        print('%-22s' % label +
+              ''.join('%10d' % counts[label][name] for _, name in flag_names))
@@ -0,0 +1,262 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix rollup cube
+
+pre-aggregated statistics of the columns of a store, at several time
+resolutions ("levels"), computed once at aggregation time, so that
+long-range plots read a few kilobytes instead of the 15 minutes data.
+
+Levels: 'hour', 'day', 'week' (ISO weeks, starting on Monday),
+'month' and 'year'.
+Statistics: 'mean', 'min', 'max', 'sum' and 'count' (number of valid samples).
+Invalid data (see `RTE_eCO2mix_load.Store.masked`) is ignored, and the
+statistics of a period without valid sample are masked when read.
+
+The cube is saved in the store directory:
+
+* "rollup.json": the levels, their number of periods and the columns
+* "rollup_<level>_period.bin": int64 start of each period, in minutes
+  since 1970-01-01 00:00 (local time, as the store timestamps)
+* "rollup_<level>_<stat>.bin": one 2D array per statistic,
+  of shape (nb_periods, nb_columns)
+
+Example::
+
+    rollup = Rollup('RTE_eCO2mix_2000-06-24_2012-02-19.store')
+    week = rollup.period('week')                   # datetime64[m] array
+    consum7d = rollup.get('week', 'mean', u'Consommation') # masked, in MW
+"""
+from __future__ import print_function, division
+
+import os.path
+import numpy as np
+
+import RTE_eCO2mix_store as st
+from RTE_eCO2mix_load import Store
+
+rollup_levels = ['hour', 'day', 'week', 'month', 'year']
+rollup_stats = ['mean', 'min', 'max', 'sum', 'count']
+
+# Data type of each statistic
+# (sums of MW values over a year overflow int32)
+stat_dtypes = {'mean': 'float64', 'min': st.value_dtype, 'max': st.value_dtype,
+               'sum': 'int64', 'count': 'int32'}
+
+rollup_header_filename = 'rollup.json'
+rollup_filename = 'rollup_%s_%s.bin' # level, stat (or 'period')
+
+def period_start(timestamps, level):
+    '''start of the `level` period of each timestamp
+
+    Parameters
+    ----------
+    timestamps : int64 array
+        in minutes since 1970-01-01 00:00 (or datetime64[m] array)
+    level : str
+        one of `rollup_levels`
+
+    Returns
+    -------
+    int64 array, in minutes since 1970-01-01 00:00
+    '''
+    t = np.asarray(timestamps).astype('datetime64[m]').astype(np.int64)
+    if level == 'hour':
+        return t - t % 60
+    if level == 'day':
+        return t - t % (24*60)
+    if level == 'week':
+        # 1970-01-01 is a Thursday: Monday 1969-12-29 is 3 days before
+        return t - (t + 3*24*60) % (7*24*60)
+    if level in ('month', 'year'):
+        unit = {'month': 'M', 'year': 'Y'}[level]
+        t = t.astype('datetime64[m]').astype('datetime64[%s]' % unit)
+        return t.astype('datetime64[m]').astype(np.int64)
+    raise ValueError('unknown rollup level "%s"' % level)
+
+def compute_rollup(timestamps, values, valid, level):
+    '''statistics of `values` over each `level` period
+
+    Parameters
+    ----------
+    timestamps : int64 array of shape (n,), sorted
+        in minutes since 1970-01-01 00:00 (or datetime64[m] array)
+    values : array of shape (n, nb_columns)
+    valid : bool array of shape (n, nb_columns)
+    level : str
+        one of `rollup_levels`
+
+    Returns
+    -------
+    periods : int64 array of shape (nb_periods,)
+        start of each period
+    stats : dict of arrays of shape (nb_periods, nb_columns),
+        indexed by statistic (see `rollup_stats`).
+        'min' and 'max' are 0 and 'mean' is NaN when 'count' is 0
+    '''
+    start = period_start(timestamps, level)
+    values = np.asarray(values)
+    # (explicit number of columns, for an empty time range)
+    values = values.reshape(len(start), int(np.prod(values.shape[1:])))
+    valid = np.asarray(valid, dtype=bool).reshape(values.shape)
+    if len(start) == 0:
+        periods = start
+        stats = dict((stat, np.zeros((0, values.shape[1]), stat_dtypes[stat]))
+                     for stat in rollup_stats)
+        return periods, stats
+    # Periods are contiguous in the sorted timestamps:
+    first = np.flatnonzero(np.r_[True, start[1:] != start[:-1]])
+    periods = start[first]
+    iinfo = np.iinfo(st.value_dtype)
+    count = np.add.reduceat(valid, first, axis=0).astype(stat_dtypes['count'])
+    total = np.add.reduceat(np.where(valid, values, 0).astype(np.int64),
+                            first, axis=0)
+    vmin = np.minimum.reduceat(np.where(valid, values, iinfo.max),
+                               first, axis=0)
+    vmax = np.maximum.reduceat(np.where(valid, values, iinfo.min),
+                               first, axis=0)
+    empty = (count == 0)
+    vmin[empty] = 0
+    vmax[empty] = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total/count
+    stats = {'mean': mean, 'min': vmin, 'max': vmax, 'sum': total,
+             'count': count}
+    for stat in rollup_stats:
+        stats[stat] = stats[stat].astype(stat_dtypes[stat])
+    return periods, stats
+
+def _write_periods(path, nb_kept, array):
+    '''write `array` in a binary file of the cube, after its `nb_kept`
+    first periods (the following ones are truncated)'''
+    row_size = array.itemsize*int(np.prod(array.shape[1:]))
+    with open(path, 'r+b' if nb_kept else 'wb') as f:
+        f.truncate(nb_kept*row_size)
+        f.seek(0, os.SEEK_END)
+        np.ascontiguousarray(array).tofile(f)
+
+def write_rollup(store_dir, levels=rollup_levels, start_row=0):
+    '''compute the rollup cube of a store, and save it in the store directory
+
+    The data masked by the default quality policy of the loader
+    (see `RTE_eCO2mix_load.Store.masked`) is treated as invalid data.
+
+    With `start_row`, after an incremental aggregation, only the periods
+    from the one which contains `start_row` onward are computed again
+    (if the existing cube has the same levels and columns).
+
+    Returns
+    -------
+    nb_periods : dict of the number of periods, indexed by level
+    '''
+    store = Store(store_dir)
+    timestamps = np.asarray(store.timestamp()).astype(np.int64)
+    path = lambda level, name: os.path.join(store_dir,
+                                            rollup_filename % (level, name))
+    # Number of periods kept, and first row computed again, by level:
+    nb_kept = dict((level, 0) for level in levels)
+    first_row = dict((level, 0) for level in levels)
+    header_path = os.path.join(store_dir, rollup_header_filename)
+    if 0 < start_row < store.nb_rows and os.path.exists(header_path):
+        header = st.read_json(store_dir, rollup_header_filename)
+        if header['columns'] == store.columns and \
+           sorted(header['nb_periods']) == sorted(levels) and \
+           start_row <= header['store_nb_rows']:
+            for level in levels:
+                start = period_start(timestamps[start_row:start_row+1],
+                                     level)[0]
+                periods = np.fromfile(path(level, 'period'), np.int64,
+                                      count=header['nb_periods'][level])
+                nb_kept[level] = np.searchsorted(periods, start)
+                first_row[level] = np.searchsorted(
+                    period_start(timestamps, level), start)
+    lo = min(first_row.values()) if levels else 0
+    values = np.empty((store.nb_rows-lo, len(store.columns)), st.value_dtype)
+    valid = np.empty(values.shape, bool)
+    for j, label in enumerate(store.columns):
+        column = store.masked(label, rows=slice(lo, None))
+        values[:,j] = column.data
+        valid[:,j] = ~np.ma.getmaskarray(column)
+    nb_periods = {}
+    for level in levels:
+        rows = slice(first_row[level] - lo, None)
+        periods, stats = compute_rollup(timestamps[first_row[level]:],
+                                        values[rows], valid[rows], level)
+        _write_periods(path(level, 'period'), nb_kept[level], periods)
+        for stat in rollup_stats:
+            _write_periods(path(level, stat), nb_kept[level], stats[stat])
+        nb_periods[level] = int(nb_kept[level] + len(periods))
+    header = {'version': st.store_version,
+              'store_nb_rows': store.nb_rows,
+              'columns': store.columns,
+              'nb_periods': nb_periods,
+              'stat_dtypes': stat_dtypes}
+    st.write_json(store_dir, rollup_header_filename, header)
+    return nb_periods
+
+class Rollup(object):
+    '''read access to the rollup cube of a store, through memory-mapping
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store (with a cube written by `write_rollup`)
+    '''
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.header = st.read_json(store_dir, rollup_header_filename)
+        self.columns = self.header['columns']
+        self.levels = [level for level in rollup_levels
+                       if level in self.header['nb_periods']]
+
+    def _memmap(self, level, name, dtype, shape):
+        '''memory-map one binary file of the cube (read-only)'''
+        if self.header['nb_periods'][level] == 0:
+            return np.zeros(shape, dtype=dtype)
+        path = os.path.join(self.store_dir, rollup_filename % (level, name))
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+    def period(self, level):
+        '''start of the periods of `level`, as a datetime64[m] array'''
+        if level not in self.levels:
+            raise KeyError('level "%s" not found in the rollup of %s' %\
+                           (level, self.store_dir))
+        nb_periods = self.header['nb_periods'][level]
+        t = self._memmap(level, 'period', np.int64, (nb_periods,))
+        return t.view('datetime64[m]')
+
+    def get(self, level, stat, label=None):
+        '''statistic `stat` over the periods of `level`
+
+        Parameters
+        ----------
+        level : str
+            one of 'hour', 'day', 'week', 'month' or 'year'
+        stat : str
+            one of 'mean', 'min', 'max', 'sum' or 'count'
+        label : str, optional
+            which column to get [default: all the columns, as a 2D array]
+
+        Returns
+        -------
+        masked array (masked for the periods without valid data,
+        except for 'count')
+        '''
+        nb_periods = len(self.period(level))
+        if stat not in rollup_stats:
+            raise KeyError('unknown rollup statistic "%s"' % stat)
+        shape = (nb_periods, len(self.columns))
+        data = self._memmap(level, stat, self.header['stat_dtypes'][stat], shape)
+        if stat == 'count':
+            mask = np.zeros(shape, dtype=bool)
+        else:
+            count = self._memmap(level, 'count',
+                                 self.header['stat_dtypes']['count'], shape)
+            mask = (count == 0)
+        if label is not None:
+            if label not in self.columns:
+                raise KeyError('column "%s" not found in the rollup of %s' %\
+                               (label, self.store_dir))
+            j = self.columns.index(label)
+            data, mask = data[:,j], mask[:,j]
+        return np.ma.MaskedArray(data, mask=mask)
+# end Rollup
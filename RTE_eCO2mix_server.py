@@ -0,0 +1,475 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix local query service
+
+small HTTP/JSON service on top of an aggregated store, so that several
+scripts (or users on the same machine) query the data without loading
+it each time: the store is memory-mapped once by the service.
+
+Queries (GET, parameters in the query string):
+
+* /info: columns, number of rows, time range and version of the dataset
+* /range?columns=Consommation,Gaz&start=2012-02-01&stop=2012-02-08
+  15 minutes data (optionally decimated with `nb_points`, see
+  RTE_eCO2mix_mix.decimate)
+* /rollup?level=week&stat=mean&columns=Consommation&start=2011-01-01
+  statistics per period (from the rollup cube when it is up to date,
+  see RTE_eCO2mix_rollup.py)
+* /records?column=Consommation&xmin=70000&delta_hours=6
+  running records (see RTE_eCO2mix_stats.running_records)
+* /ldc?column=Consommation&years=2010,2011&hours=0,2000,4000
+  points of the yearly load duration curves (or, with `levels`, the duration
+  above each power level, see RTE_eCO2mix_stats.LoadDurationCurves)
+
+`start` and `stop` (excluded) are ISO 8601 local times, `policy` a quality
+policy (see RTE_eCO2mix_quality.py). Unavailable (masked) data is `null`.
+Errors are answered with status 400 (or 404, or 500 for an unexpected
+error) and an "error" message.
+
+Responses are cached in an LRU cache, keyed by the query and the version of
+the dataset: the size and mtime of the header of the store (and of its
+rollup cube), which are rewritten when the incremental aggregation adds
+or changes days. The store is then opened again.
+
+The service listens on localhost only, by default::
+
+    python RTE_eCO2mix_server.py RTE_eCO2mix.store --port 8765
+    curl 'http://127.0.0.1:8765/records?column=Consommation&xmin=70000'
+
+`QueryService.query` answers the same queries without HTTP.
+"""
+from __future__ import print_function, division
+
+import os.path, json, threading, argparse, traceback
+from collections import OrderedDict
+try: # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, parse_qs
+except ImportError: # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+import numpy as np
+
+import RTE_eCO2mix_store as st
+import RTE_eCO2mix_quality as q
+from RTE_eCO2mix_load import Store
+from RTE_eCO2mix_rollup import Rollup, compute_rollup, period_start, \
+                               rollup_header_filename
+from RTE_eCO2mix_stats import running_records, LoadDurationCurves
+from RTE_eCO2mix_mix import decimate
+
+default_host = '127.0.0.1'
+default_port = 8765
+
+# Number of responses kept in the cache
+cache_size = 256
+# Maximum number of rows of a /range response (use `nb_points` beyond)
+max_rows = 200000
+
+class QueryError(ValueError):
+    '''invalid query (answered with status 400, or `status`)'''
+    def __init__(self, message, status=400):
+        ValueError.__init__(self, message)
+        self.status = status
+
+class LRUCache(object):
+    '''least recently used cache, with at most `size` entries (thread-safe)'''
+    def __init__(self, size=cache_size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''cached value of `key` (None if not cached)'''
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries[key] = value # most recently used
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+# end LRUCache
+
+def dataset_version(store_dir):
+    '''version of a store: size and mtime of its header
+    and of the header of its rollup cube (if any)'''
+    version = []
+    for filename in (st.header_filename, rollup_header_filename):
+        path = os.path.join(store_dir, filename)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            version.append('%d-%d' % (stat.st_size, int(stat.st_mtime*1e6)))
+    return '/'.join(version)
+
+### JSON encoding ##############################################################
+
+def _times(t):
+    '''ISO 8601 strings of a datetime64 array (minute resolution)'''
+    return np.datetime_as_string(np.asarray(t).astype('datetime64[m]')).tolist()
+
+def _values(data):
+    '''nested lists of the values of a (masked) array,
+    None for the masked (or NaN) data'''
+    data = np.ma.asarray(data)
+    mask = np.ma.getmaskarray(data)
+    if data.dtype.kind == 'f':
+        mask = mask | np.isnan(data.data)
+    values = data.data.astype(object) # (Python numbers)
+    values[mask] = None
+    return values.tolist()
+
+### Query parameters ###########################################################
+
+def _param(params, name, default=None, required=False):
+    '''value of a query parameter (the last one, if repeated)'''
+    if name in params:
+        return params[name][-1]
+    if required:
+        raise QueryError('missing parameter "%s"' % name)
+    return default
+
+def _list_param(params, name, convert=str, default=None):
+    '''comma-separated list parameter'''
+    value = _param(params, name)
+    if value is None:
+        return default
+    try:
+        return [convert(v) for v in value.split(',') if v != '']
+    except ValueError:
+        raise QueryError('invalid parameter "%s": %s' % (name, value))
+
+def _number_param(params, name, convert=float, default=None):
+    value = _param(params, name)
+    if value is None:
+        return default
+    try:
+        return convert(value)
+    except ValueError:
+        raise QueryError('invalid parameter "%s": %s' % (name, value))
+
+def _time_param(params, name):
+    value = _param(params, name)
+    if value is None:
+        return None
+    try:
+        return np.datetime64(value, 'm')
+    except ValueError:
+        raise QueryError('invalid time "%s": %s' % (name, value))
+
+def _policy_param(params):
+    policy = _param(params, 'policy')
+    if policy is not None and policy.isdigit():
+        policy = int(policy)
+    try:
+        q.policy_flags(policy)
+    except ValueError as exc:
+        raise QueryError(str(exc))
+    return policy
+
+### Query service ##############################################################
+
+class QueryService(object):
+    '''answers the queries on a store (see the module docstring),
+    with an LRU cache of the responses
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store
+    cache_size : int
+        number of responses kept in the cache
+    '''
+    def __init__(self, store_dir, cache_size=cache_size):
+        self.store_dir = store_dir
+        self.cache = LRUCache(cache_size)
+        self.version = None
+        self._lock = threading.Lock()
+        self._check_version()
+
+    def _check_version(self):
+        '''open the store again if its version changed
+        (the cached responses of the previous version are dropped)
+
+        Returns
+        -------
+        version : str
+        '''
+        version = dataset_version(self.store_dir)
+        with self._lock:
+            if version != self.version:
+                self.store = Store(self.store_dir)
+                try:
+                    self.rollup = Rollup(self.store_dir)
+                except (IOError, OSError):
+                    self.rollup = None
+                self.ldc = LoadDurationCurves(self.store)
+                self.cache.clear()
+                self.version = version
+            return self.version
+
+    def query(self, path, params=None):
+        '''answer a query
+
+        Parameters
+        ----------
+        path : str
+            '/info', '/range', '/rollup', '/records' or '/ldc'
+        params : dict, optional
+            parameters of the query, by name (a value or a list of values,
+            as returned by `parse_qs`)
+
+        Returns
+        -------
+        response : bytes (JSON)
+
+        Raises
+        ------
+        QueryError for an invalid query
+        '''
+        params = dict((name, value if isinstance(value, list) else [value])
+                      for name, value in (params or {}).items())
+        path = path.rstrip('/')
+        handler = self._handlers.get(path)
+        if handler is None:
+            raise QueryError('unknown query "%s"' % path, 404)
+        version = self._check_version()
+        key = (path, tuple(sorted((name, tuple(value))
+                                  for name, value in params.items())), version)
+        response = self.cache.get(key) if path not in self._uncached else None
+        if response is None:
+            try:
+                result = handler(self, params)
+            except QueryError:
+                raise
+            except (KeyError, ValueError) as exc:
+                raise QueryError(exc.args[0] if exc.args else repr(exc))
+            response = json.dumps(result, ensure_ascii=False,
+                                  sort_keys=True).encode('utf-8')
+            if path not in self._uncached:
+                self.cache.put(key, response)
+        return response
+
+    def _columns(self, params):
+        columns = _list_param(params, 'columns', default=self.store.columns)
+        for label in columns:
+            if label not in self.store.columns:
+                raise QueryError('unknown column "%s"' % label)
+        return columns
+
+    def _column(self, params):
+        label = _param(params, 'column', required=True)
+        if label not in self.store.columns:
+            raise QueryError('unknown column "%s"' % label)
+        return label
+
+    def info(self, params):
+        t = self.store.timestamp()
+        return {'columns': self.store.columns, 'nb_rows': self.store.nb_rows,
+                'start': _times(t[:1])[0] if len(t) else None,
+                'stop': _times(t[-1:])[0] if len(t) else None,
+                'version': self.version, 'has_flags': self.store.has_flags,
+                'rollup_levels': self.rollup.levels if self.rollup else [],
+                'cache': {'size': len(self.cache), 'hits': self.cache.hits,
+                          'misses': self.cache.misses}}
+
+    def range_query(self, params):
+        columns = self._columns(params)
+        nb_points = _number_param(params, 'nb_points', int)
+        method = _param(params, 'method', 'minmax')
+        rows = self.store.row_range(_time_param(params, 'start'),
+                                    _time_param(params, 'stop'))
+        if nb_points is None and rows.stop - rows.start > max_rows:
+            raise QueryError('more than %d rows requested: reduce the time '
+                             'range, or decimate with "nb_points"' % max_rows)
+        t, data = self.store.window(_time_param(params, 'start'),
+                                    _time_param(params, 'stop'), columns,
+                                    _policy_param(params))
+        if nb_points is not None and len(t) > nb_points and columns:
+            # (samples selected on the first column)
+            t, data = decimate(t, data, nb_points, method, key=data[:,0])
+        return {'columns': columns, 'time': _times(t), 'data': _values(data)}
+
+    def rollup_query(self, params):
+        level = _param(params, 'level', required=True)
+        stat = _param(params, 'stat', 'mean')
+        columns = self._columns(params)
+        policy = _policy_param(params)
+        start, stop = _time_param(params, 'start'), _time_param(params, 'stop')
+        rows = self.store.row_range(start, stop)
+        rollup = self.rollup
+        if rollup is not None and level in rollup.levels and \
+           rollup.header['store_nb_rows'] == self.store.nb_rows and \
+           q.policy_flags(policy) == q.policy_flags() and \
+           all(label in rollup.columns for label in columns):
+            # Periods which overlap the rows of the time window:
+            timestamps = self.store.timestamp()
+            periods = rollup.period(level)
+            first = last = 0
+            if rows.stop > rows.start:
+                first = np.searchsorted(periods, timestamps[rows.start],
+                                        'right') - 1
+                last = np.searchsorted(periods, timestamps[rows.stop-1],
+                                       'right')
+            data = np.ma.column_stack([rollup.get(level, stat, label)[first:last]
+                                       for label in columns]) \
+                   if columns else np.ma.zeros((last - first, 0))
+            periods = periods[first:last]
+            # The first and last periods, when cut by the time window,
+            # are computed on the rows of the window (as without the cube):
+            if columns and last > first:
+                window_periods = period_start(timestamps[rows], level)\
+                                 .astype('datetime64[m]')
+                outside = period_start(timestamps[[max(rows.start-1, 0),
+                                       min(rows.stop, len(timestamps)-1)]],
+                                       level).astype('datetime64[m]')
+                if rows.start > 0 and outside[0] == periods[0]:
+                    end = np.searchsorted(window_periods, periods[0], 'right')
+                    data[0] = self._rows_rollup(
+                        slice(rows.start, rows.start + end), columns, policy,
+                        level, stat)
+                if rows.stop < len(timestamps) and outside[1] == periods[-1]:
+                    begin = np.searchsorted(window_periods, periods[-1], 'left')
+                    data[-1] = self._rows_rollup(
+                        slice(rows.start + begin, rows.stop), columns, policy,
+                        level, stat)
+        else:
+            if stat not in ('mean', 'min', 'max', 'sum', 'count'):
+                raise QueryError('unknown rollup statistic "%s"' % stat)
+            t, window = self.store.window(start, stop, columns, policy)
+            periods, stats = compute_rollup(t, window.data,
+                                            ~np.ma.getmaskarray(window), level)
+            data = stats[stat]
+            if stat != 'count':
+                data = np.ma.MaskedArray(data, mask=(stats['count'] == 0))
+        return {'columns': columns, 'level': level, 'stat': stat,
+                'time': _times(periods), 'data': _values(data)}
+
+    def _rows_rollup(self, rows, columns, policy, level, stat):
+        '''statistic `stat` of the `rows` of the store, which are in
+        one `level` period (see `compute_rollup`)'''
+        data = np.ma.column_stack([self.store.masked(label, rows=rows,
+                                                     policy=policy)
+                                   for label in columns])
+        _, stats = compute_rollup(self.store.timestamp()[rows],
+                                  np.ma.getdata(data),
+                                  ~np.ma.getmaskarray(data), level)
+        if stat == 'count':
+            return stats[stat][0]
+        return np.ma.MaskedArray(stats[stat][0], mask=(stats['count'][0] == 0))
+
+    def records(self, params):
+        label = self._column(params)
+        xmin = _number_param(params, 'xmin', float, -np.inf)
+        delta_hours = _number_param(params, 'delta_hours', float, 0)
+        rows = self.store.row_range(_time_param(params, 'start'),
+                                    _time_param(params, 'stop'))
+        x = self.store.masked(label, rows=rows, policy=_policy_param(params))
+        step = self.store.time_step() or 15
+        arg_records, values = running_records(x, xmin,
+                                              int(delta_hours*60//step))
+        t = self.store.timestamp()[rows][arg_records]
+        return {'column': label, 'time': _times(t), 'data': _values(values)}
+
+    def ldc(self, params):
+        label = self._column(params)
+        years = _list_param(params, 'years', int) or self.ldc.complete_years()
+        hours = _list_param(params, 'hours', float)
+        levels = _list_param(params, 'levels', float)
+        if (hours is None) == (levels is None):
+            raise QueryError('one of the parameters "hours" or "levels" '
+                             'is required')
+        if hours is not None:
+            points = self.ldc.points(label, years, hours,
+                                     _param(params, 'missing', 'drop'))
+            return {'column': label, 'years': years, 'hours': hours,
+                    'data': _values(points)}
+        curves = self.ldc.curves(label, years, levels)
+        return {'column': label, 'years': years, 'levels': levels,
+                'data': _values(curves)}
+
+    _handlers = {'/info': info, '/range': range_query, '/rollup': rollup_query,
+                 '/records': records, '/ldc': ldc}
+    # (the dataset info is always computed again, with the cache statistics)
+    _uncached = ('/info',)
+# end QueryService
+
+### HTTP server ################################################################
+
+class QueryHandler(BaseHTTPRequestHandler):
+    '''HTTP front-end of the `QueryService` of the server'''
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            status = 200
+            body = self.server.service.query(url.path,
+                                             parse_qs(url.query, True))
+        except QueryError as exc:
+            status = exc.status
+            body = json.dumps({'error': str(exc)}).encode('utf-8')
+        except Exception as exc:
+            # (bug, or unreadable store: the server keeps running)
+            traceback.print_exc()
+            status = 500
+            body = json.dumps({'error': 'internal error: %r' % exc})\
+                   .encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class QueryServer(ThreadingMixIn, HTTPServer):
+    '''threaded HTTP server of a `QueryService`'''
+    daemon_threads = True
+
+    def __init__(self, service, host=default_host, port=default_port,
+                 verbose=False):
+        HTTPServer.__init__(self, (host, port), QueryHandler)
+        self.service = service
+        self.verbose = verbose
+
+def make_server(store_dir, host=default_host, port=default_port,
+                cache_size=cache_size, verbose=False):
+    '''HTTP server of the queries on a store (call its `serve_forever` method;
+    with `port` 0, the port is chosen by the system: see `server_address`)'''
+    return QueryServer(QueryService(store_dir, cache_size), host, port, verbose)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='local HTTP/JSON query service on an aggregated store')
+    parser.add_argument('store_dir', nargs='?', default='RTE_eCO2mix.store')
+    parser.add_argument('--host', default=default_host)
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--cache-size', type=int, default=cache_size)
+    args = parser.parse_args()
+    server = make_server(args.store_dir, args.host, args.port,
+                         args.cache_size, verbose=True)
+    print('serving "%s" on http://%s:%d/' % ((args.store_dir,) +
+                                            server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
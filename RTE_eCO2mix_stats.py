@@ -0,0 +1,539 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix statistics
+
+vectorized statistics on éCO2mix time series (15 minutes timestep),
+which accept masked arrays (masked data is ignored):
+
+* running records (e.g. peak demand records)
+* rolling window statistics (mean, std, min, max, quantile),
+  whose cost doesn't depend on the window length
+* load duration curves (the power exceeded during a given duration),
+  by partial selection (`np.partition`) or with fixed bins histograms,
+  for several years and columns at once
+
+The analyses of a store can be memoized on disk, chunk by chunk
+(see RTE_eCO2mix_cache.py): only the chunks whose data changed
+are computed again.
+"""
+from __future__ import print_function, division
+
+from bisect import bisect_left, insort
+import numpy as np
+
+def _filled(x, fill_value):
+    '''float copy of `x` with masked and NaN data replaced by `fill_value`'''
+    x = np.ma.asarray(x).astype(float)
+    x = x.filled(fill_value)
+    x[np.isnan(x)] = fill_value
+    return x
+
+def _gap_filter(arg_records, delta_min):
+    '''indices of the records kept when records closer than `delta_min`
+    to the next one are dropped'''
+    keep = np.ones(len(arg_records), dtype=bool)
+    keep[:-1] = np.diff(arg_records) >= delta_min
+    return keep
+
+### Running records ############################################################
+
+def running_records(x, xmin=-np.inf, delta_min=0):
+    '''find the running records of one or several series,
+    above one or several thresholds
+
+    A record is a value greater than all the previous ones and than `xmin`.
+    When two records are closer than `delta_min`, only the second one is kept
+    (as in a sequential scan which replaces the last record).
+
+    Parameters
+    ----------
+    x : 1D or 2D array (possibly masked)
+        the series (2D: one series per column)
+    xmin : float or 1D array of floats
+        record thresholds
+    delta_min : int, optional
+        minimum number of samples between two records
+
+    Returns
+    -------
+    records : nested lists of (arg_records, records) tuples of arrays,
+        indexed by [series][threshold]
+        (for 1D `x` and a scalar `xmin`, only one tuple is returned)
+    '''
+    x = np.ma.asarray(x)
+    single_series = (x.ndim == 1)
+    single_threshold = np.ndim(xmin) == 0
+    # (explicit number of columns, for empty series)
+    x = _filled(x.reshape(len(x), int(np.prod(x.shape[1:]))), -np.inf)
+    thresholds = np.atleast_1d(xmin)
+    results = []
+    for column in x.T:
+        # Records without threshold: values above the running maximum
+        previous_max = np.empty_like(column)
+        previous_max[:1] = -np.inf
+        np.maximum.accumulate(column[:-1], out=previous_max[1:])
+        candidates = np.flatnonzero(column > previous_max)
+        # Apply each threshold (a record above `xmin` is also a record
+        # without threshold), then remove the close records
+        column_results = []
+        for threshold in thresholds:
+            arg_records = candidates[column[candidates] > threshold]
+            arg_records = arg_records[_gap_filter(arg_records, delta_min)]
+            column_results.append((arg_records, column[arg_records]))
+        results.append(column_results)
+    if single_threshold:
+        results = [column_results[0] for column_results in results]
+    if single_series:
+        results = results[0]
+    return results
+
+def running_record(x, xmin, delta_min=0):
+    '''find the running record in the `x` vector
+    records values under xmin are skipped.
+    records closer than `delta_min` are skipped
+    returns (arg_records, records)
+
+    (vectorized version of the function formerly defined in
+    analysis_examples/elec_consumption.py, see `running_records`)
+    '''
+    return running_records(x, xmin, delta_min)
+
+def _call(memo, func, *args):
+    '''`func(*args)`, memoized by `memo` (see RTE_eCO2mix_cache.Memo) if any'''
+    if memo is None:
+        return func(*args)
+    return memo(func, *args)
+
+def chunked_running_records(store, label, xmin=-np.inf, delta_min=0,
+                            chunk='month', policy=None, memo=None):
+    '''running records of the column `label` of a store (see `running_records`,
+    for one series and one threshold), computed chunk by chunk
+
+    The records of each chunk (greater than the previous values of the
+    chunk) are computed separately, then only those greater than the
+    maximum of the previous chunks are kept: with a `memo`, only the
+    chunks whose data changed are computed again.
+
+    Parameters
+    ----------
+    store : `RTE_eCO2mix_load.Store`
+    label : str
+        which column
+    xmin, delta_min :
+        record threshold and minimum number of samples between two records
+    chunk : str or int
+        chunk of data (see `RTE_eCO2mix_load.Store.chunk_ranges`)
+    policy : str or int, optional
+        quality policy (see `RTE_eCO2mix_load.Store.masked`)
+    memo : `RTE_eCO2mix_cache.Memo`, optional
+        memoization cache of the records of each chunk
+
+    Returns
+    -------
+    (arg_records, records) : arrays of the row indices and of the values
+    '''
+    arg_records, records = [], []
+    previous_max = -np.inf
+    for rows in store.chunk_ranges(chunk):
+        x = store.masked(label, rows=rows, policy=policy)
+        args, values = _call(memo, running_records, x, xmin)
+        keep = values > previous_max
+        arg_records.append(rows.start + args[keep])
+        records.append(values[keep])
+        if len(values):
+            previous_max = max(previous_max, values[-1])
+    if not arg_records:
+        return np.zeros(0, dtype=int), np.zeros(0)
+    arg_records = np.concatenate(arg_records)
+    records = np.concatenate(records)
+    keep = _gap_filter(arg_records, delta_min)
+    return arg_records[keep], records[keep]
+
+### Rolling window statistics #################################################
+
+def _as_columns(x):
+    '''float 2D view of `x` (one series per column) and its validity mask'''
+    x = np.ma.asarray(x)
+    # (explicit number of columns, for empty series)
+    values = x.reshape(len(x), int(np.prod(x.shape[1:])))
+    values = values.astype(float).filled(np.nan)
+    valid = ~np.isnan(values)
+    return values, valid
+
+def _window_sum(x, window):
+    '''sum of `x` over the trailing windows of length `window` (along axis 0)
+    with the cumulative sum: cost independent of `window`'''
+    cs = np.zeros((len(x)+1,) + x.shape[1:])
+    np.cumsum(x, axis=0, out=cs[1:])
+    lag = np.maximum(np.arange(1, len(x)+1) - window, 0)
+    return cs[1:] - cs[lag]
+
+def _window_reduce(x, window, ufunc, fill_value):
+    '''`ufunc` (np.maximum or np.minimum) over the trailing windows
+    of length `window` (along axis 0)
+
+    van Herk/Gil-Werman algorithm: the series is cut into blocks of length
+    `window`, and each window is the union of the end of one block
+    and the start of the next one. With the running reductions within
+    the blocks (forward and backward), the cost is 3 operations
+    per sample, whatever `window` is.
+    '''
+    n = len(x)
+    # Pad before (partial first windows) and after (complete last block)
+    nb_blocks = (n + window - 1)//window + 1
+    padded = np.full((nb_blocks*window,) + x.shape[1:], fill_value)
+    padded[window-1:window-1+n] = x
+    blocks = padded.reshape((nb_blocks, window) + x.shape[1:])
+    forward = ufunc.accumulate(blocks, axis=1).reshape(padded.shape)
+    backward = ufunc.accumulate(blocks[:,::-1], axis=1)[:,::-1]
+    backward = backward.reshape(padded.shape)
+    # Window ending at padded index i+window-1 starts at i:
+    return ufunc(backward[:n], forward[window-1:window-1+n])
+
+def _rolling_result(result, count, min_count, shape):
+    '''mask the windows with less than `min_count` valid samples'''
+    mask = count < max(min_count, 1)
+    return np.ma.MaskedArray(result, mask=mask).reshape(shape)
+
+def rolling(x, window, stat='mean', min_count=1, q=0.5):
+    '''rolling statistic of `x` over trailing windows of `window` samples
+
+    The value at index i is the statistic of the valid samples of
+    x[i-window+1:i+1] (the first windows are partial). Masked and NaN data
+    are ignored (instead of being filled with some value, which biases
+    the statistics).
+
+    Parameters
+    ----------
+    x : 1D or 2D array (possibly masked)
+        the series (2D: one series per column, all processed at once)
+    window : int
+        window length, in samples (e.g. 24*4 for 1 day)
+    stat : str
+        'mean', 'std', 'min', 'max' or 'quantile'
+    min_count : int, optional
+        minimal number of valid samples in the window,
+        below which the result is masked [default to 1]
+    q : float, optional
+        quantile level, between 0 and 1 (for stat='quantile'),
+        with linear interpolation (as `np.quantile`)
+
+    Returns
+    -------
+    masked array, of the same shape as `x`
+
+    Notes
+    -----
+    mean and std use cumulative sums, min and max the van Herk/Gil-Werman
+    algorithm: their cost per sample doesn't depend on `window`.
+    The quantile keeps the window sorted (binary search for each
+    inserted and removed sample).
+    '''
+    shape = np.shape(x)
+    window = int(window)
+    if window < 1:
+        raise ValueError('window should be at least 1 sample (%d)' % window)
+    values, valid = _as_columns(x)
+    count = _window_sum(valid.astype(float), window).round()
+    filled = np.where(valid, values, 0.)
+    if stat in ('mean', 'std'):
+        # Shift the series by their mean to limit the cancellation
+        # error in the sum of squares:
+        offset = filled.sum(axis=0)/np.maximum(valid.sum(axis=0), 1)
+        filled = np.where(valid, values - offset, 0.)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = _window_sum(filled, window)/count
+            if stat == 'mean':
+                result = mean + offset
+            else:
+                mean2 = _window_sum(filled**2, window)/count
+                result = np.sqrt(np.maximum(mean2 - mean**2, 0))
+    elif stat in ('min', 'max'):
+        ufunc, fill_value = {'min': (np.minimum, np.inf),
+                             'max': (np.maximum, -np.inf)}[stat]
+        result = _window_reduce(np.where(valid, values, fill_value), window,
+                                ufunc, fill_value)
+    elif stat == 'quantile':
+        result = np.column_stack([_rolling_quantile(column, window, q)
+                                  for column in values.T])
+        result = result.reshape(values.shape)
+    else:
+        raise ValueError('unknown rolling statistic "%s"' % stat)
+    return _rolling_result(result, count, min_count, shape)
+
+def _rolling_quantile(x, window, q):
+    '''rolling quantile of the 1D float array `x` (NaN are ignored),
+    keeping the valid samples of the window in a sorted list'''
+    result = np.empty(len(x))
+    result.fill(np.nan)
+    sorted_window = []
+    values = x.tolist()
+    for i, value in enumerate(values):
+        if value == value: # not NaN
+            insort(sorted_window, value)
+        if i >= window:
+            old = values[i-window]
+            if old == old:
+                del sorted_window[bisect_left(sorted_window, old)]
+        k = len(sorted_window)
+        if k:
+            position = q*(k-1)
+            j = int(position)
+            frac = position - j
+            result[i] = sorted_window[j]
+            if frac > 0:
+                result[i] += frac*(sorted_window[j+1] - sorted_window[j])
+    return result
+
+def rolling_mean(x, window, min_count=1):
+    '''rolling mean over trailing windows of `window` samples (see `rolling`)'''
+    return rolling(x, window, 'mean', min_count)
+
+def rolling_std(x, window, min_count=1):
+    '''rolling standard deviation over trailing windows (see `rolling`)'''
+    return rolling(x, window, 'std', min_count)
+
+def rolling_min(x, window, min_count=1):
+    '''rolling minimum over trailing windows of `window` samples (see `rolling`)'''
+    return rolling(x, window, 'min', min_count)
+
+def rolling_max(x, window, min_count=1):
+    '''rolling maximum over trailing windows of `window` samples (see `rolling`)'''
+    return rolling(x, window, 'max', min_count)
+
+def rolling_quantile(x, window, q, min_count=1):
+    '''rolling `q`-quantile over trailing windows (see `rolling`)'''
+    return rolling(x, window, 'quantile', min_count, q)
+
+### Load duration curves ######################################################
+
+def _valid_columns(x):
+    '''2D float copy of `x` (one series per column), with NaN for masked data'''
+    return _as_columns(x)[0]
+
+def load_duration_points(x, hours, period_hours=None, missing='drop',
+                         samples_per_hour=4):
+    '''power exceeded during `hours` hours, for each series of `x`
+    (i.e. points of the load duration curve)
+
+    Only the requested points are selected (`np.partition`, in O(n)),
+    instead of sorting the whole series.
+
+    Parameters
+    ----------
+    x : 1D or 2D array (possibly masked)
+        power series (2D: one series per column)
+    hours : array of floats
+        durations of the points, in hours (0: maximum power)
+    period_hours : float, optional
+        length of the period covered by `x`, in hours
+        [default: len(x)/samples_per_hour]
+    missing : str
+        how to handle masked (or NaN) data:
+
+        * 'drop': the curve is computed on the valid data only,
+          the durations being scaled from `period_hours` to the
+          duration of the valid data
+        * 'median': masked data is filled with the median of the valid data
+          (as in the former analysis scripts)
+    samples_per_hour : int
+        number of samples per hour (4 for 15 minutes data)
+
+    Returns
+    -------
+    points : masked array of shape (len(hours),) for 1D `x`,
+        or (len(hours), nb_columns) for 2D `x`
+        (masked for the series without valid data
+        and the durations longer than the period)
+    '''
+    values = _valid_columns(x)
+    hours = np.atleast_1d(np.asarray(hours, dtype=float))
+    if period_hours is None:
+        period_hours = len(values)/samples_per_hour
+    points = np.ma.masked_all((len(hours), values.shape[1]))
+    for j, column in enumerate(values.T):
+        valid = column[~np.isnan(column)]
+        n = len(valid)
+        if n == 0:
+            continue
+        if missing == 'drop':
+            rank = np.floor(hours/period_hours*n)
+        elif missing == 'median':
+            valid = np.concatenate([valid, np.repeat(np.median(valid),
+                                                     len(column) - n)])
+            n = len(valid)
+            rank = np.floor(hours*samples_per_hour)
+        else:
+            raise ValueError('unknown missing data policy "%s"' % missing)
+        # rank in decreasing order -> index in increasing order:
+        in_range = (rank >= 0) & (rank < n)
+        index = (n - 1 - rank[in_range]).astype(int)
+        if len(index):
+            points[in_range, j] = np.partition(valid, np.unique(index))[index]
+    if np.ndim(x) == 1:
+        points = points[:,0]
+    return points
+
+def load_duration_histogram(x, levels, groups=None, nb_groups=None,
+                            samples_per_hour=4):
+    '''duration (in hours) during which the power exceeds each of the `levels`,
+    for each series of `x` and each group of samples (e.g. years)
+
+    This gives the full load duration curves, on a fixed set of power levels,
+    with one vectorized histogram (`np.bincount`) for all the groups
+    and series. Masked (or NaN) data is not counted.
+
+    Parameters
+    ----------
+    x : 1D or 2D array (possibly masked)
+        power series (2D: one series per column)
+    levels : sorted 1D array
+        power levels (bin edges)
+    groups : 1D int array, optional
+        group index (0 to nb_groups-1) of each sample [default: one group]
+    nb_groups : int, optional
+        number of groups [default: groups.max()+1]
+    samples_per_hour : int
+        number of samples per hour (4 for 15 minutes data)
+
+    Returns
+    -------
+    hours : array of shape (nb_groups, len(levels), nb_columns)
+        (1D `x`: (nb_groups, len(levels))) duration of the power
+        above or equal to each level
+    valid_hours : array of shape (nb_groups, nb_columns)
+        (1D `x`: (nb_groups,)) duration of the valid data
+    '''
+    values = _valid_columns(x)
+    n, nb_columns = values.shape
+    levels = np.asarray(levels, dtype=float)
+    if groups is None:
+        groups = np.zeros(n, dtype=int)
+    groups = np.asarray(groups)
+    if nb_groups is None:
+        nb_groups = groups.max() + 1 if n else 0
+    valid = ~np.isnan(values)
+    # bin k: levels[k-1] <= value < levels[k] (bin 0: below levels[0])
+    bins = np.searchsorted(levels, np.where(valid, values, -np.inf),
+                           side='right')
+    nb_bins = len(levels) + 1
+    index = (groups[:,None]*nb_columns + np.arange(nb_columns))*nb_bins + bins
+    counts = np.bincount(index[valid], minlength=nb_groups*nb_columns*nb_bins)
+    counts = counts.reshape(nb_groups, nb_columns, nb_bins)
+    # number of samples above each level (reverse cumulative sum):
+    above = counts[:,:,::-1].cumsum(axis=2)[:,:,::-1][:,:,1:]
+    hours = above.transpose(0,2,1)/samples_per_hour
+    valid_hours = counts.sum(axis=2)/samples_per_hour
+    if np.ndim(x) == 1:
+        hours, valid_hours = hours[:,:,0], valid_hours[:,0]
+    return hours, valid_hours
+
+class LoadDurationCurves(object):
+    '''yearly load duration curves of the columns of a store,
+    with a cache of the results per (column, year)
+
+    Parameters
+    ----------
+    store : `RTE_eCO2mix_load.Store`
+        the data (or any object with the `timestamp`, `row_range`
+        and `masked` methods)
+    samples_per_hour : int
+        number of samples per hour (4 for 15 minutes data)
+    memo : `RTE_eCO2mix_cache.Memo`, optional
+        disk cache of the results of each year, keyed by the content
+        of its data (kept between runs)
+    '''
+    def __init__(self, store, samples_per_hour=4, memo=None):
+        self.store = store
+        self.samples_per_hour = samples_per_hour
+        self.memo = memo
+        self._cache = {}
+
+    def year_range(self, year):
+        '''slice of the rows of `year` (from the date index of the store)'''
+        return self.store.row_range('%d-01-01' % year, '%d-01-01' % (year+1))
+
+    def year_hours(self, year):
+        '''number of hours in `year`'''
+        days = (np.datetime64('%d-01-01' % (year+1)) -
+                np.datetime64('%d-01-01' % year)).astype(int)
+        return days*24
+
+    def complete_years(self):
+        '''years whose data covers the full year'''
+        t = self.store.timestamp()
+        if len(t) == 0:
+            return []
+        first, last = t[[0,-1]].astype('datetime64[Y]').astype(int) + 1970
+        complete = []
+        for y in range(first, last+1):
+            rows = self.year_range(y)
+            if rows.stop - rows.start >= self.year_hours(y)*self.samples_per_hour:
+                complete.append(y)
+        return complete
+
+    def _cached(self, label, years, key, compute):
+        '''results for each year, from the cache or computed (in one batch)
+        for the missing years by `compute(label, missing_years)`'''
+        missing = [y for y in years
+                   if key not in self._cache.get((label, y), {})]
+        if missing:
+            for y, result in zip(missing, compute(label, missing)):
+                self._cache.setdefault((label, y), {})[key] = result
+        return [self._cache[(label, y)][key] for y in years]
+
+    def points(self, label, years, hours, missing='drop'):
+        '''power of column `label` exceeded during `hours` hours, each year
+
+        Returns
+        -------
+        points : masked array of shape (len(years), len(hours))
+        (see `load_duration_points`)
+        '''
+        hours = tuple(np.atleast_1d(hours).tolist())
+        def compute(label, years):
+            column = self.store.masked(label)
+            return [_call(self.memo, load_duration_points,
+                          column[self.year_range(y)], hours,
+                          self.year_hours(y), missing, self.samples_per_hour)
+                    for y in years]
+        results = self._cached(label, years, ('points', hours, missing), compute)
+        return np.ma.vstack(results) if results else \
+               np.ma.masked_all((0, len(hours)))
+
+    def curves(self, label, years, levels):
+        '''load duration curves of column `label`, on fixed power `levels`
+
+        Returns
+        -------
+        hours : array of shape (len(years), len(levels))
+            duration of the power above each level, each year,
+            scaled to the full year when some data is missing
+        '''
+        levels = tuple(np.asarray(levels, dtype=float).tolist())
+        def compute(label, years):
+            column = self.store.masked(label)
+            ranges = [self.year_range(y) for y in years]
+            if self.memo is None:
+                # (all the years in one histogram)
+                rows = np.concatenate([np.arange(r.start, r.stop)
+                                       for r in ranges])
+                groups = np.repeat(np.arange(len(years)),
+                                   [r.stop - r.start for r in ranges])
+                hours, valid_hours = load_duration_histogram(column[rows],
+                        levels, groups, len(years), self.samples_per_hour)
+            else:
+                # (one histogram per year, memoized)
+                results = [self.memo(load_duration_histogram, column[r],
+                                     levels, None, 1, self.samples_per_hour)
+                           for r in ranges]
+                hours = np.array([h[0] for h, _ in results])
+                valid_hours = np.array([v[0] for _, v in results])
+            year_hours = np.array([self.year_hours(y) for y in years])
+            # (NaN durations for the years without valid data)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                scale = year_hours/valid_hours
+                return list(hours*scale[:,None])
+        results = self._cached(label, years, ('curves', levels), compute)
+        return np.array(results).reshape(len(years), len(levels))
+# end LoadDurationCurves
@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix columnar binary store
+
+a binary alternative to the big aggregated CSV file, which takes
+tens of seconds to be parsed again with `np.genfromtxt`.
+
+A store is a directory which contains:
+
+* "header.json": the list of columns, their data type and the number of rows
+* "timestamp.bin": int64 timestamps, in minutes since 1970-01-01 00:00
+  (local time, as in the daily files). This is the integer representation
+  of a numpy `datetime64[m]` array (see RTE_eCO2mix_time.py for the
+  DST transition days and the conversion to UTC).
+* "colXX.bin": one typed array per column (XX is the column index
+  in the header), in MW (or g/kWh for CO2 content)
+* "colXX_valid.bin": one boolean validity mask per column
+  (False when the data is not available: empty or "ND" in the daily files)
+* "colXX_flags.bin" (optional): one uint8 quality flags bitmask per column
+  (see RTE_eCO2mix_quality.py)
+
+All the binary files are raw arrays in native byte order,
+so that they can be appended day by day and memory-mapped at once.
+
+A store written by an incremental aggregation also contains a
+"manifest.json" file which records, for each day, the signature
+of its daily file (size, mtime and SHA-1 hash) and its rows in the store.
+It may also contain a rollup cube: "rollup.json" and "rollup_*.bin" files
+(see RTE_eCO2mix_rollup.py).
+"""
+from __future__ import print_function, division
+
+import os.path, io, json, hashlib
+from itertools import chain
+import numpy as np
+
+from RTE_eCO2mix_time import day_timestamps
+
+store_version = 1
+
+# Data type of the value columns (éCO2mix data are integers, in MW)
+value_dtype = 'int32'
+timestamp_dtype = 'int64'
+valid_dtype = 'bool'
+flags_dtype = 'uint8'
+
+header_filename = 'header.json'
+timestamp_filename = 'timestamp.bin'
+column_filename = 'col%02d.bin'
+valid_filename = 'col%02d_valid.bin'
+flags_filename = 'col%02d_flags.bin'
+manifest_filename = 'manifest.json'
+
+def read_json(store_dir, filename):
+    '''read one of the JSON files of a store'''
+    with io.open(os.path.join(store_dir, filename), encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json(store_dir, filename, content):
+    '''write one of the JSON files of a store'''
+    with io.open(os.path.join(store_dir, filename), 'w',
+                 encoding='utf-8') as out:
+        out.write(json.dumps(content, ensure_ascii=False, indent=1,
+                             sort_keys=True))
+
+def read_manifest(store_dir):
+    '''manifest of the daily files aggregated in a store
+    (empty dict if the store has no manifest)
+    '''
+    if not os.path.exists(os.path.join(store_dir, manifest_filename)):
+        return {}
+    return read_json(store_dir, manifest_filename)
+
+def file_signature(filename, sha1=True):
+    '''signature of a daily file: dict with its 'size', 'mtime'
+    and (optionally) the 'sha1' hash of its content'''
+    stat = os.stat(filename)
+    signature = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if sha1:
+        with open(filename, 'rb') as f:
+            signature['sha1'] = hashlib.sha1(f.read()).hexdigest()
+    return signature
+
+def _open_binary(path, nb_rows, itemsize):
+    '''open a binary file of the store for writing, keeping its `nb_rows`
+    first rows (the following ones are truncated)'''
+    if nb_rows == 0:
+        return open(path, 'wb')
+    f = open(path, 'r+b')
+    f.truncate(nb_rows*itemsize)
+    f.seek(0, os.SEEK_END)
+    return f
+
+class StoreWriter(object):
+    '''writes a columnar binary store, block after block
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store (created if needed)
+    columns : list of str
+        labels of the value columns
+    nb_rows : int, optional
+        number of rows to keep from an existing store: new blocks are
+        appended after them [default to 0: a new store is written]
+    flags : bool, optional
+        whether quality flags are written with each block [default to False]
+    '''
+    def __init__(self, store_dir, columns, nb_rows=0, flags=False):
+        self.store_dir = store_dir
+        self.columns = list(columns)
+        self.nb_rows = nb_rows
+        self.flags = flags
+        if not os.path.isdir(store_dir):
+            os.makedirs(store_dir)
+        if nb_rows > 0:
+            header = read_json(store_dir, header_filename)
+            if header['columns'] != self.columns:
+                raise ValueError('columns of store %s differ from %s' %\
+                                 (store_dir, self.columns))
+            if header['nb_rows'] < nb_rows:
+                raise ValueError('store %s has only %d rows (%d requested)' %\
+                                 (store_dir, header['nb_rows'], nb_rows))
+            if flags and 'flags_dtype' not in header:
+                raise ValueError('store %s has no quality flags' % store_dir)
+        path = lambda name: os.path.join(store_dir, name)
+        itemsize = lambda dtype: np.dtype(dtype).itemsize
+        self._timestamp_file = _open_binary(path(timestamp_filename), nb_rows,
+                                            itemsize(timestamp_dtype))
+        self._column_files = [_open_binary(path(column_filename % j), nb_rows,
+                                           itemsize(value_dtype))
+                              for j in range(len(self.columns))]
+        self._valid_files = [_open_binary(path(valid_filename % j), nb_rows,
+                                          itemsize(valid_dtype))
+                             for j in range(len(self.columns))]
+        self._flags_files = []
+        if flags:
+            self._flags_files = [_open_binary(path(flags_filename % j),
+                                              nb_rows, itemsize(flags_dtype))
+                                 for j in range(len(self.columns))]
+
+    def append(self, timestamps, values, valid, flags=None):
+        '''append a block of rows to the store
+
+        Parameters
+        ----------
+        timestamps : int64 array of shape (n,)
+        values : array of shape (n, nb_columns)
+        valid : bool array of shape (n, nb_columns)
+        flags : uint8 array of shape (n, nb_columns)
+            quality flags (only if the store is written with flags)
+        '''
+        timestamps = np.asarray(timestamps, dtype=timestamp_dtype)
+        values = np.asarray(values, dtype=value_dtype)
+        valid = np.asarray(valid, dtype=valid_dtype)
+        n = len(timestamps)
+        assert values.shape == (n, len(self.columns))
+        assert valid.shape == values.shape
+        timestamps.tofile(self._timestamp_file)
+        for j in range(len(self.columns)):
+            np.ascontiguousarray(values[:,j]).tofile(self._column_files[j])
+            np.ascontiguousarray(valid[:,j]).tofile(self._valid_files[j])
+        if self.flags:
+            flags = np.asarray(flags, dtype=flags_dtype)
+            assert flags.shape == values.shape
+            for j in range(len(self.columns)):
+                np.ascontiguousarray(flags[:,j]).tofile(self._flags_files[j])
+        self.nb_rows += n
+
+    def close(self):
+        '''flush the binary files and write the store header'''
+        for f in [self._timestamp_file] + self._column_files + \
+                 self._valid_files + self._flags_files:
+            f.close()
+        header = {'version': store_version,
+                  'nb_rows': self.nb_rows,
+                  'columns': self.columns,
+                  'timestamp_dtype': timestamp_dtype,
+                  'value_dtype': value_dtype,
+                  'valid_dtype': valid_dtype}
+        if self.flags:
+            header['flags_dtype'] = flags_dtype
+        write_json(self.store_dir, header_filename, header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+# end StoreWriter
+
+def patch_store(store_dir, row, values, valid, flags=None):
+    '''overwrite the values and validity masks of an existing store,
+    starting at `row` (timestamps are left unchanged)
+    
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store
+    row : int
+        index of the first row to overwrite
+    values : array of shape (n, nb_columns)
+    valid : bool array of shape (n, nb_columns)
+    flags : uint8 array of shape (n, nb_columns), optional
+        quality flags (written only if the store has flags)
+    '''
+    values = np.asarray(values, dtype=value_dtype)
+    valid = np.asarray(valid, dtype=valid_dtype)
+    header = read_json(store_dir, header_filename)
+    if row + len(values) > header['nb_rows']:
+        raise ValueError('cannot patch rows %d to %d of store %s (%d rows)' %\
+                         (row, row+len(values), store_dir, header['nb_rows']))
+    arrays = [(column_filename, values), (valid_filename, valid)]
+    if flags is not None and 'flags_dtype' in header:
+        arrays.append((flags_filename, np.asarray(flags, dtype=flags_dtype)))
+    for j in range(values.shape[1]):
+        for filename, array in [(filename % j, array[:,j])
+                                for filename, array in arrays]:
+            with open(os.path.join(store_dir, filename), 'r+b') as f:
+                f.seek(row*array.itemsize)
+                np.ascontiguousarray(array).tofile(f)
+
+def write_store(store_dir, day_blocks, columns):
+    '''write daily data blocks into a columnar binary store
+
+    Parameters
+    ----------
+    store_dir : str
+        directory of the store
+    day_blocks : iterable of (day, values, valid) tuples
+        as yielded by `RTE_eCO2mix_aggregate.reordered_day_range`,
+        or (day, values, valid, flags) tuples (the store is then written
+        with quality flags)
+    columns : list of str
+        labels of the value columns
+
+    Returns
+    -------
+    nb_rows : int
+        number of rows written
+    '''
+    day_blocks = iter(day_blocks)
+    first_block = next(day_blocks, None)
+    if first_block is not None:
+        day_blocks = chain([first_block], day_blocks)
+    with_flags = first_block is not None and len(first_block) == 4
+    with StoreWriter(store_dir, columns, flags=with_flags) as writer:
+        for block in day_blocks:
+            day, values, valid = block[:3]
+            writer.append(day_timestamps(day, len(values)), values, valid,
+                          *block[3:])
+    return writer.nb_rows
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: UTF-8 -*-
+""" RTE éCO2mix timestamps
+
+vectorized timestamps of the éCO2mix data, without Python datetime objects:
+timestamps are int64 numbers of minutes since 1970-01-01 00:00
+(i.e. the integer representation of numpy `datetime64[m]` arrays).
+
+The daily files are in French local time (Europe/Paris: CET, UTC+1 in winter,
+CEST, UTC+2 in summer), with one data line every 15 minutes:
+
+* 96 lines on a normal day,
+* 92 lines on the day of the switch to summer time (last Sunday of March:
+  the local times from 02:00 to 02:45 don't exist),
+* 100 lines on the day of the switch to winter time (last Sunday of October:
+  the local times from 02:00 to 02:45 occur twice).
+
+Stored timestamps are local times (as in the daily files), and are converted
+to UTC on demand (`local_to_utc`).
+"""
+from __future__ import print_function, division
+
+import datetime as dt
+import numpy as np
+
+# Time step of the data lines, in minutes
+time_step = 15
+# Number of data lines of a normal day, and of the DST transition days
+rows_per_day = 24*60//time_step
+spring_rows = rows_per_day - 60//time_step
+autumn_rows = rows_per_day + 60//time_step
+
+# UTC offset of French local time, in minutes (winter, summer)
+winter_offset = 60
+summer_offset = 120
+
+def day_minutes(nb_rows=rows_per_day):
+    '''local time of each data line of a day with `nb_rows` lines,
+    in minutes since midnight
+
+    Raises
+    ------
+    ValueError if `nb_rows` is not 96, or 92 or 100 (DST transition days)
+    '''
+    minutes = time_step*np.arange(rows_per_day, dtype=np.int64)
+    dst_hour = (minutes >= 2*60) & (minutes < 3*60)
+    if nb_rows == rows_per_day:
+        return minutes
+    elif nb_rows == spring_rows:
+        return minutes[~dst_hour]
+    elif nb_rows == autumn_rows:
+        return np.concatenate([minutes[:3*60//time_step],
+                               minutes[dst_hour], minutes[3*60//time_step:]])
+    raise ValueError('a day has %d, %d or %d data lines, not %d' %\
+                     (rows_per_day, spring_rows, autumn_rows, nb_rows))
+
+def day_time_labels(nb_rows=rows_per_day):
+    '''time labels "HH:MM" of the data lines of a day with `nb_rows` lines
+    (see `day_minutes`)'''
+    minutes = day_minutes(nb_rows)
+    return np.array(['%.2d:%.2d' % (m//60, m%60) for m in minutes.tolist()])
+
+def dst_rows(day):
+    '''expected number of data lines of `day`, if the daily file accounts
+    for the DST transitions (92 or 100 lines on the transition days)'''
+    summer_start, summer_end = dst_transition_days(day.year)
+    if day == summer_start:
+        return spring_rows
+    if day == summer_end:
+        return autumn_rows
+    return rows_per_day
+
+def check_day_rows(day, nb_rows):
+    '''check the number of data lines of `day`: 96, or the number of lines
+    of a DST transition day (see `dst_rows`)
+
+    Raises
+    ------
+    ValueError if `nb_rows` is not valid for `day`
+    '''
+    if nb_rows != rows_per_day and nb_rows != dst_rows(day):
+        raise ValueError('day %s should have %d data lines, not %d' %\
+                         (day.isoformat(), dst_rows(day), nb_rows))
+
+def day_timestamps(day, nb_rows=rows_per_day):
+    '''local timestamps of the `nb_rows` data lines of `day`
+    (see `day_minutes`), in minutes since 1970-01-01 (int64)
+    '''
+    t0 = np.datetime64(day.isoformat(), 'm').astype(np.int64)
+    return t0 + day_minutes(nb_rows)
+
+def format_timestamps(timestamps):
+    '''ISO 8601 strings "YYYY-MM-DDTHH:MM:SS" of int64 `timestamps`
+    (vectorized equivalent of `datetime.isoformat`)'''
+    t = np.asarray(timestamps).astype(np.int64).astype('datetime64[m]')
+    return np.datetime_as_string(t.astype('datetime64[s]'))
+
+### Local time / UTC conversions ###############################################
+
+def dst_transition_days(year):
+    '''days of the switch to summer time and back to winter time
+    (last Sundays of March and October, EU rules)'''
+    days = []
+    for month in (3, 10):
+        last_day = dt.date(year, month, 31)
+        days.append(last_day - dt.timedelta((last_day.weekday() - 6) % 7))
+    return tuple(days)
+
+def _dst_transitions(years):
+    '''UTC timestamps of the start and end of summer time, for each year
+    (at 01:00 UTC)'''
+    starts, ends = [], []
+    for year in years:
+        summer_start, summer_end = dst_transition_days(int(year))
+        starts.append(day_timestamps(summer_start, rows_per_day)[0] + 60)
+        ends.append(day_timestamps(summer_end, rows_per_day)[0] + 60)
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+def utc_offset(utc):
+    '''UTC offset of French local time (in minutes) at UTC times `utc`'''
+    utc = np.asarray(utc).astype('datetime64[m]').astype(np.int64)
+    years = utc.astype('datetime64[m]').astype('datetime64[Y]').astype(int) + 1970
+    year_list = np.unique(years)
+    starts, ends = _dst_transitions(year_list)
+    k = np.searchsorted(year_list, years)
+    summer = (utc >= starts[k]) & (utc < ends[k])
+    return np.where(summer, summer_offset, winter_offset)
+
+def utc_to_local(utc):
+    '''French local timestamps (int64 minutes) of UTC timestamps `utc`'''
+    utc = np.asarray(utc).astype('datetime64[m]').astype(np.int64)
+    return utc + utc_offset(utc)
+
+def local_to_utc(local, ambiguous='order'):
+    '''UTC timestamps (int64 minutes) of French local timestamps `local`
+
+    Parameters
+    ----------
+    local : int64 or datetime64[m] array
+        local timestamps
+    ambiguous : str
+        how to convert the local times which occur twice (from 02:00 to 02:45
+        on the day of the switch to winter time):
+
+        * 'order': `local` is in chronological order, as in a data file
+          or a store: a time which repeats a previous one is in winter time
+        * 'summer' or 'winter': always in summer (or winter) time
+
+    Raises
+    ------
+    ValueError for local times which don't exist (from 02:00 to 02:45
+    on the day of the switch to summer time)
+    '''
+    local = np.asarray(local).astype('datetime64[m]').astype(np.int64)
+    utc_summer = local - summer_offset
+    utc_winter = local - winter_offset
+    is_summer = utc_to_local(utc_summer) == local
+    is_winter = utc_to_local(utc_winter) == local
+    if not (is_summer | is_winter).all():
+        raise ValueError('local time %s does not exist (switch to summer time)'
+                         % format_timestamps(local[~(is_summer | is_winter)][0]))
+    both = is_summer & is_winter
+    if ambiguous == 'order':
+        previous_max = np.empty_like(local)
+        previous_max[:1] = np.iinfo(np.int64).min
+        np.maximum.accumulate(local[:-1], out=previous_max[1:])
+        is_summer = is_summer & ~(both & (previous_max >= local))
+    elif ambiguous == 'winter':
+        is_summer = is_summer & ~both
+    elif ambiguous != 'summer':
+        raise ValueError('unknown ambiguous time policy "%s"' % ambiguous)
+    return np.where(is_summer, utc_summer, utc_winter)
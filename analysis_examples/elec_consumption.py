@@ -14,21 +14,25 @@ from datetime import date, timedelta
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
-
-# Which data file to load
-fname = 'RTE_eCO2mix_2000-06-24_2012-02-19.csv'
+import sys, os.path
+# Access the loader module in the parent directory:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from RTE_eCO2mix_load import Store
+from RTE_eCO2mix_stats import chunked_running_records
+from RTE_eCO2mix_cache import Memo
+from RTE_eCO2mix_rollup import Rollup
+
+# Which data store to load (see RTE_eCO2mix_aggregate.py)
+fname = 'RTE_eCO2mix_2000-06-24_2012-02-19.store'
 start_day = date(2000,6,24)
 
-# Load the data file (big) :
-data = np.genfromtxt(fname, delimiter=',',
-                     skip_header=1, usecols = range(1,12+1),
-                     missing='NA', usemask=True)
+# Open the data store (memory-mapped) :
+store = Store(fname)
 
-### Extract the data
-# Consumption data:
-consum15m = data[:,0]
-consum15m.mask[consum15m == 100] = True # Remove a bunch of wrong data
-consum15m = consum15m/1000 # Scale power from MW to GW
+### Extract the data
+# Consumption data (wrong data is masked by the loader):
+consum15m = store.masked(u'Consommation')
+consum15m = consum15m/1000 # Scale power from MW to GW
 
 # Time vector
 N15m = len(consum15m)
@@ -38,38 +42,18 @@ print('Electricity data loaded over %.1f years' % (N15m/4/24/365.25))
 
 ### Analysis: ##################################################################
 
-# Helper function
-def running_record(x, xmin, delta_min=0):
-    '''find the running record in the `x` vector
-    records values under xmin are skipped.
-    records closer than `delta_min` are skipped
-    returns (arg_records, records)
-    '''
-    arg_records = []
-    records = []
-    running_rec = xmin
-    for i in xrange(len(x)):
-        if x[i] > running_rec:
-            # a new record is found
-            # 1) check that the previous one is not too closer
-            if arg_records and i - arg_records[-1] < delta_min:
-                # Delete the previous record:
-                arg_records.pop(-1)
-                records.pop(-1)
-            # 2) Save the new record
-            running_rec = x[i]
-            arg_records.append(i)
-            records.append(running_rec)
-    return (arg_records, records)
-# end running_record()
-
-# Compute consumption records (at least 6 hours apart):
-P_min = 70 # GW
-(arg_records, records) = running_record(consum15m, P_min, delta_min = 6*4)
+# Compute consumption records (at least 6 hours apart), month by month,
+# the records of the unchanged months being read from the disk cache
+# (see RTE_eCO2mix_cache.py):
+P_min = 70 # GW
+(arg_records, records) = chunked_running_records(store, u'Consommation',
+                                                 P_min*1000, delta_min = 6*4,
+                                                 memo=Memo())
+records = records/1000 # GW
 print('Consumption records (peaks) above %d GW : %d' % (P_min, len(records)))
 
 for rec_idx, rec_value in zip(arg_records, records):
-    rec_day = start_day + timedelta(rec_idx//(4*24))
+    rec_day = start_day + timedelta(int(rec_idx//(4*24)))
     rec_time = (rec_idx % (4*24)) # counted in 15 minutes intervals
     rec_hour = rec_time // 4
     rec_minute = (rec_time % 4)*15
@@ -78,21 +62,15 @@ for rec_idx, rec_value in zip(arg_records, records):
            rec_day.strftime('%a'), rec_hour, rec_minute))
 
 
-### Compute some averages:
-# Daily averages
-consum1d = consum15m.reshape(-1,24*4).mean(axis=1)
-N1d = len(consum1d)
-t1d = np.arange(N1d, dtype=float)+ 1/2
-
-# Weekly averages:
-day_skip=2 # Skip 2 days to start on Monday 2000-06-26
-consum7d = consum1d[2:].reshape(-1,7).mean(axis=1)
-N7d = len(consum7d)
-t7d = np.arange(N7d, dtype=float)*7 + 7/2 + day_skip
-
-# Compute some percentiles statistics
-consum7d_min = consum15m[day_skip*24*4:].reshape(-1,7*24*4).min(axis=1)
-consum7d_max = consum15m[day_skip*24*4:].reshape(-1,7*24*4).max(axis=1)
+### Weekly statistics (precomputed in the rollup cube of the store):
+rollup = Rollup(fname)
+# Weeks start on Monday (time counted in days since start_day)
+week_start = rollup.period('week') - np.datetime64(start_day, 'm')
+t7d = week_start.astype(float)/(24*60) + 7/2
+# Weekly averages, min and max:
+consum7d = rollup.get('week', 'mean', u'Consommation')/1000
+consum7d_min = rollup.get('week', 'min', u'Consommation')/1000
+consum7d_max = rollup.get('week', 'max', u'Consommation')/1000
 
 ### Plot: ######################################################################
 plt.figure('electricity consumption')
@@ -15,11 +15,20 @@ from datetime import date, datetime, timedelta
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
+import sys, os.path
+# Access the loader module in the parent directory:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from RTE_eCO2mix_load import Store
+from RTE_eCO2mix_mix import production_mix
 
-# Which data file to load
-fname = 'RTE_eCO2mix_2010-07-08_2012-03-15.csv'
+# Which data store to load (see RTE_eCO2mix_aggregate.py)
+fname = 'RTE_eCO2mix_2010-07-08_2012-03-15.store'
 start_day = date(2010,7,8)
 
+# Columns of the data store, and their labels in the plot:
+prod_columns = [u'Nucléaire', u'Gaz',u'Charbon', u'Fioul + pointe',
+                u'Hydraulique', u'Eolien',
+                u'Autres', u'Solde']
 
 prod_headers = [u'Nucléaire', u'Gaz',u'Charbon', u'Fioul + pointe',
                 u'Hydraulique', u'Éolien',
@@ -28,39 +37,37 @@ prod_colors = ['#f5da00', '#ff8c04' ,'#ff5704','#d71818',
                '#015cfb','#03dd80',
                '#8303dd', '#353137']
 
-## Load the data file (big) :
-#data = np.genfromtxt(fname, delimiter=',',
-#                     skip_header=1, usecols = [1]+range(4,12),
-#                     missing='NA', usemask=True)
-#data /= 1000 # Scale power from MW to GW
-
-## Load the datetime column:
-#dtconv = lambda d: datetime.strptime(d,"%Y-%m-%dT%H:%M:%S")
-#d = np.loadtxt(fname, delimiter=',', usecols=[0], dtype=object,  skiprows=1, converters={0:dtconv})
-
-### Extract the data
-# Consumption data:
-consum = data[:,0]
-consum.mask[consum == 100] = True # Remove a bunch of wrong data
-# Production data
-prod = data[:,1:]
+## Load the data store (wrong data is masked by the loader) :
+store = Store(fname)
 N_prod = len(prod_headers)
-assert N_prod == prod.shape[1]
+assert N_prod == len(prod_columns)
+
+# Production mix of February 2012 (reading only this month):
+_, feb_prod = store.window(date(2012,2,1), date(2012,3,1), prod_columns)
+print('February 2012 average production mix (GW):')
+for header, P in zip(prod_headers, feb_prod.mean(axis=0)/1000):
+    print(' * %-16s %5.1f' % (header, P))
 
 # Column reordering: based on increasing std
-zoom = np.arange(550*24*4, 600*24*4)
-reordering = prod[zoom,:].std(axis=0).argsort()
+# (only the data of a zoom period is read, thanks to the date index of the store)
+_, zoom_prod = store.window(date(2012,1,8), date(2012,2,27), prod_columns)
+reordering = zoom_prod.std(axis=0).argsort()
 reordering = [6,0,1,2,5,3,4,7]
+prod_columns = [prod_columns[k] for k in reordering]
 prod_headers = [prod_headers[k] for k in reordering]
 prod_colors = [prod_colors[k] for k in reordering]
 
-prod = prod[:,reordering]
-# Cumulated (or stacked) production
-cumprod = prod.cumsum(axis=1)
+# Cumulated (or stacked) production, in the chosen order,
+# decimated to a bounded number of points (min/max envelope of the total
+# production), so that plotting several years stays fast:
+resolution = None # 15 min data, or 'hour', 'day', 'week'...
+nb_points = 2000 # about twice the plot width in pixels
+d, cumprod = production_mix(store, prod_columns, resolution=resolution,
+                            nb_points=nb_points)
+cumprod = cumprod/1000 # Scale power from MW to GW
 
 # Time vector
-N = len(consum)
-t = np.arange(N, dtype=float)/(24*4)
+t = (d - d[0])/np.timedelta64(1, 'D')
 
 ################################################################################
 # Plots
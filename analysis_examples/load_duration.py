@@ -18,36 +18,39 @@ Pierre Haessig — March 2012
 
 from __future__ import division, print_function
 
-from datetime import date, datetime, timedelta
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
+import sys, os.path
+# Access the loader module in the parent directory:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from RTE_eCO2mix_load import Store
+from RTE_eCO2mix_stats import LoadDurationCurves
+from RTE_eCO2mix_cache import Memo
 
-# Where to read:
-fname = 'RTE_eCO2mix_2000-06-24_2012-02-19.csv'
+# Where to read (see RTE_eCO2mix_aggregate.py):
+fname = 'RTE_eCO2mix_2000-06-24_2012-02-19.store'
 
-years_of_interest = range(2001,2012)
+years_of_interest = list(range(2001,2012))
 print('Load duration curve analysis over the %d - %d period' %\
       (years_of_interest[0], years_of_interest[-1]))
 
-# Load the datetime column:
-print('reading time data...')
-dtconv = lambda d: datetime.strptime(d,"%Y-%m-%dT%H:%M:%S")
-time = np.loadtxt(fname, delimiter=',', usecols=[0], dtype=object,  skiprows=1, converters={0:dtconv})
-
-# Load the consumption data, 15 minutes timestep :
-print('reading consumption data...')
-consum = np.genfromtxt(fname, delimiter=',',
-                     skip_header=1, usecols = [1],
-                     missing='NA', usemask=True)
-consum.mask[consum == 100] = True # Remove a bunch of wrong data
-consum /= 1000 # Scale power from MW to GW
-
-# Retreive the year:
-time_year = np.array([d.year for d in time])
-
-# Hours vector, with a 15 minutes time step
-hours = np.arange(366*24*4)/4
+store = Store(fname)
+# Load duration curves engine (wrong data is masked by the loader).
+# The results of each year are cached on disk,
+# and computed again only if the data of the year changed (see
+# RTE_eCO2mix_cache.py)
+ldc = LoadDurationCurves(store, memo=Memo())
+label = u'Consommation'
+consum = store.masked(label)
+
+# Power levels of the curves, every 100 MW (in MW). Unlike the former
+# version of this script (sorted series, with the missing data filled with
+# the median), the curves are histograms of the valid data, whose durations
+# are scaled to the full year:
+levels = np.arange(0, 110e3, 100)
+print('computing the load duration curves...')
+curves = ldc.curves(label, years_of_interest, levels)
 
 ################################################################################
 # Plot the load duration curves
@@ -63,36 +66,30 @@ fig.add_subplot(111, title = 'Load duration curve for France (%d - %d)' %\
                 axis_bgcolor='0.5',
                 xlim=(-100,9500), ylim=(0,110))
 
-# Compute some stats on the LDC
+# Compute some stats on the LDC (in GW), with the missing data filled
+# with the median (as in the former version of this script)
 hours_of_interest = np.array([0,2000,4000,8000])
-typical_power_min = np.zeros(len(hours_of_interest))+np.nan
-typical_power_max = np.zeros(len(hours_of_interest))+np.nan
+typical_power = ldc.points(label, years_of_interest, hours_of_interest,
+                           missing='median')/1000
+typical_power_min = typical_power.min(axis=0)
+typical_power_max = typical_power.max(axis=0)
 
-# Compute and plot the LDC for each year
+# Plot the LDC for each year
 for k,y in enumerate(years_of_interest):
-    year_consum = consum[time_year==y]
-    n_missing = year_consum.mask.sum()
-    # Remove NaNs by padding median values:
-    year_consum = year_consum.filled(fill_value = np.median(year_consum))
-    # Sort the load power:
-    sorted_consum = np.sort(year_consum)
-    sorted_consum = sorted_consum[::-1] # Reverse the order
-    L = len(sorted_consum)
+    L = ldc.year_hours(y)
+    n_missing = consum[ldc.year_range(y)].mask.sum()
     print('Year %d: %d days, %d missing data' %\
-          (y, L/24/4 ,n_missing))
-    # Plot
+          (y, L/24 ,n_missing))
+    # max and min power (in GW):
+    P_max, P_min = ldc.points(label, [y], [0, L-1/4], missing='median')[0]/1000
+    # Plot (the levels below the min are not shown)
     color = cm(k/(len(years_of_interest)-1))
-    plt.plot(hours[0:L], sorted_consum, label='year %d' % y, color=color)
+    above_min = levels/1000 >= np.floor(P_min*10)/10
+    plt.plot(curves[k][above_min], levels[above_min]/1000,
+             label='year %d' % y, color=color)
     # Add the max and the min
-    plt.plot(0, sorted_consum[0], 'D', color=color )
-    plt.plot((L-1)/4, sorted_consum[-1], 'D', color=color )
-    
-    # Compute some stats
-    typical_power = sorted_consum[hours_of_interest*4]
-    typical_power_min = np.where(typical_power > typical_power_min,
-                                 typical_power_min, typical_power)
-    typical_power_max = np.where(typical_power < typical_power_max,
-                                 typical_power_max, typical_power)
+    plt.plot(0, P_max, 'D', color=color )
+    plt.plot(L-1/4, P_min, 'D', color=color )
 # Add some annotations
 for i, h in enumerate(hours_of_interest):
     Pmin = typical_power_min[i]
@@ -7,54 +7,53 @@ Pierre Haessig — July 2012
 """
 from __future__ import print_function, division
 
-from datetime import date, datetime, timedelta
+from datetime import date
 import numpy as np
-import scipy.signal as sig
 import matplotlib.pyplot as plt
 import matplotlib as mpl
-
-# Which data file to load
-fname = 'RTE_eCO2mix_2010-07-08_2012-03-15.csv'
+import sys, os.path
+# Access the loader module in the parent directory:
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from RTE_eCO2mix_load import Store
+from RTE_eCO2mix_stats import rolling_mean, load_duration_histogram
+from RTE_eCO2mix_cache import Memo
+
+# Which data store to load (see RTE_eCO2mix_aggregate.py)
+fname = 'RTE_eCO2mix_2010-07-08_2012-03-15.store'
 start_day = date(2010,7,8)
 
-
-prod_headers = [u'Nucléaire', u'Gaz',u'Charbon', u'Fioul + pointe',
-                u'Hydraulique', u'Éolien',
-                u'Autres', u'Import']
-wind_column = prod_headers.index(u'Éolien') # aka = 5
+wind_label = u'Eolien'
 wind_color = '#03dd80'
 
-### Load the data file (big) :
-data = np.genfromtxt(fname, delimiter=',',
-                     skip_header=1, usecols = [1]+range(4,12),
-                     missing='NA', usemask=True)
-data /= 1000 # Scale power from MW to GW
+### Open the data store (memory-mapped) :
+store = Store(fname)
 
-# Load the datetime column:
-dtconv = lambda d: datetime.strptime(d,"%Y-%m-%dT%H:%M:%S")
-d = np.loadtxt(fname, delimiter=',', usecols=[0], dtype=object,  skiprows=1, converters={0:dtconv})
+# Load the datetime column (datetime64 array):
+d = store.timestamp()
 
-### Extract the data
-# Consumption data:
-consum = data[:,0]
-consum.mask[consum == 100] = True # Remove a bunch of wrong data
+### Extract the data, scaled from MW to GW
+# Consumption data (wrong data is masked by the loader):
+consum = store.masked(u'Consommation')/1000
 # Production data
-prod = data[:,1+wind_column]
+prod = store.masked(wind_label)/1000
 
 
 # Time vector
 N = len(consum)
 t = np.arange(N, dtype=float)/(24*4)
 
+# Disk cache of the results, computed again only when the data changes
+# (see RTE_eCO2mix_cache.py)
+memo = Memo()
+
 ### Compute some running averages ###
-# fill in the blanks
-prod_filled = prod.filled(0)
+# (missing data is ignored)
 # average over 24 hours
-prod_d1 = sig.lfilter([1]*24*4, [24*4], prod_filled)
+prod_d1 = memo(rolling_mean, prod, 24*4)
 # average over 7 days
-prod_d7 = sig.lfilter([1]*24*4*7, [24*4*7], prod_filled)
+prod_d7 = memo(rolling_mean, prod, 24*4*7)
 # average over 30 days
-prod_d30 = sig.lfilter([1]*24*4*30, [24*4*30], prod_filled)
+prod_d30 = memo(rolling_mean, prod, 24*4*30)
 
 # Normalization, with respect to the rated wind power, which
 # increases along time.
@@ -62,7 +61,6 @@ prod_d30 = sig.lfilter([1]*24*4*30, [24*4*30], prod_filled)
 Pnom = 4. + t/t[-1]*2.5 # dummy model of a linear increase from 4 GW to 6 GW
 
 #prod /= Pnom
-#prod_filled /= Pnom
 #prod_d1 /= Pnom
 #prod_d7 /= Pnom
 #prod_d30 /= Pnom
@@ -81,7 +79,7 @@ fig.add_subplot(111, title='wind power production along time',
 #plt.plot(t-3.5, prod_d7, 'b-')
 #plt.plot(t-15, prod_d30, 'r-')
 
-td_d1 = timedelta(1) # 1 day
+td_d1 = np.timedelta64(24*60, 'm') # 1 day
 plt.fill_between(d, prod, color=wind_color, lw=0)
 plt.plot(d-td_d1//2, prod_d1, 'c-', label='24 hours avg power')
 plt.plot(d-7*td_d1//2, prod_d7, 'b-', label='7 days avg power')
@@ -96,10 +94,16 @@ fig = plt.figure('wind ldc')
 fig.add_subplot(111, title='wind power load duration curve',
                      xlabel='fraction of time (%)', ylabel='power (pu)')
 
-plt.plot(t/t[-1]*100, np.sort(prod_filled)[::-1], 'b-', label='15 min avg power')
-plt.plot(t/t[-1]*100, np.sort(prod_d1)[::-1], 'c-', label='24 hours avg power')
-plt.plot(t/t[-1]*100, np.sort(prod_d7)[::-1], 'g-', label='7 days avg power')
-plt.plot(t/t[-1]*100, np.sort(prod_d30)[::-1], 'r-', label='30 days avg power')
+# Duration above power levels (every 10 MW), for the 4 series at once:
+levels = np.arange(0, prod.max() + 0.01, 0.01)
+hours, valid_hours = memo(load_duration_histogram,
+    np.ma.column_stack([prod, prod_d1, prod_d7, prod_d30]), levels)
+time_fraction = hours[0]/valid_hours[0]*100 # shape (len(levels), 4)
+
+plt.plot(time_fraction[:,0], levels, 'b-', label='15 min avg power')
+plt.plot(time_fraction[:,1], levels, 'c-', label='24 hours avg power')
+plt.plot(time_fraction[:,2], levels, 'g-', label='7 days avg power')
+plt.plot(time_fraction[:,3], levels, 'r-', label='30 days avg power')
 plt.hlines(Pmean, 0,100, colors='r', linestyles='dashed', label='avg load')
 plt.legend(loc='upper right')
 